@@ -33,3 +33,27 @@ cp "$SCRIPTPATH/$RARITIES" "$SCRIPTPATH/bkups/$TS_RARITIES"
 NEXT_ID="next_id"
 TS_NEXT_ID="$timestamp-$NEXT_ID"
 cp "$SCRIPTPATH/$NEXT_ID" "$SCRIPTPATH/bkups/$TS_NEXT_ID"
+
+# The state database runs in WAL mode, so copy it with SQLite's online backup
+# rather than cp to get a consistent snapshot.
+STATE_DB="state.db"
+TS_STATE_DB="$timestamp-$STATE_DB"
+if [ -f "$SCRIPTPATH/$STATE_DB" ]; then
+    python3 -c "import sqlite3, sys; sqlite3.connect(sys.argv[1]).backup(sqlite3.connect(sys.argv[2]))" \
+        "$SCRIPTPATH/$STATE_DB" "$SCRIPTPATH/bkups/$TS_STATE_DB"
+fi
+
+# The issued combination index is a snapshot plus a log of the codes issued since
+ISSUED_INDEX="issued.npz"
+for FILE in "$ISSUED_INDEX" "$ISSUED_INDEX.log"; do
+    if [ -f "$SCRIPTPATH/$FILE" ]; then
+        cp "$SCRIPTPATH/$FILE" "$SCRIPTPATH/bkups/$timestamp-$FILE"
+    fi
+done
+
+# The rarity counts not yet flushed to the state database (one log per bot process)
+for FILE in "$SCRIPTPATH"/rarities.log*; do
+    if [ -f "$FILE" ]; then
+        cp "$FILE" "$SCRIPTPATH/bkups/$timestamp-$(basename "$FILE")"
+    fi
+done
@@ -0,0 +1,76 @@
+"""Benchmark the compositing backends on every frame in assets/frames.
+
+Run from the repository root:
+    python -m benchmarks.bench_compositing
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from src.artists import add_frame
+from src.compositing import COMPOSITORS
+from src.constants import ASSET_DIR, FRAME_DIR
+from src.frames import frame_cache
+
+
+def time_backend(image, frame_name: str, backend: str, repeat: int) -> float:
+    """Return the best wall time (seconds) of `repeat` add_frame calls."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        add_frame(image, frame_name, backend=backend)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def frames_equal(frames, others) -> bool:
+    """Whether two lists of frames have identical pixels."""
+    return all(
+        np.array_equal(np.asarray(a), np.asarray(b)) for a, b in zip(frames, others)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per backend.")
+    args = parser.parse_args()
+
+    image = Image.open(os.path.join(ASSET_DIR, "example/1.png"))
+    frame_names = sorted(f[:-4] for f in os.listdir(FRAME_DIR) if f.endswith(".gif"))
+    backends = list(COMPOSITORS)
+
+    columns = "".join(f"{b + ' (ms)':>14}" for b in backends)
+    print(f"{'frame':<20}{'frames':>8}{columns}{'speedup':>10}{'identical':>11}")
+    totals = {backend: 0.0 for backend in backends}
+    for frame_name in frame_names:
+        # Decode outside of the timed region; both backends share the cache
+        frame_asset = frame_cache.get(frame_name)
+        frame_asset.stack
+
+        times = {b: time_backend(image, frame_name, b, args.repeat) for b in backends}
+        outputs = [add_frame(image, frame_name, backend=b) for b in backends]
+        identical = all(
+            len(out) == len(outputs[0]) and frames_equal(out, outputs[0])
+            for out in outputs[1:]
+        )
+        for backend in backends:
+            totals[backend] += times[backend]
+
+        columns = "".join(f"{1000 * times[b]:>14.1f}" for b in backends)
+        speedup = times["pil"] / times["numpy"]
+        print(
+            f"{frame_name:<20}{len(frame_asset):>8}{columns}"
+            f"{speedup:>9.2f}x{str(identical):>11}"
+        )
+
+    columns = "".join(f"{1000 * totals[b]:>14.1f}" for b in backends)
+    speedup = totals["pil"] / totals["numpy"]
+    print(f"{'TOTAL':<20}{'':>8}{columns}{speedup:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
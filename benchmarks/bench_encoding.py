@@ -0,0 +1,60 @@
+"""Benchmark the GIF encoders on every frame in assets/frames.
+
+Reports the encode time and output size of each encoder. Run from the repository root:
+    python -m benchmarks.bench_encoding
+"""
+
+import argparse
+import io
+import os
+import time
+
+from PIL import Image
+
+from src.artists import add_frame
+from src.constants import ASSET_DIR, FRAME_DIR
+from src.encoders import GIF_ENCODERS, save_gif
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--encoders",
+        nargs="+",
+        default=list(GIF_ENCODERS),
+        choices=list(GIF_ENCODERS),
+        help="Encoders to compare.",
+    )
+    args = parser.parse_args()
+
+    image = Image.open(os.path.join(ASSET_DIR, "example/1.png"))
+    frame_names = sorted(f[:-4] for f in os.listdir(FRAME_DIR) if f.endswith(".gif"))
+    encoders = args.encoders
+
+    columns = "".join(f"{e + ' (s)':>14}{e + ' (KB)':>14}" for e in encoders)
+    print(f"{'frame':<20}{'frames':>8}{columns}")
+    totals = {encoder: [0.0, 0] for encoder in encoders}
+    for frame_name in frame_names:
+        nft_img = add_frame(image, frame_name)
+
+        row = f"{frame_name:<20}{len(nft_img):>8}"
+        for encoder in encoders:
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            save_gif(nft_img, buffer, encoder=encoder)
+            elapsed = time.perf_counter() - start
+            size = len(buffer.getvalue())
+
+            totals[encoder][0] += elapsed
+            totals[encoder][1] += size
+            row += f"{elapsed:>14.2f}{size // 1024:>14}"
+        print(row)
+
+    columns = "".join(
+        f"{totals[e][0]:>14.2f}{totals[e][1] // 1024:>14}" for e in encoders
+    )
+    print(f"{'TOTAL':<20}{'':>8}{columns}")
+
+
+if __name__ == "__main__":
+    main()
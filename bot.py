@@ -1,21 +1,44 @@
 # %%
 from datetime import datetime, date
+import asyncio
+import contextlib
 import json
 import os
-import shutil
 from typing import Tuple, List, Dict, Optional
 import discord
 from copy import deepcopy
 
-from openai import OpenAI
-
 import discord
 from discord.ext import commands
 from discord.abc import Messageable
 from dotenv import load_dotenv
-from src.constants import VALID_YEAR, OUT_DIR, START_WEEK
-from src.artists import add_frame
+from src.constants import (
+    VALID_YEAR,
+    OUT_DIR,
+    START_WEEK,
+    STATE_DB,
+    ANIMATED_WEBP,
+    DALLE_IMAGES_PER_MINUTE,
+    NFTS_PER_GIFT,
+    ISSUED_INDEX,
+    CLAIM_LOG,
+    RARITY_LOG,
+)
+from src.claims import ClaimJob, ClaimLog, get_claim_files, new_claim_id
+from src.generation import GenerationService
+from src.store import StateStore, open_store
+from src.aggregates import RarityAggregates, open_aggregates
+from src.responses import ResponseCache
+from src.jokes import JokeService
+from src.workers import (
+    RenderPool,
+    render_nft,
+    render_gift_nft,
+    render_gift_preview,
+)
 from src.msgs import (
+    asset_registry,
+    get_msg_assets,
     days_until_christmas,
     send_created_msg,
     send_eoe_msg,
@@ -26,27 +49,29 @@ from src.msgs import (
     send_not_bayesbrew_msg,
     send_error,
     send_success_msg,
-    send_rares_msg,
-    send_odds_msg,
+    send_success_text_msg,
+    render_rares_msg,
+    render_odds_msg,
+    send_bot_faq_msg,
+    send_web3_faq_msg,
     send_welcome_msg,
     send_joke_msg,
     send_join_msg,
 )
 from src.generators import (
     generate_dalle_description,
-    generate_dalle_art,
     generate_erc721_metadata,
     generate_example_art,
 )
 from src.rarity import (
-    sample_rarity_label,
-    sample_attributes,
-    sample_frame,
-    sample_rarity_label_uniform,
     get_rarity_pmf,
     get_rarity_labels,
 )
-from threading import Lock
+from src.sampler import loot_sampler
+from src.uniqueness import IssuedIndex, UniqueSampler
+from src.ledger import get_day_index
+from src.locks import LockManager
+from src.leases import LeaseSemaphore
 from PIL.Image import Image as ImgType
 
 # %% Initialization
@@ -54,29 +79,121 @@ from PIL.Image import Image as ImgType
 load_dotenv()
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 SIM_FLAG = bool(int(os.getenv("SIM_FLAG")))
+BATCH_FLAG = bool(int(os.getenv("BATCH_FLAG", "0")))
 
-# Initialize the dalle API
-openai_client = OpenAI()
+# Sharding (set by launcher.py): this process runs shards SHARD_IDS of SHARD_COUNT, and
+# shares its state with the other SHARD_PROCESSES - 1 processes
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i]
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES", "1"))
+SHARED = SHARD_PROCESSES > 1
 
 # Initialize the discord bot
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-help_command = commands.DefaultHelpCommand(no_category="Commands")
+
+
+class CachedHelpCommand(commands.DefaultHelpCommand):
+    """The default help command, but the bot-wide help pages are only built once."""
+
+    _pages = {}
+
+    async def send_bot_help(self, mapping):
+        # The pages only change if the commands do
+        key = tuple(
+            sorted(command.qualified_name for command in self.context.bot.commands)
+        )
+        if key not in self._pages:
+            await super().send_bot_help(mapping)
+            self._pages.clear()
+            self._pages[key] = list(self.paginator.pages)
+            return
+
+        destination = self.get_destination()
+        for page in self._pages[key]:
+            await destination.send(page)
+
+
+help_command = CachedHelpCommand(no_category="Commands")
 bot_description = "To be added to the game, contact @bayesbrew.\n\n\
                    To claim a gift, use the command: !claim"
-bot = commands.Bot(
+bot_options = dict(
     command_prefix="!",
     description=bot_description,
     help_command=help_command,
     intents=intents,
-    heartbeat_timeout=1000000000,
     case_insensitive=True,
 )
+if SHARD_COUNT is not None:
+    bot = commands.AutoShardedBot(
+        shard_ids=SHARD_IDS or None, shard_count=SHARD_COUNT, **bot_options
+    )
+else:
+    bot = commands.Bot(**bot_options)
+
+# The bot's state and services, opened by setup(). The render workers are spawned
+# processes that import this module as __mp_main__, so nothing is opened on import.
+generation_service: Optional[GenerationService] = None
+store: Optional[StateStore] = None
+rarity_aggregates: Optional[RarityAggregates] = None
+response_cache: Optional[ResponseCache] = None
+joke_service: Optional[JokeService] = None
+issued_index: Optional[IssuedIndex] = None
+unique_sampler: Optional[UniqueSampler] = None
+render_pool: Optional[RenderPool] = None
+render_slots: Optional[LeaseSemaphore] = None
+user_locks: Optional[LockManager] = None
+claim_log: Optional[ClaimLog] = None
+claims_resumed = False
+
+
+def setup():
+    """Open the bot's state and services."""
+    global generation_service, store, rarity_aggregates, response_cache, joke_service
+    global issued_index, unique_sampler, render_pool, render_slots, user_locks
+    global claim_log
+
+    # Initialize the dalle API (the processes split the account's rate limit)
+    generation_service = GenerationService(
+        images_per_minute=DALLE_IMAGES_PER_MINUTE / SHARD_PROCESSES
+    )
+
+    # Initialize the state store (each process writes its rarity counts behind its own
+    # log)
+    store = open_store(
+        STATE_DB,
+        shared=SHARED,
+        counter_log=f"{RARITY_LOG}.{SHARD_INDEX}" if SHARED else RARITY_LOG,
+    )
+    rarity_aggregates = open_aggregates(store, get_rarity_labels())
+
+    # Initialize the cache of rendered responses for the read-only commands
+    response_cache = ResponseCache()
+
+    # Initialize the jokes
+    joke_service = JokeService()
 
-# Initialize the mutex locks
-history_mutex = Lock()
-rarities_mutex = Lock()
+    # Initialize the index of issued attribute combinations
+    issued_index = IssuedIndex(ISSUED_INDEX, shared=SHARED)
+    unique_sampler = UniqueSampler(issued_index)
+
+    # Initialize the render workers (the processes split the cores, and lease render
+    # slots from the state database so they never render more gifts at once than there
+    # are cores)
+    render_pool = RenderPool(
+        max_workers=max(1, (os.cpu_count() or 1) // SHARD_PROCESSES)
+    )
+    render_slots = LeaseSemaphore("render", os.cpu_count() or 1) if SHARED else None
+
+    # Initialize the per-user locks (a user's claims are serialized, other users' are
+    # not)
+    user_locks = LockManager()
+
+    # Initialize the log of the claims being gifted (resumed once the bot is ready)
+    claim_log = ClaimLog(f"{CLAIM_LOG}.{SHARD_INDEX}" if SHARED else CLAIM_LOG)
+    claim_log.compact()
 
 
 # %% Utility Functions
@@ -91,42 +208,33 @@ async def verification(ctx, username: str):
         await send_eoe_msg(ctx)
         raise RuntimeError("End of Event.")
 
-    history_mutex.acquire()
-    with open("history.json", "r") as f:
-        history = json.load(f)
-
     # Check that the user exists
-    if username not in history.keys():
+    if not store.has_user(username):
         await send_join_msg(ctx, username)
-        history_mutex.release()
         raise RuntimeError("Multi-claim.")
 
     # Check to see if this user has claimed a loot box today
-    year, week_num, day_num = date.today().isocalendar()
-    day_hash = hash((year, week_num, day_num))
-
-    if day_hash in history[username]:
+    if store.has_claimed(username, get_day_index()):
         await send_impish_msg(ctx)
-        history_mutex.release()
         raise RuntimeError("Multi-claim.")
 
-    # Otherwise, they are admirable!
-    # Update the dictionary notifying that they have claimed it today
-    if not SIM_FLAG:
-        history[username].append(day_hash)
 
-    # Make a copy just in case
-    shutil.copyfile("history.json", "tmp/history.json")
-    try:
-        with open("history.json", "w") as f:
-            json.dump(history, f)
-    except Exception as exc:
-        shutil.copyfile("history.json", "tmp/history.json")
-        history_mutex.release()
-        raise exc
+async def commit_claim(ctx, username: str, rarity_label: str):
+    """Record today's claim and increment the user's rarity counter in one transaction."""
+    username = username.lower()
 
-    # Release the mutex and return
-    history_mutex.release()
+    # The verification check and this write are separate, so a concurrent claim
+    # may have beaten us to it. The store only inserts the claim once.
+    if not store.record_claim(
+        username, get_day_index(), rarity_label, record_history=not SIM_FLAG
+    ):
+        await send_impish_msg(ctx)
+        raise RuntimeError("Multi-claim.")
+
+
+def get_num_nfts() -> int:
+    """Get the number of NFTs in each gift."""
+    return NFTS_PER_GIFT if BATCH_FLAG else 1
 
 
 def get_week_num():
@@ -135,22 +243,6 @@ def get_week_num():
     return week_num - START_WEEK
 
 
-def save_nft(nft_img: List[ImgType], filename: str):
-    """Save the NFT gif.
-
-    This function is slow and should run in a separate thread.
-    """
-    nft_img[0].save(
-        filename,
-        save_all=True,
-        append_images=nft_img[1:],
-        optimize=True,
-        duration=10,
-        loop=0,
-    )
-    return
-
-
 def save_metadata(metadata: List[ImgType], filename: str):
     """Save the metadata json.
 
@@ -161,34 +253,13 @@ def save_metadata(metadata: List[ImgType], filename: str):
     return
 
 
-def increment_rarity(username: str, rarity_label: str):
-    """Increment the rarity statistic for this user."""
-    rarities_mutex.acquire()
-    with open("rarities.json", "r") as f:
-        rarities = json.load(f)
-
-    rarities[username][rarity_label] += 1
-
-    with open("rarities.json", "w") as f:
-        json.dump(rarities, f)
-    rarities_mutex.release()
-
-
-def decrement_rarity(username: str, rarity_label: str):
-    """Decrement the rarity statistic for this user."""
-    rarities_mutex.acquire()
-    with open("rarities.json", "r") as f:
-        rarities = json.load(f)
-
-    rarities[username][rarity_label] -= 1
-
-    with open("rarities.json", "w") as f:
-        json.dump(rarities, f)
-    rarities_mutex.release()
-
-
-async def _recover(ctx: Messageable, username: str, rarity_label: Optional[str]):
-    """Recover a user's daily gift.
+async def _recover(
+    ctx: Messageable,
+    username: str,
+    rarity_label: Optional[str],
+    day_index: Optional[int] = None,
+):
+    """Recover a user's daily gift (today's, unless day_index is given).
 
     If rarity_level is None, the rarity statistics will also be adjusted.
     """
@@ -200,109 +271,260 @@ async def _recover(ctx: Messageable, username: str, rarity_label: Optional[str])
         await send_eoe_msg(ctx)
         raise RuntimeError("End of Event.")
 
-    history_mutex.acquire()
-    with open("history.json", "r") as f:
-        history = json.load(f)
-
-    # Check to see if this user has claimed a loot box today
-    year, week_num, day_num = date.today().isocalendar()
-    day_hash = hash((year, week_num, day_num))
-
-    # Check to see if this user has claimed a loot box today
-    if day_hash in history[username]:
-        history[username].remove(day_hash)
-
-        # Make a copy just in case
-        shutil.copyfile("history.json", "tmp/history.json")
-        try:
-            with open("history.json", "w") as f:
-                json.dump(history, f)
-        except Exception as exc:
-            shutil.copyfile("history.json", "tmp/history.json")
-            history_mutex.release()
-            raise exc
-
-    history_mutex.release()
-
-    # ========================== #
-    # Rarity
-    # ========================== #
+    # Remove today's claim and its rarity count together
     if rarity_label is not None:
         print(f"Decrementing rarity for {username}, {rarity_label}")
-        decrement_rarity(username, rarity_label)
+    if day_index is None:
+        day_index = get_day_index()
+    store.revoke_claim(username, day_index, rarity_label)
 
     await send_recovered_msg(ctx, username)
 
 
-async def _gift_util(
-    ctx: Messageable,
+async def _generate_art(
     username: str,
-    rarity_label: str,
     description: str,
-    metadata: Dict[str, str],
+    img_file: str,
+    reuse: bool = False,
+    variant: int = 0,
+) -> Tuple[ImgType, str]:
+    """Generate the artwork for one NFT.
+
+    If reuse is True, previously generated art for the same description is reused.
+    """
+    if SIM_FLAG:
+        # Generate some example art so we don't have to query Dalle
+        return generate_example_art(img_file), description
+
+    # Generate the art using Dalle (queued, rate limited and retried by the service)
+    return await generation_service.generate(
+        username, description, img_file, reuse=reuse, variant=variant
+    )
+
+
+class ChannelContext:
+    """Stands in for the command context when a claim is resumed after a restart."""
+
+    def __init__(self, channel: Messageable):
+        self.channel = channel
+
+    async def send(self, *args, **kwargs):
+        return await self.channel.send(*args, **kwargs)
+
+
+@contextlib.asynccontextmanager
+async def _claim_guard(
+    ctx: Messageable, username: str, rarity_label: str, codes: List[int]
 ):
-    start = datetime.now()
+    """Give a recorded claim back if it fails before its job is logged.
 
-    # Send the admirable message
-    await send_admirable_msg(ctx, username, rarity_label, description)
+    Wrap everything between recording the claim and logging its job, since nothing
+    would resume or roll back the claim otherwise.
+    """
+    try:
+        yield
+    except Exception:
+        unique_sampler.release(codes)
+        await _recover(ctx, username, rarity_label)
+        raise
 
+
+def _log_claim(
+    ctx: Messageable,
+    username: str,
+    rarity_label: str,
+    descriptions: List[str],
+    metadatas: List[Dict[str, str]],
+    reuse: bool = False,
+    codes: Optional[List[int]] = None,
+) -> ClaimJob:
+    """Log a recorded claim with everything needed to finish it.
+
+    Gifts of NFTS_PER_GIFT NFTs share a frame and are sent as a single 2x2 preview.
+    If reuse is True, cached art is used instead of generating it again.
+    The issued combination `codes` of the NFTs are released if the gift fails.
+    Call this in the user's lock, before any network call, so a crash or a Discord
+    error afterwards can only leave a claim that is resumed or given back.
+    """
     # ============================================ #
     # Setup the unique directory structure
     # ============================================ #
     datestr = datetime.today().strftime("%Y-%m-%d")
+    files = get_claim_files(
+        OUT_DIR, username, datestr, len(descriptions), ANIMATED_WEBP
+    )
+
+    job = ClaimJob(
+        claim_id=new_claim_id(username),
+        username=username,
+        day_index=get_day_index(),
+        rarity_label=rarity_label,
+        descriptions=descriptions,
+        metadatas=metadatas,
+        frame_name=loot_sampler.sample_frame(rarity_label),
+        channel_id=ctx.channel.id,
+        files=files,
+        reuse=reuse,
+        codes=codes or [],
+    )
+    claim_log.start(job)
+    return job
+
+
+async def _gift_util(ctx: Messageable, job: ClaimJob):
+    """Generate, frame and send a logged gift of one NFT per description."""
+    # Send the admirable message (a failure here must not strand the logged claim)
+    description = "\n\n".join(dict.fromkeys(job.descriptions))
+    try:
+        await send_admirable_msg(ctx, job.username, job.rarity_label, description)
+    except discord.DiscordException as exc:
+        print(f"Could not send the admirable message: {exc}")
+
+    await _run_claim(ctx, job)
 
-    # Generate unique paths
-    uniq_dir = os.path.join(OUT_DIR, username)
-    os.makedirs(uniq_dir, exist_ok=True)
 
-    img_file = os.path.join(uniq_dir, f"{datestr}.png")
-    nft_file = os.path.join(uniq_dir, f"{datestr}.gif")
-    data_file = os.path.join(uniq_dir, f"{datestr}.json")
+def render_slot():
+    """Hold one of the render slots shared by the shard processes (if sharded)."""
+    if render_slots is None:
+        return contextlib.nullcontext()
+    return render_slots.slot(timeout=render_pool.timeout)
+
+
+async def _fail_claim(ctx: Messageable, job: ClaimJob, exc: Exception, reason: str):
+    """Give a failed claim back to the user."""
+    print(exc)
+    claim_log.advance(job, "failed")
+    unique_sampler.release(job.codes)
+    await _recover(ctx, job.username, job.rarity_label, job.day_index)
+    await send_error(ctx, job.username)
+    raise RuntimeError(reason)
+
+
+async def _run_claim(ctx: Messageable, job: ClaimJob, resumed: bool = False):
+    """Run the remaining steps of a logged claim.
+
+    If resumed is True, art that was generated before a restart is reused.
+    """
+    start = datetime.now()
+    files = job.files
+    os.makedirs(os.path.dirname(files["preview"]), exist_ok=True)
 
     # ============================================ #
     # Image Generation
     # ============================================ #
-    # Generate the artwork
-    print("Generating the artwork...")
-    if SIM_FLAG:
-        # Generate some example art so we don't have to query Dalle
-        image = generate_example_art(img_file)
-        revised_prompt = description
-    else:
-        # Generate the art using Dalle
-        image, revised_prompt = generate_dalle_art(openai_client, description, img_file)
-
-        if image is None:
-            _recover(ctx, username, rarity_label)
-            await send_error(ctx, username)
-            raise RuntimeError("Dalle Error")
-
-    # Sample the frame
-    frame_name = sample_frame(rarity_label)
+    if not job.reached("generated"):
+        # Generate the artwork (all of the requests are queued concurrently)
+        print("Generating the artwork...")
+        try:
+            results = await asyncio.gather(
+                *[
+                    _generate_art(
+                        job.username, d, f, reuse=job.reuse or resumed, variant=i
+                    )
+                    for i, (d, f) in enumerate(zip(job.descriptions, files["img"]))
+                ]
+            )
+        except Exception as exc:
+            await _fail_claim(ctx, job, exc, "Dalle Error")
+        claim_log.advance(job, "generated", revised_prompt=results[0][1])
 
     # ============================================ #
     # NFT Generation
     # ============================================ #
-    # Add the frame to each image and then save them
-    # Spawn these in multiple threads since this can be done asynchronously and is slow
-    print("Adding frames to the NFTs...")
-    nft_img = add_frame(image, frame_name)
-
-    print("Saving the NFTs...")
-    save_nft(nft_img, nft_file)
+    # Add the frame to the images and save the NFTs along with their previews
+    # This is slow, so it runs in worker processes while the bot keeps serving commands
+    if not job.reached("rendered"):
+        print("Adding frames to the NFTs...")
+        try:
+            async with render_slot():
+                if len(files["img"]) == 1:
+                    await render_pool.submit(
+                        render_nft,
+                        files["img"][0],
+                        job.frame_name,
+                        files["nft"][0],
+                        files["preview"],
+                        files["thumbnail"],
+                        files["webp"][0],
+                    )
+                else:
+                    # Frame every NFT in parallel, then build the 2x2 preview from their frames
+                    preview_imgs = await asyncio.gather(
+                        *[
+                            render_pool.submit(render_gift_nft, i, job.frame_name, n, w)
+                            for i, n, w in zip(
+                                files["img"], files["nft"], files["webp"]
+                            )
+                        ]
+                    )
+                    await render_pool.submit(
+                        render_gift_preview,
+                        preview_imgs,
+                        job.frame_name,
+                        files["preview"],
+                        files["thumbnail"],
+                    )
+        except Exception as exc:
+            await _fail_claim(ctx, job, exc, "Render Error")
+        claim_log.advance(job, "rendered")
 
     # Save the metadata jsons
-    print("Saving the NFTs...")
-    save_metadata(metadata, data_file)
+    if not job.reached("saved"):
+        print("Saving the NFTs...")
+        for metadata, data_file in zip(job.metadatas, files["data"]):
+            save_metadata(metadata, data_file)
+        claim_log.advance(job, "saved")
 
     # Send a message to the new owner with images of their new NFTs!
+    # The reduced preview is sent since the full NFT can be several megabytes
     print("Complete!")
-    await send_success_msg(ctx, username, nft_file, revised_prompt)
+    try:
+        await send_success_msg(ctx, job.username, files["preview"], job.revised_prompt)
+    except Exception as exc:
+        # The gift is saved, so tell them without the preview rather than leave it open
+        print(f"Could not send the preview of the claim {job.claim_id}: {exc!r}")
+        try:
+            await send_success_text_msg(ctx, job.username)
+        except Exception as exc:
+            print(f"Could not send the success message: {exc!r}")
+    claim_log.advance(job, "sent")
 
     stop = datetime.now()
     print("Elapsed Time: ", str(stop - start))
 
 
+async def resume_claims():
+    """Finish the claims that were interrupted by a restart."""
+    for job in claim_log.pending():
+        print(f"Resuming the claim {job.claim_id} after '{job.step}'...")
+        try:
+            channel = bot.get_channel(job.channel_id)
+            if channel is None:
+                channel = await bot.fetch_channel(job.channel_id)
+            await _run_claim(ChannelContext(channel), job, resumed=True)
+        except Exception as exc:
+            print(f"Could not resume the claim {job.claim_id}: {exc}")
+
+
+# %%
+# Events
+# ============================================ #
+@bot.event
+async def on_ready():
+    """Resume interrupted claims, prefetch some jokes and upload the static message images that need it."""
+    global claims_resumed
+    if not claims_resumed:
+        # on_ready runs again after every reconnect, but claims are only resumed once
+        claims_resumed = True
+        asyncio.create_task(resume_claims())
+
+    joke_service.schedule_refill()
+    try:
+        await asset_registry.refresh(bot, get_msg_assets())
+    except discord.DiscordException as exc:
+        print(f"Could not upload the message images: {exc}")
+
+
 # %%
 # Commands
 # ============================================ #
@@ -313,39 +535,57 @@ async def claim(ctx: Messageable):
     # Verification
     # ============================================ #
     username = (ctx.message.author.name).lower()
-    await verification(ctx, username)
-
-    # ============================================ #
-    # Sampling
-    # ============================================ #
-    print("Sampling the rarity and attributes...")
-    # Sample the rarity level
-    if SIM_FLAG:
-        rarity_label = sample_rarity_label_uniform()
-    else:
-        week_num = get_week_num()
-        rarity_label = sample_rarity_label(week_num)
-
-    # Increment their rarity counter
-    increment_rarity(username, rarity_label)
-
-    # Sample the metadata
-    attributes = sample_attributes(rarity_label)
-
-    # Structure the text string
-    description = generate_dalle_description(attributes)
-
-    # ============================================ #
-    # Metadata Generation
-    # ============================================ #
-    # Generate the ERC721-compliant metadata json
-    metadata = generate_erc721_metadata(attributes, description)
+    async with user_locks.lock(username):
+        await verification(ctx, username)
+
+        # ============================================ #
+        # Sampling
+        # ============================================ #
+        print("Sampling the rarity and attributes...")
+        # Sample the rarity level
+        if SIM_FLAG:
+            rarity_label = loot_sampler.sample_rarity_label_uniform()
+        else:
+            week_num = get_week_num()
+            rarity_label = loot_sampler.sample_rarity_label(week_num)
+
+        # Record the claim and increment their rarity counter
+        await commit_claim(ctx, username, rarity_label)
+
+        # Sample the metadata for every NFT in the gift (once the claim is recorded, so
+        # no combination is issued for a claim that is refused)
+        descriptions = []
+        metadatas = []
+        codes = []
+        async with _claim_guard(ctx, username, rarity_label, codes):
+            for _ in range(get_num_nfts()):
+                if SIM_FLAG:
+                    attributes = loot_sampler.sample_attributes(rarity_label)
+                else:
+                    # Never hand out the same rarity and attributes twice
+                    attributes, code = unique_sampler.sample(rarity_label)
+                    if code is not None:
+                        codes.append(code)
+
+                # Structure the text string
+                description = generate_dalle_description(attributes)
+                descriptions.append(description)
+
+                # ============================================ #
+                # Metadata Generation
+                # ============================================ #
+                # Generate the ERC721-compliant metadata json
+                metadatas.append(generate_erc721_metadata(attributes, description))
+
+            job = _log_claim(
+                ctx, username, rarity_label, descriptions, metadatas, codes=codes
+            )
 
     # ============================================ #
     # Gift
     # ============================================ #
     # Use the gift util to construct the gifts and send the message
-    await _gift_util(ctx, username, rarity_label, description, metadata)
+    await _gift_util(ctx, job)
 
 
 @bot.command()
@@ -361,7 +601,8 @@ async def topElfRecover(
         await send_not_bayesbrew_msg(ctx)
         return
 
-    await _recover(ctx, username, rarity_label)
+    async with user_locks.lock(username.lower()):
+        await _recover(ctx, username, rarity_label)
 
 
 @bot.command()
@@ -371,33 +612,47 @@ async def topElfPower(
     """Only @bayesbrew can use this function.
 
     Create an exact gift for someone.
+    Art that was already generated for this description is reused, so regenerating
+    a gift that failed after its art was created does not pay for new images.
     """
     # Check if I called it...
     if (ctx.message.author.name).lower() != "bayesbrew":
         await send_not_bayesbrew_msg(ctx)
         return
 
-    # ============================================ #
-    # Verification
-    # ============================================ #
-    await verification(ctx, username)
-
-    # ============================================ #
-    # Increment their rarity counter
-    # ============================================ #
-    increment_rarity(username, rarity_label)
-
-    # ============================================ #
-    # Metadata Generation
-    # ============================================ #
-    # Generate the ERC721-compliant metadata json
-    metadata = generate_erc721_metadata({}, description)
+    async with user_locks.lock(username.lower()):
+        # ============================================ #
+        # Verification
+        # ============================================ #
+        await verification(ctx, username)
+
+        # ============================================ #
+        # Record the claim and increment their rarity counter
+        # ============================================ #
+        await commit_claim(ctx, username, rarity_label)
+
+        async with _claim_guard(ctx, username, rarity_label, []):
+            # ============================================ #
+            # Metadata Generation
+            # ============================================ #
+            # Generate the ERC721-compliant metadata json
+            metadata = generate_erc721_metadata({}, description)
+
+            num_nfts = get_num_nfts()
+            job = _log_claim(
+                ctx,
+                username,
+                rarity_label,
+                num_nfts * [description],
+                num_nfts * [metadata],
+                reuse=True,
+            )
 
     # ============================================ #
     # Gift
     # ============================================ #
     # Use the gift util to construct the gifts and send the message
-    await _gift_util(ctx, username, rarity_label, description, metadata)
+    await _gift_util(ctx, job)
 
 
 @bot.command()
@@ -414,33 +669,44 @@ async def create(ctx: Messageable, *, description: str):
     # Verification
     # ============================================ #
     username = (ctx.message.author.name).lower()
-    await verification(ctx, username)
-
-    # ============================================ #
-    # Sampling
-    # ============================================ #
-    print("Sampling the rarity and attributes...")
-    # Sample the rarity level
-    if SIM_FLAG:
-        rarity_label = sample_rarity_label_uniform()
-    else:
-        week_num = get_week_num()
-        rarity_label = sample_rarity_label(week_num)
-
-    # Increment their rarity counter
-    increment_rarity(username, rarity_label)
-
-    # ============================================ #
-    # Metadata Generation
-    # ============================================ #
-    # Generate the ERC721-compliant metadata json
-    metadata = generate_erc721_metadata({}, description)
+    async with user_locks.lock(username):
+        await verification(ctx, username)
+
+        # ============================================ #
+        # Sampling
+        # ============================================ #
+        print("Sampling the rarity and attributes...")
+        # Sample the rarity level
+        if SIM_FLAG:
+            rarity_label = loot_sampler.sample_rarity_label_uniform()
+        else:
+            week_num = get_week_num()
+            rarity_label = loot_sampler.sample_rarity_label(week_num)
+
+        # Record the claim and increment their rarity counter
+        await commit_claim(ctx, username, rarity_label)
+
+        async with _claim_guard(ctx, username, rarity_label, []):
+            # ============================================ #
+            # Metadata Generation
+            # ============================================ #
+            # Generate the ERC721-compliant metadata json
+            metadata = generate_erc721_metadata({}, description)
+
+            num_nfts = get_num_nfts()
+            job = _log_claim(
+                ctx,
+                username,
+                rarity_label,
+                num_nfts * [description],
+                num_nfts * [metadata],
+            )
 
     # ============================================ #
     # Gift
     # ============================================ #
     # Use the gift util to construct the gifts and send the message
-    await _gift_util(ctx, username, rarity_label, description, metadata)
+    await _gift_util(ctx, job)
 
 
 @bot.command()
@@ -458,51 +724,10 @@ async def join(ctx: Messageable):
         return
 
     # =============================== #
-    # History
-    # =============================== #
-    history_mutex.acquire()
-
-    with open("history.json", "r") as f:
-        history = json.load(f)
-
-    if username in history.keys():
-        history_mutex.release()
-        await send_created_msg(ctx, username)
-        return
-
-    history[username] = []
-
-    # Save the accounts file (first make a copy just in case...)
-    shutil.copyfile("history.json", "tmp/history.json")
-    try:
-        with open("history.json", "w") as f:
-            json.dump(history, f)
-    except Exception as exc:
-        shutil.copyfile("tmp/history.json", "history.json")
-        raise exc
-
-    history_mutex.release()
-
-    # =============================== #
-    # Rarities
+    # History & Rarities
     # =============================== #
-    rarities_mutex.acquire()
-
-    with open("rarities.json", "r") as f:
-        rarities = json.load(f)
-
-    rarity_labels = get_rarity_labels()
-    rarities[username] = {r: 0 for r in rarity_labels}
-
-    shutil.copyfile("rarities.json", "tmp/rarities.json")
-    try:
-        with open("rarities.json", "w") as f:
-            json.dump(rarities, f)
-    except Exception as exc:
-        print(exc)
-        shutil.copyfile("tmp/rarities.json", "rarities.json")
-
-    rarities_mutex.release()
+    async with user_locks.lock(username):
+        store.add_user(username, get_rarity_labels())
 
     # =============================== #
     # Send the msg
@@ -513,24 +738,37 @@ async def join(ctx: Messageable):
 @bot.command()
 async def rares(ctx: Messageable):
     """Display the number of rare NFTs everyone has!"""
-    rarities_mutex.acquire()
-    with open("rarities.json", "r") as f:
-        rarities = json.load(f)
-    rarities_mutex.release()
-    await send_rares_msg(ctx, rarities)
+    rarity_aggregates.sync()
+    output = await response_cache.get(
+        "rares",
+        rarity_aggregates.version,
+        lambda: render_rares_msg(rarity_aggregates.snapshot()),
+    )
+    await ctx.send(output)
 
 
 @bot.command()
 async def odds(ctx: Messageable):
     """Display this week's odds of getting various rarity level gifts!"""
-    rarities_mutex.acquire()
-    with open("rarities.json", "r") as f:
-        rarities = json.load(f)
-    rarities_mutex.release()
-
+    rarity_aggregates.sync()
     week_num = get_week_num()
-    pmf = get_rarity_pmf(week_num)
-    await send_odds_msg(ctx, week_num, pmf, rarities)
+    output = await response_cache.get(
+        "odds",
+        (rarity_aggregates.version, week_num),
+        lambda: render_odds_msg(
+            week_num, get_rarity_pmf(week_num), rarity_aggregates.snapshot()
+        ),
+    )
+    await ctx.send(output)
+
+
+@bot.command()
+async def faq(ctx: Messageable, topic: str = "bot"):
+    """Answer frequently asked questions (use '!faq web3' for web3 questions)."""
+    if topic.lower() == "web3":
+        await send_web3_faq_msg(ctx)
+    else:
+        await send_bot_faq_msg(ctx)
 
 
 @bot.command()
@@ -542,8 +780,21 @@ async def welcome(ctx: Messageable):
 @bot.command()
 async def joke(ctx: Messageable):
     """Tell a random Christmas joke!"""
-    await send_joke_msg(ctx)
+    try:
+        await send_joke_msg(ctx, joke_service.get_joke())
+    except (KeyError, discord.HTTPException) as exc:
+        # e.g. a joke too long for an embed, so tell a bundled one instead
+        print(f"Could not send the joke: {exc!r}")
+        await send_joke_msg(ctx, joke_service.get_corpus_joke())
 
 
 # Run the bot
-bot.run(DISCORD_TOKEN)
+if __name__ == "__main__":
+    setup()
+    bot.run(DISCORD_TOKEN)
+    render_pool.shutdown()
+    issued_index.close()
+    claim_log.close()
+    if render_slots is not None:
+        render_slots.close()
+    store.close()
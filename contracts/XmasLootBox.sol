@@ -34,6 +34,15 @@ contract XmasLootBox is ERC721URIStorage, Ownable {
         }
     }
 
+    function mintBatch(address[] memory recipients, string[] memory tokenURIs)
+        public onlyOwner
+    {
+        require(recipients.length == tokenURIs.length, "XmasLootBox: length mismatch");
+        for(uint i=0; i<recipients.length; i++){
+            mintNFT(recipients[i], tokenURIs[i]);
+        }
+    }
+
     function totalSupply() external view returns (uint256){
         return _tokenIds.current();
     }
@@ -0,0 +1,166 @@
+"""Run the bot as several shard processes and restart the ones that crash.
+
+Each process runs bot.py with a subset of the gateway shards (SHARD_IDS of
+SHARD_COUNT). The processes share the state database, the issued combination index and
+the render slots, so any of them can serve any user.
+
+    python launcher.py --processes 2 --shards 4
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+from src.constants import ISSUED_INDEX
+from src.uniqueness import IssuedIndex
+
+BOT_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "bot.py")
+
+
+def get_shard_ids(shard_count: int, processes: int, index: int) -> List[int]:
+    """The shards run by one process (shards are dealt out round-robin)."""
+    return list(range(index, shard_count, processes))
+
+
+class ShardProcess:
+    """One bot process and its restart bookkeeping."""
+
+    def __init__(
+        self, index: int, shard_ids: List[int], shard_count: int, processes: int
+    ):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.processes = processes
+        self.proc: Optional[subprocess.Popen] = None
+        self.started = 0.0
+        self.restart_at: Optional[float] = None
+        self.backoff = 1.0
+
+    def start(self):
+        env = dict(
+            os.environ,
+            SHARD_INDEX=str(self.index),
+            SHARD_IDS=",".join(str(shard_id) for shard_id in self.shard_ids),
+            SHARD_COUNT=str(self.shard_count),
+            SHARD_PROCESSES=str(self.processes),
+        )
+        print(f"Starting shard process {self.index} (shards {self.shard_ids})...")
+        self.proc = subprocess.Popen([sys.executable, BOT_FILE], env=env)
+        self.started = time.monotonic()
+        self.restart_at = None
+
+    def stop(self, timeout: float):
+        """Ask the bot to shut down cleanly, and kill it if it does not."""
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        self.proc.send_signal(signal.SIGINT)
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            print(f"Killing shard process {self.index}.")
+            self.proc.kill()
+            self.proc.wait()
+
+
+class Supervisor:
+    """Start the shard processes and restart them (with backoff) when they crash."""
+
+    def __init__(
+        self,
+        processes: int,
+        shard_count: int,
+        stagger: float = 5.0,
+        min_uptime: float = 60.0,
+        max_backoff: float = 300.0,
+        stop_timeout: float = 30.0,
+    ):
+        self.shards = [
+            ShardProcess(
+                i, get_shard_ids(shard_count, processes, i), shard_count, processes
+            )
+            for i in range(processes)
+        ]
+        # Discord limits how fast shards may identify, so start them one at a time
+        self.stagger = stagger
+        self.min_uptime = min_uptime
+        self.max_backoff = max_backoff
+        self.stop_timeout = stop_timeout
+        self._stopping = False
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _check(self, shard: ShardProcess):
+        now = time.monotonic()
+        if shard.restart_at is not None:
+            if now >= shard.restart_at:
+                shard.start()
+            return
+
+        code = shard.proc.poll()
+        if code is None or code == 0:
+            return
+
+        # Back off while the shard keeps crashing right after starting
+        if now - shard.started >= self.min_uptime:
+            shard.backoff = 1.0
+        else:
+            shard.backoff = min(2 * shard.backoff, self.max_backoff)
+        print(
+            f"Shard process {shard.index} exited with {code}, "
+            f"restarting in {shard.backoff:.0f}s."
+        )
+        shard.restart_at = now + shard.backoff
+
+    def run(self):
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        for i, shard in enumerate(self.shards):
+            if self._stopping:
+                break
+            if i > 0:
+                time.sleep(self.stagger)
+            shard.start()
+
+        while not self._stopping:
+            time.sleep(1)
+            for shard in self.shards:
+                if shard.proc is not None:
+                    self._check(shard)
+            if all(
+                shard.proc is not None and shard.proc.poll() == 0
+                for shard in self.shards
+            ):
+                print("Every shard process exited.")
+                break
+
+        for shard in self.shards:
+            shard.stop(self.stop_timeout)
+
+        # The shards share the issued index, so it is only compacted once they stopped
+        IssuedIndex(ISSUED_INDEX).close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot as shard processes.")
+    parser.add_argument(
+        "--processes", type=int, default=os.cpu_count() or 1, help="Bot processes."
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help="Gateway shards in total (default: one per process).",
+    )
+    args = parser.parse_args()
+
+    shard_count = args.shards or args.processes
+    if shard_count < args.processes:
+        parser.error("Every process needs at least one shard.")
+    Supervisor(args.processes, shard_count).run()
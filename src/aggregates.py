@@ -0,0 +1,140 @@
+"""In-memory rarity aggregates.
+
+The rarity totals are kept up to date as the store changes, so !odds and !rares read a
+snapshot instead of querying and summing every user's counters. When several processes
+share the store, the changes made by the others are picked up by sync().
+"""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .store import StateStore
+
+
+class RaritySnapshot:
+    """An immutable view of the rarity counts at one version."""
+
+    def __init__(
+        self,
+        version: int,
+        rarity_labels: List[str],
+        totals: Tuple[int, ...],
+        users: Dict[str, Tuple[int, ...]],
+    ):
+        self.version = version
+        self.rarity_labels = rarity_labels
+        self.totals = totals
+        self.users = users
+
+    @property
+    def total_count(self) -> int:
+        """The number of NFTs handed out."""
+        return sum(self.totals)
+
+    def get_pmf(self) -> List[float]:
+        """The observed rarity distribution."""
+        total_count = self.total_count
+        return [t / total_count if total_count else 0.0 for t in self.totals]
+
+
+class RarityAggregates:
+    """Global and per-user rarity counts, updated incrementally.
+
+    Updates are O(1). Reading the totals through a snapshot is O(labels); the per-user
+    counts are only copied on the first snapshot after a change.
+    """
+
+    def __init__(self, rarity_labels: List[str]):
+        self.rarity_labels = list(rarity_labels)
+        self._index = {label: i for i, label in enumerate(self.rarity_labels)}
+        self._totals = [0] * len(self.rarity_labels)
+        self._users: Dict[str, List[int]] = {}
+        self._version = 0
+        self._snapshot: Optional[RaritySnapshot] = None
+        self._lock = threading.Lock()
+        self._store: Optional[StateStore] = None
+        self._rarity_version = None
+
+    @property
+    def version(self) -> int:
+        """Incremented on every change."""
+        return self._version
+
+    def load(self, rarities: Dict[str, Dict[str, int]]):
+        """Replace every count (e.g. from StateStore.get_rarities)."""
+        with self._lock:
+            self._users = {
+                username: [counts.get(label, 0) for label in self.rarity_labels]
+                for username, counts in rarities.items()
+            }
+            self._totals = [
+                sum(counts[i] for counts in self._users.values())
+                for i in range(len(self.rarity_labels))
+            ]
+            self._changed()
+
+    def apply(self, username: str, rarity_label: Optional[str], delta: int = 1):
+        """Apply a change to a user's counts (rarity_label None adds the user)."""
+        with self._lock:
+            counts = self._users.get(username)
+            if counts is None:
+                counts = self._users[username] = [0] * len(self.rarity_labels)
+            if rarity_label is not None:
+                i = self._index[rarity_label]
+                counts[i] += delta
+                self._totals[i] += delta
+            self._changed()
+
+    def sync(self):
+        """Reload the counts if another process (e.g. another shard) changed the store.
+
+        Another process's write-behind counts show up once it flushes them, i.e. up to
+        RARITY_FLUSH_INTERVAL seconds after its claims.
+        """
+        if self._store is None:
+            return
+        rarity_version = self._store.rarity_version()
+        if self._rarity_version is not None:
+            # This process's own changes were already applied
+            seen = self._store.skip_own_rarity_versions(self._rarity_version)
+            if seen == rarity_version:
+                self._rarity_version = rarity_version
+                return
+        self._rarity_version = rarity_version
+        self.load(self._store.get_rarities())
+
+    def _changed(self):
+        self._version += 1
+        self._snapshot = None
+
+    def snapshot(self) -> RaritySnapshot:
+        """Get an immutable view of the current counts."""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = RaritySnapshot(
+                    self._version,
+                    self.rarity_labels,
+                    tuple(self._totals),
+                    {username: tuple(c) for username, c in self._users.items()},
+                )
+            return self._snapshot
+
+    def totals(self) -> Tuple[int, ...]:
+        """The number of NFTs handed out at each rarity (without a full snapshot)."""
+        with self._lock:
+            return tuple(self._totals)
+
+
+def open_aggregates(store: StateStore, rarity_labels: List[str]) -> RarityAggregates:
+    """Load the aggregates from a store and keep them in sync with its changes.
+
+    Only a shared store is synced, as otherwise every change goes through this process.
+    """
+    aggregates = RarityAggregates(rarity_labels)
+    store.subscribe(aggregates.apply)
+    if store.shared:
+        aggregates._store = store
+        aggregates.sync()
+    else:
+        aggregates.load(store.get_rarities())
+    return aggregates
@@ -0,0 +1,125 @@
+"""Content-addressed cache of generated artwork.
+
+Every Dalle image is stored under a hash of the request (model, size, quality and
+prompt) together with its revised prompt. Regenerating a gift with the same prompt,
+e.g. after framing or minting failed, can then reuse the art instead of paying for a
+new image.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from .constants import ART_CACHE_DIR, ART_CACHE_BYTES
+
+
+def get_art_key(prompt: str, params: Dict, variant: int = 0) -> str:
+    """Hash the parts of a Dalle request that determine the image.
+
+    `variant` tells apart the NFTs of a gift that share one prompt.
+    """
+    request = {
+        "model": params.get("model"),
+        "size": params.get("size"),
+        "quality": params.get("quality"),
+        "prompt": prompt,
+        "variant": variant,
+    }
+    blob = json.dumps(request, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+class ArtCache:
+    """An on-disk cache of Dalle images, optionally bounded by size (LRU eviction).
+
+    Each entry is a `<key>.png` holding the image bytes and a `<key>.json` holding the
+    revised prompt. Reads refresh the png's mtime, which is used as the LRU order.
+    """
+
+    def __init__(
+        self, directory: str = ART_CACHE_DIR, max_bytes: Optional[int] = ART_CACHE_BYTES
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._nbytes = sum(size for _, _, size in self._entries())
+
+    @property
+    def nbytes(self) -> int:
+        """The total size of the cached images."""
+        return self._nbytes
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, key)
+        return f"{base}.png", f"{base}.json"
+
+    def _entries(self):
+        """Yield (key, mtime, size) for every cached image."""
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".png"):
+                stat = entry.stat()
+                yield entry.name[: -len(".png")], stat.st_mtime, stat.st_size
+
+    def __contains__(self, key: str) -> bool:
+        png_file, data_file = self._paths(key)
+        return os.path.exists(png_file) and os.path.exists(data_file)
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """Get the image bytes and revised prompt for a key, or None on a miss."""
+        png_file, data_file = self._paths(key)
+        with self._lock:
+            try:
+                with open(data_file, "r") as f:
+                    revised_prompt = json.load(f)["revised_prompt"]
+                with open(png_file, "rb") as f:
+                    imgbytes = f.read()
+            except (OSError, ValueError, KeyError):
+                return None
+
+            # Mark the entry as recently used
+            os.utime(png_file)
+
+        return imgbytes, revised_prompt
+
+    def put(self, key: str, imgbytes: bytes, revised_prompt: str):
+        """Store an image and its revised prompt, evicting old entries if needed."""
+        png_file, data_file = self._paths(key)
+        with self._lock:
+            if os.path.exists(png_file):
+                self._nbytes -= os.path.getsize(png_file)
+
+            # Write the metadata last, so a half-written entry is never read
+            _write_atomic(png_file, imgbytes)
+            _write_atomic(data_file, json.dumps({"revised_prompt": revised_prompt}))
+            self._nbytes += len(imgbytes)
+
+            self._evict(keep=key)
+
+    def _evict(self, keep: str):
+        """Remove the least recently used entries until the cache is within budget."""
+        if self.max_bytes is None or self._nbytes <= self.max_bytes:
+            return
+
+        for key, _, size in sorted(self._entries(), key=lambda entry: entry[1]):
+            if self._nbytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for filename in self._paths(key):
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+            self._nbytes -= size
+
+
+def _write_atomic(filename: str, data):
+    """Write a file through a temporary file so readers never see partial data."""
+    mode = "wb" if isinstance(data, bytes) else "w"
+    tmp_file = f"{filename}.tmp"
+    with open(tmp_file, mode) as f:
+        f.write(data)
+    os.replace(tmp_file, filename)
@@ -1,28 +1,20 @@
-import os
 from PIL import Image
 from PIL.Image import Image as ImgType
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
-from .constants import FRAME_DIR
+from .compositing import COMPOSITORS
+from .constants import COMPOSITE_BACKEND, GIF_ENCODER, IMG_WIDTH, IMG_HEIGHT
+from .encoders import save_gif
+from .frames import frame_cache, get_frame_offset
 
-IMG_WIDTH, IMG_HEIGHT = 256, 256
 
+def add_frame(
+    image: Image, frame_name: str, backend: str = COMPOSITE_BACKEND
+) -> List[ImgType]:
+    """Adds an animated GIF frame to an image.
 
-def get_frame_offset(frame_name: str) -> int:
-    """Get an offset padding based on the frame."""
-    if frame_name in [None, "speedlines", "rain_of_gold", "astro"]:
-        # NOTE: The speedlines and rain of gold frames look a lot better
-        #       if you don't create a buffer border.
-        offset = 0
-    else:
-        # NOTE: This offset creates a buffer border to prevent the frame from
-        #       overlapping the image.
-        offset = 140
-    return offset
-
-
-def add_frame(image: Image, frame_name: str) -> List[ImgType]:
-    """Adds an animated GIF frame to an image."""
+    The backend selects the compositor used to paste the frame (see compositing.py).
+    """
     output_images = []
 
     if frame_name is None:
@@ -30,46 +22,91 @@ def add_frame(image: Image, frame_name: str) -> List[ImgType]:
         # Just make a fake gif with 2 frames
         output_images.extend([image.resize((IMG_WIDTH, IMG_HEIGHT)) for _ in range(2)])
     else:
-        # Construct the path
-        frame_path = os.path.join(FRAME_DIR, f"{frame_name}.gif")
-
-        # Load the frame
-        frame_gif = Image.open(frame_path)
+        # Get the decoded frames (already resized and converted to RGBA)
+        frame_asset = frame_cache.get(frame_name)
+        offset = frame_asset.offset
 
         # Get the image's size
         image = image.resize((IMG_WIDTH, IMG_HEIGHT))
 
-        # Get the frame
-        offset = get_frame_offset(frame_name)
-
         # Create the base background image and paste the desired image ontop
-        base_layer = Image.new(
-            mode="RGB", size=(IMG_WIDTH + offset, IMG_HEIGHT + offset)
-        )
+        base_layer = Image.new(mode="RGB", size=frame_asset.size)
         base_layer.paste(image, (offset // 2, offset // 2))
 
-        # Break apart the frame gif, paste it ontop of the base image, and reconstruct it in a list
-        try:
-            while 1:
-                # Get the next frame, resize it, and add an alpha layer
-                frame_gif.seek(frame_gif.tell() + 1)
-                frame_img = frame_gif.resize((IMG_WIDTH + offset, IMG_HEIGHT + offset))
-                frame_img = frame_img.convert("RGBA")
-
-                # Copy the base layer image
-                temp_img = base_layer.copy()
-                # Then the frame on top
-                temp_img.paste(frame_img, (0, 0), frame_img)
-
-                # Add this frame to the output list
-                output_images.append(temp_img.copy())
-        except EOFError:
-            pass  # end of sequence
+        # Paste every frame ontop of the base image
+        output_images.extend(COMPOSITORS[backend](base_layer, frame_asset))
 
     # Return the output gif images
     return output_images
 
 
+def save_nft(nft_img: List[ImgType], filename: str, encoder: str = GIF_ENCODER):
+    """Save the NFT gif.
+
+    The encoder trades encode time against file size (see encoders.py).
+    This function is slow and should run in a render worker (see workers.py).
+    """
+    save_gif(nft_img, filename, encoder=encoder, duration=10)
+    return
+
+
+def get_preview_size(size: Tuple[int, int]) -> Tuple[int, int]:
+    """Get the size of a Discord preview (half size to fit in the discord message)."""
+    width, height = size
+    return width // 2, height // 2
+
+
+def scale_frame(img: ImgType, size: Tuple[int, int]) -> ImgType:
+    """Resize a frame, skipping the work if it already has the requested size."""
+    if img.size == size:
+        return img
+    return img.resize(size)
+
+
+def save_nft_outputs(
+    nft_img: List[ImgType],
+    nft_file: str,
+    preview_file: Optional[str] = None,
+    thumbnail_file: Optional[str] = None,
+    webp_file: Optional[str] = None,
+    encoder: str = GIF_ENCODER,
+) -> Tuple[Dict[str, str], List[ImgType]]:
+    """Save the full NFT gif along with its reduced outputs from one set of frames.
+
+    The frames are scaled down once and shared by the Discord preview gif and the
+    static thumbnail (PNG or WebP, based on the extension). The animated WebP is
+    only written if a filename is given.
+    Returns the saved filenames keyed by output and the scaled preview frames, so
+    that callers can assemble a multi-NFT preview without resizing anything again.
+    """
+    outputs = {"nft": nft_file}
+    save_nft(nft_img, nft_file, encoder)
+
+    preview_size = get_preview_size(nft_img[0].size)
+    preview_img = [scale_frame(img, preview_size) for img in nft_img]
+
+    if preview_file is not None:
+        save_nft(preview_img, preview_file, encoder)
+        outputs["preview"] = preview_file
+
+    if thumbnail_file is not None:
+        preview_img[0].save(thumbnail_file)
+        outputs["thumbnail"] = thumbnail_file
+
+    if webp_file is not None:
+        nft_img[0].save(
+            webp_file,
+            save_all=True,
+            append_images=nft_img[1:],
+            duration=10,
+            loop=0,
+            quality=80,
+        )
+        outputs["webp"] = webp_file
+
+    return outputs, preview_img
+
+
 def create_img_preview(nft_imgs: List[List[ImgType]], frame_name: str) -> List[ImgType]:
     """Creates a 4x4 preview of your NFTs using the first image frame of the gif.
     NOTE: This requires that exactly 4 NFT gifs are provided.
@@ -99,9 +136,9 @@ def create_nft_preview(nft_imgs: List[List[ImgType]], frame_name: str) -> List[I
     """
     # Construct a base image
     # We will make it half the size to fit in the discord message
+    # (frames that were already scaled by save_nft_outputs are not resized again)
     offset = get_frame_offset(frame_name)
-    width = (IMG_WIDTH + offset) // 2
-    height = (IMG_HEIGHT + offset) // 2
+    width, height = get_preview_size((IMG_WIDTH + offset, IMG_HEIGHT + offset))
     base_preview = Image.new(mode="RGB", size=(2 * width, 2 * height))
 
     # Get the number of frames
@@ -112,10 +149,10 @@ def create_nft_preview(nft_imgs: List[List[ImgType]], frame_name: str) -> List[I
     for i in range(num_frames):
         # Paste each image onto the base layer
         temp_img = base_preview.copy()
-        temp_img.paste(nft_imgs[0][i].resize((width, height)), (0, 0))
-        temp_img.paste(nft_imgs[1][i].resize((width, height)), (width, 0))
-        temp_img.paste(nft_imgs[2][i].resize((width, height)), (0, width))
-        temp_img.paste(nft_imgs[3][i].resize((width, height)), (width, height))
+        temp_img.paste(scale_frame(nft_imgs[0][i], (width, height)), (0, 0))
+        temp_img.paste(scale_frame(nft_imgs[1][i], (width, height)), (width, 0))
+        temp_img.paste(scale_frame(nft_imgs[2][i], (width, height)), (0, width))
+        temp_img.paste(scale_frame(nft_imgs[3][i], (width, height)), (width, height))
         preview.append(temp_img)
 
     return preview
@@ -0,0 +1,118 @@
+"""Registry of Discord CDN URLs for the static message images.
+
+The message images (impish.jpg, loot-box.gif, ...) never change, so each one is
+uploaded once and its attachment URL is reused by every later embed. The URLs are
+persisted across restarts. Discord CDN URLs are signed and expire (the `ex` query
+parameter is the expiry time in hex), so an image is uploaded again once its URL is
+about to expire.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+import discord
+
+from .constants import ASSET_CHANNEL_ID, ASSET_REGISTRY
+
+# Upload again when a URL expires within this many seconds
+EXPIRY_MARGIN = 60 * 60
+
+
+def get_url_expiry(url: str) -> Optional[float]:
+    """Get the expiry time of a signed Discord CDN URL, or None if it has none."""
+    try:
+        return float(int(parse_qs(urlparse(url).query)["ex"][0], 16))
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+class AssetRegistry:
+    """Attachment URLs of the static images, keyed by path."""
+
+    def __init__(
+        self,
+        filename: str = ASSET_REGISTRY,
+        channel_id: Optional[int] = ASSET_CHANNEL_ID,
+    ):
+        self.filename = filename
+        self.channel_id = channel_id
+        self._urls: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(filename):
+            with open(filename, "r") as f:
+                self._urls = json.load(f)
+
+    def _version(self, path: str) -> str:
+        """Identify the contents of an asset, so edited assets are uploaded again."""
+        stat = os.stat(path)
+        return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+    def get_url(self, path: str) -> Optional[str]:
+        """Get a valid URL for an asset, or None if it has to be uploaded."""
+        entry = self._urls.get(path)
+        if entry is None or entry["version"] != self._version(path):
+            return None
+
+        expires = entry.get("expires")
+        if expires is not None and expires - EXPIRY_MARGIN < time.time():
+            return None
+        return entry["url"]
+
+    def set_url(self, path: str, url: str):
+        """Remember the URL of an uploaded asset."""
+        with self._lock:
+            self._urls[path] = {
+                "url": url,
+                "version": self._version(path),
+                "expires": get_url_expiry(url),
+            }
+            # Bot shards in other processes may be writing the registry too
+            tmp_file = f"{self.filename}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(self._urls, f, indent=2)
+            os.replace(tmp_file, self.filename)
+
+    async def upload(self, channel, path: str) -> str:
+        """Upload an asset to a channel and remember its URL."""
+        message = await channel.send(file=discord.File(path))
+        url = message.attachments[0].url
+        self.set_url(path, url)
+        return url
+
+    async def refresh(self, client: discord.Client, paths):
+        """Upload every asset without a valid URL to the cache channel, if there is one."""
+        if self.channel_id is None:
+            return
+
+        channel = client.get_channel(self.channel_id)
+        if channel is None:
+            channel = await client.fetch_channel(self.channel_id)
+
+        for path in paths:
+            if self.get_url(path) is None:
+                await self.upload(channel, path)
+
+    async def send_embed(self, channel, embed: discord.Embed, path: str):
+        """Send an embed showing an asset, uploading the asset only if needed."""
+        url = self.get_url(path)
+        if url is not None:
+            embed.set_image(url=url)
+            return await channel.send(embed=embed)
+
+        # Upload with this message and remember the attachment's URL
+        filename = os.path.basename(path)
+        embed.set_image(url=f"attachment://{filename}")
+        message = await channel.send(
+            embed=embed, file=discord.File(path, filename=filename)
+        )
+        # The attachment is moved into the embed, so its URL is the embed's image URL
+        if message.embeds and message.embeds[0].image.url:
+            self.set_url(path, message.embeds[0].image.url)
+        elif message.attachments:
+            self.set_url(path, message.attachments[0].url)
+        return message
@@ -0,0 +1,171 @@
+"""Write-ahead log of the claims that are being gifted.
+
+A claim runs through these steps once it has been recorded in the state store:
+
+    claimed -> generated -> rendered -> saved -> sent
+
+Every step is appended (and fsynced) to the log with the state it produced before the
+next step starts. After a crash the incomplete claims are read back and resumed from
+their last completed step, so nothing is sampled, counted or generated twice.
+
+A log belongs to the one process that opened it: the others are refused, so none of
+them can replace the file under the owner's open log.
+"""
+
+import fcntl
+import json
+import os
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from .constants import CLAIM_LOG
+
+CLAIM_STEPS = ["claimed", "generated", "rendered", "saved", "sent"]
+
+# Steps after which a claim needs no more work
+FINAL_STEPS = ("sent", "failed")
+
+
+@dataclass
+class ClaimJob:
+    """Everything needed to finish a claim without sampling it again."""
+
+    claim_id: str
+    username: str
+    day_index: int
+    rarity_label: str
+    descriptions: List[str]
+    metadatas: List[dict]
+    frame_name: str
+    channel_id: int
+    files: Dict[str, list]
+    reuse: bool = False
+    step: str = "claimed"
+    revised_prompt: Optional[str] = None
+    # The issued combination codes, released if the claim fails
+    codes: List[int] = field(default_factory=list)
+
+    @property
+    def done(self) -> bool:
+        return self.step in FINAL_STEPS
+
+    def reached(self, step: str) -> bool:
+        """Whether this claim has completed `step`."""
+        return self.step in CLAIM_STEPS and (
+            CLAIM_STEPS.index(self.step) >= CLAIM_STEPS.index(step)
+        )
+
+
+class ClaimLog:
+    """The incomplete claims, persisted as an append-only JSON lines log.
+
+    Raises RuntimeError if another process has the log open.
+    """
+
+    def __init__(self, filename: str = CLAIM_LOG):
+        self.filename = filename
+        self.jobs: Dict[str, ClaimJob] = {}
+
+        # Lock a separate file, since compacting replaces the log itself
+        self._lock_file = open(f"{filename}.lock", "a")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(
+                f"The claim log {filename} is in use by another process."
+            )
+
+        self._log = open(filename, "a+")
+        self._log.seek(0)
+        end = 0
+        for line in iter(self._log.readline, ""):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written record left by a crash
+                break
+            self._apply(record)
+            end = self._log.tell()
+
+        # Drop the partial record, so the next records are not appended to it
+        self._log.truncate(end)
+
+    def _apply(self, record: dict):
+        if "job" in record:
+            self.jobs[record["id"]] = ClaimJob(**record["job"])
+            return
+
+        job = self.jobs.get(record["id"])
+        if job is None:
+            return
+        job.step = record["step"]
+        for key, value in record.get("data", {}).items():
+            setattr(job, key, value)
+        if job.done:
+            del self.jobs[record["id"]]
+
+    def _append(self, record: dict):
+        self._log.write(json.dumps(record) + "\n")
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    def start(self, job: ClaimJob):
+        """Log a new claim."""
+        self.jobs[job.claim_id] = job
+        self._append({"id": job.claim_id, "job": asdict(job)})
+
+    def advance(self, job: ClaimJob, step: str, **data):
+        """Log that a claim completed `step`, along with the state it produced."""
+        job.step = step
+        for key, value in data.items():
+            setattr(job, key, value)
+        self._append({"id": job.claim_id, "step": step, "data": data})
+        if job.done:
+            self.jobs.pop(job.claim_id, None)
+
+    def pending(self) -> List[ClaimJob]:
+        """The claims that were started but not finished."""
+        return list(self.jobs.values())
+
+    def compact(self):
+        """Rewrite the log with just the incomplete claims."""
+        self._log.close()
+
+        tmp_file = f"{self.filename}.tmp"
+        with open(tmp_file, "w") as f:
+            for job in self.jobs.values():
+                f.write(json.dumps({"id": job.claim_id, "job": asdict(job)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.filename)
+        self._log = open(self.filename, "a")
+
+    def close(self):
+        self.compact()
+        self._log.close()
+        self._lock_file.close()
+
+
+def get_claim_files(
+    out_dir: str, username: str, datestr: str, num_nfts: int, webp: bool
+):
+    """The paths of every file a claim produces."""
+    uniq_dir = os.path.join(out_dir, username)
+    names = [datestr] if num_nfts == 1 else [f"{datestr}_{i}" for i in range(num_nfts)]
+    return {
+        "img": [os.path.join(uniq_dir, f"{name}.png") for name in names],
+        "nft": [os.path.join(uniq_dir, f"{name}.gif") for name in names],
+        "webp": [
+            os.path.join(uniq_dir, f"{name}.webp") if webp else None for name in names
+        ],
+        "data": [os.path.join(uniq_dir, f"{name}.json") for name in names],
+        "preview": os.path.join(uniq_dir, f"{datestr}_preview.gif"),
+        "thumbnail": os.path.join(uniq_dir, f"{datestr}_thumb.png"),
+    }
+
+
+def new_claim_id(username: str) -> str:
+    """Identify a claim."""
+    return f"{username}-{uuid.uuid4().hex[:12]}"
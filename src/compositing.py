@@ -0,0 +1,48 @@
+"""Compositing backends for pasting a frame asset over the artwork.
+
+Both backends produce pixel-identical output. The numpy backend blends every frame at
+once instead of copying and pasting one frame at a time.
+"""
+
+from typing import Callable, Dict, List
+
+import numpy as np
+from PIL import Image
+from PIL.Image import Image as ImgType
+
+from .frames import FrameAsset
+
+
+def composite_pil(base_layer: ImgType, frame_asset: FrameAsset) -> List[ImgType]:
+    """Paste every frame ontop of a copy of the base image using PIL."""
+    output_images = []
+    for frame_img, mask in zip(frame_asset.frames, frame_asset.masks):
+        temp_img = base_layer.copy()
+        temp_img.paste(frame_img, (0, 0), mask)
+        output_images.append(temp_img)
+    return output_images
+
+
+def composite_numpy(base_layer: ImgType, frame_asset: FrameAsset) -> List[ImgType]:
+    """Alpha-blend the base image under every frame in one vectorized operation."""
+    stack = frame_asset.stack
+    alpha = stack[..., 3:].astype(np.uint16)
+    overlay = stack[..., :3].astype(np.uint16)
+    base = np.asarray(base_layer, dtype=np.uint16)
+
+    # Same integer arithmetic as PIL's paste with a mask:
+    #   out = (base * (255 - alpha) + overlay * alpha) / 255, rounded.
+    # Every intermediate value fits in uint16.
+    blended = base * (255 - alpha) + overlay * alpha
+    blended += 128
+    blended += blended >> 8
+    blended >>= 8
+    frames = blended.astype(np.uint8)
+
+    return [Image.fromarray(frame) for frame in frames]
+
+
+COMPOSITORS: Dict[str, Callable[[ImgType, FrameAsset], List[ImgType]]] = {
+    "pil": composite_pil,
+    "numpy": composite_numpy,
+}
@@ -11,4 +11,65 @@ FRAME_DIR = os.path.join(BASE_DIR, ASSET_DIR, "frames/")
 OUT_DIR = os.path.join(BASE_DIR, "../nfts/")
 
 # Define the collection URL
-OPENSEA_URL = "https://testnets.opensea.io/collection/xmaslootbox?search[sortAscending]=false&search[sortBy]=CREATED_DATE"
\ No newline at end of file
+OPENSEA_URL = "https://testnets.opensea.io/collection/xmaslootbox?search[sortAscending]=false&search[sortBy]=CREATED_DATE"
+
+# Define the NFT image size
+IMG_WIDTH, IMG_HEIGHT = 256, 256
+
+# Define the memory budget (bytes) for decoded frames in each render worker
+FRAME_CACHE_BYTES = 256 * 1024 * 1024
+
+# Define the compositing backend used to add frames ("pil" or "numpy")
+COMPOSITE_BACKEND = "pil"
+
+# Define the GIF encoder used to save the NFTs ("legacy", "fast", "small" or "quality")
+GIF_ENCODER = "fast"
+
+# Also save an animated WebP alongside each NFT gif
+ANIMATED_WEBP = False
+
+# Define the number of NFTs in a gift (when BATCH_FLAG is set; see mint4NFTs)
+NFTS_PER_GIFT = 4
+
+# Define the maximum number of concurrent Dalle requests
+DALLE_CONCURRENCY = 4
+
+# Define the Dalle rate limit (match this to the account's images/minute limit)
+DALLE_IMAGES_PER_MINUTE = 5
+
+# Define the generated art cache (set ART_CACHE_BYTES to None for no size limit)
+ART_CACHE_DIR = os.path.join(BASE_DIR, "../art_cache/")
+ART_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+# Define the seed for sampling rarities and attributes (None for a random seed)
+SAMPLER_SEED = None
+
+# Define the state database
+STATE_DB = "state.db"
+
+# Define the index of issued attribute combinations
+ISSUED_INDEX = "issued.npz"
+
+# Define where the Discord URLs of the static message images are kept, and the channel
+# they are uploaded to on startup (None uploads each image the first time it is sent)
+ASSET_REGISTRY = "asset_urls.json"
+ASSET_CHANNEL_ID = None
+
+# Define the joke API
+JOKE_API_URL = "https://v2.jokeapi.dev/joke/Christmas"
+
+# Local cache of files downloaded from IPFS, keyed by CID
+IPFS_CACHE_DIR = os.path.join(BASE_DIR, "../ipfs_cache/")
+
+# Mint the gifts claimed within this many seconds together, up to this many gifts per transaction
+MINT_BATCH_WINDOW = 10.0
+MINT_BATCH_SIZE = 10
+
+# Define the write-ahead log of the claims being gifted
+CLAIM_LOG = "claims.log"
+
+# Define the log of rarity count changes not yet flushed to the state database, how
+# often it is fsynced ("always", "interval" or "never") and how often it is flushed
+RARITY_LOG = "rarities.log"
+RARITY_LOG_FSYNC = "interval"
+RARITY_FLUSH_INTERVAL = 30.0
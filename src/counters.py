@@ -0,0 +1,208 @@
+"""Write-behind counters.
+
+Counter changes (e.g. a claim's rarity count) are kept in memory and appended to a
+small log instead of being written to the state database one by one. The changes are
+coalesced per counter and flushed to the database in one transaction every so often,
+and when the bot shuts down. After a crash the log is replayed, and every change logged
+after the last flush is applied again.
+
+A change is logged before the transaction that makes it (e.g. recording the claim)
+commits, and the transaction stores the number of the change, so after a crash only the
+changes of committed transactions are applied. A change whose transaction rolls back is
+cancelled by logging the opposite change. A flush stores the number of the last change
+it applied in the same way, so a change is never applied twice, even if the bot crashes
+between committing a flush and truncating the log.
+
+A log belongs to the one process that opened it: the others are refused, so they cannot
+flush (and count again) the changes of a running bot.
+
+How often the log is fsynced is a trade-off between the cost of a claim and the
+changes lost if the machine (rather than the bot) goes down:
+
+    "always"    fsync every change
+    "interval"  fsync at most once every `fsync_interval` seconds
+    "never"     leave it to the operating system
+
+Every change is written to the operating system before it is counted, so a crash of
+the bot alone loses nothing under any policy.
+"""
+
+import fcntl
+import json
+import os
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from .constants import RARITY_FLUSH_INTERVAL, RARITY_LOG, RARITY_LOG_FSYNC
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+CounterKey = Tuple[str, str]
+CounterChange = Tuple[int, str, str, int]
+
+
+class CounterLog:
+    """Append-only log of counter changes, as JSON lines of [seq, username, label, delta].
+
+    Raises RuntimeError if another process has the log open. A `read_only` log can only
+    be replayed, and can be read while another process (e.g. the bot) writes it.
+    """
+
+    def __init__(
+        self,
+        filename: str = RARITY_LOG,
+        fsync: str = RARITY_LOG_FSYNC,
+        fsync_interval: float = 1.0,
+        read_only: bool = False,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(
+                f"Unknown fsync policy '{fsync}', use one of {FSYNC_POLICIES}."
+            )
+        self.filename = filename
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.read_only = read_only
+        self._last_sync = time.monotonic()
+        self._log = None
+        if read_only:
+            return
+
+        self._log = open(filename, "a")
+        try:
+            fcntl.flock(self._log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._log.close()
+            raise RuntimeError(
+                f"The counter log {filename} is in use by another process."
+            )
+
+    def replay(self) -> Iterator[CounterChange]:
+        """Read back every logged change."""
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, "r") as f:
+            for line in f:
+                try:
+                    seq, username, label, delta = json.loads(line)
+                except ValueError:
+                    # A partially written record left by a crash
+                    break
+                yield seq, username, label, delta
+
+    def append(self, seq: int, username: str, label: str, delta: int):
+        self._log.write(json.dumps([seq, username, label, delta]) + "\n")
+        self._log.flush()
+        if self.fsync == "always":
+            self.sync()
+        elif self.fsync == "interval":
+            if time.monotonic() - self._last_sync >= self.fsync_interval:
+                self.sync()
+
+    def sync(self):
+        """Force the logged changes to disk."""
+        os.fsync(self._log.fileno())
+        self._last_sync = time.monotonic()
+
+    def truncate(self):
+        """Drop every logged change (once they have been flushed)."""
+        self._log.truncate(0)
+        self._log.flush()
+        if self.fsync != "never":
+            self.sync()
+
+    def close(self):
+        if self._log is None:
+            return
+        if self.fsync != "never":
+            self.sync()
+        self._log.close()
+
+
+class WriteBehindCounters:
+    """Counter changes that were logged but not yet flushed to the database."""
+
+    def __init__(
+        self,
+        log: CounterLog,
+        flush_interval: float = RARITY_FLUSH_INTERVAL,
+        max_pending: int = 1000,
+    ):
+        self.log = log
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.seq = 0
+        self.flushed_seq = 0
+        self.pending: Dict[CounterKey, int] = {}
+        self._staged: List[CounterChange] = []
+
+    @property
+    def flushed_key(self) -> str:
+        """The database key of the number of the last flushed change."""
+        return f"counter_seq:{os.path.basename(self.log.filename)}"
+
+    @property
+    def committed_key(self) -> str:
+        """The database key of the number of the last committed change."""
+        return f"counter_committed:{os.path.basename(self.log.filename)}"
+
+    def recover(
+        self, changes: List[CounterChange], flushed_seq: int, committed_seq: int
+    ):
+        """Restore the logged changes that were committed but not flushed."""
+        self.seq = self.flushed_seq = flushed_seq
+        self.pending.clear()
+        for seq, username, label, delta in changes:
+            self.seq = max(self.seq, seq)
+            if flushed_seq < seq <= committed_seq:
+                self._add(username, label, delta)
+
+    def _add(self, username: str, label: str, delta: int):
+        key = (username, label)
+        count = self.pending.get(key, 0) + delta
+        if count:
+            self.pending[key] = count
+        else:
+            self.pending.pop(key, None)
+
+    def _append(self, username: str, label: str, delta: int) -> int:
+        self.seq += 1
+        self.log.append(self.seq, username, label, delta)
+        return self.seq
+
+    def stage(self, username: str, label: str, delta: int) -> int:
+        """Log a change of a transaction that has yet to commit, returning its number."""
+        seq = self._append(username, label, delta)
+        self._staged.append((seq, username, label, delta))
+        return seq
+
+    def commit(self):
+        """Count the staged changes, once their transaction committed."""
+        for _, username, label, delta in self._staged:
+            self._add(username, label, delta)
+        self._staged.clear()
+
+    def rollback(self):
+        """Cancel the staged changes, once their transaction rolled back."""
+        for _, username, label, delta in self._staged:
+            self._append(username, label, -delta)
+        self._staged.clear()
+
+    @property
+    def full(self) -> bool:
+        """Whether enough changes are pending to flush them."""
+        return len(self.pending) >= self.max_pending
+
+    def get(self, username: str, label: str) -> int:
+        return self.pending.get((username, label), 0)
+
+    @property
+    def dirty(self) -> bool:
+        """Whether there are logged changes that were not flushed."""
+        return self.seq != self.flushed_seq
+
+    def flushed(self):
+        """Forget the pending changes once a flush of all of them has been committed."""
+        self.flushed_seq = self.seq
+        self.pending.clear()
+        self.log.truncate()
@@ -0,0 +1,93 @@
+"""GIF encoders for the NFTs.
+
+The legacy encoder hands PIL full RGB frames, which makes it quantize every frame
+independently. The palette encoders compute one adaptive palette per NFT and quantize
+every frame against it, so PIL only has to store the regions that change between
+frames (unchanged pixels become transparent).
+"""
+
+from typing import Dict, List, Optional
+
+from PIL import Image
+from PIL.Image import Image as ImgType
+
+# Encoder settings keyed by name. "colors" stays below 256 so PIL has a spare palette
+# entry to use as the transparent color for the unchanged pixels of each delta frame.
+GIF_ENCODERS: Dict[str, Optional[dict]] = {
+    # Quantize every frame independently (slow, large output)
+    "legacy": None,
+    # Fastest encode
+    "fast": {
+        "colors": 255,
+        "method": Image.Quantize.FASTOCTREE,
+        "dither": Image.Dither.NONE,
+        "sample_frames": 8,
+    },
+    # Smallest output
+    "small": {
+        "colors": 127,
+        "method": Image.Quantize.MEDIANCUT,
+        "dither": Image.Dither.NONE,
+        "sample_frames": 8,
+    },
+    # Smoothest gradients (dithering makes the delta frames much larger)
+    "quality": {
+        "colors": 255,
+        "method": Image.Quantize.MEDIANCUT,
+        "dither": Image.Dither.FLOYDSTEINBERG,
+        "sample_frames": 16,
+    },
+}
+
+
+def build_shared_palette(
+    frames: List[ImgType],
+    colors: int = 255,
+    method: Image.Quantize = Image.Quantize.FASTOCTREE,
+    sample_frames: int = 8,
+) -> ImgType:
+    """Compute one adaptive palette from an evenly spaced sample of the frames."""
+    step = max(1, len(frames) // sample_frames)
+    samples = frames[::step]
+
+    # Stack the samples vertically and quantize them as a single image
+    width, height = frames[0].size
+    mosaic = Image.new(mode="RGB", size=(width, height * len(samples)))
+    for i, frame in enumerate(samples):
+        mosaic.paste(frame, (0, height * i))
+
+    return mosaic.quantize(colors=colors, method=method)
+
+
+def quantize_frames(
+    frames: List[ImgType],
+    colors: int = 255,
+    method: Image.Quantize = Image.Quantize.FASTOCTREE,
+    dither: Image.Dither = Image.Dither.NONE,
+    sample_frames: int = 8,
+) -> List[ImgType]:
+    """Quantize every frame against a single shared palette."""
+    palette = build_shared_palette(frames, colors, method, sample_frames)
+    return [frame.quantize(palette=palette, dither=dither) for frame in frames]
+
+
+def save_gif(
+    frames: List[ImgType], filename, encoder: str = "fast", duration: int = 10
+):
+    """Save the frames as a looping gif using one of the GIF_ENCODERS.
+
+    `filename` may be a path or a writable file object.
+    """
+    settings = GIF_ENCODERS[encoder]
+    if settings is not None:
+        frames = quantize_frames(frames, **settings)
+
+    frames[0].save(
+        filename,
+        format="GIF",
+        save_all=True,
+        append_images=frames[1:],
+        optimize=True,
+        duration=duration,
+        loop=0,
+    )
@@ -1,16 +1,21 @@
-from typing import List, Coroutine, Callable, Tuple, Optional
-from requests import Session, Request, get
+from typing import Dict, List, Coroutine, Callable, Tuple, Optional
 import dotenv
 import os
 import json
 import functools
 import asyncio
 import secrets
+import threading
 
 from eth_account import Account
 from web3 import Web3
 from web3.gas_strategies.rpc import rpc_gas_price_strategy
 
+from .ipfs import IPFSClient, PINATA_GATEWAY_URL, PINATA_PIN_URL
+from .minting import MintBatcher, MintNotSent
+from .rpcbatch import BulkReader
+from .txmanager import TransactionManager, TransactionReverted
+
 # Initialize the environment variables
 dotenv.load_dotenv()
 ALCHEMY_TOKEN = os.getenv("ALCHEMY_TOKEN")
@@ -20,12 +25,13 @@ CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS")
 OWNER_ADDRESS = os.getenv("OWNER_ADDRESS")
 OWNER_PRIVATE_KEY = os.getenv("OWNER_PRIVATE_KEY")
 
-# Prepare the IPFS url, payload and header
-ipfs_url = "https://api.pinata.cloud/pinning/pinFileToIPFS"
-ipfs_headers = {
-    "pinata_api_key": PINATA_API_KEY,
-    "pinata_secret_api_key": PINATA_SECRET_KEY,
-}
+# Share one pooled IPFS client (the URLs can point at a local mock server)
+ipfs_client = IPFSClient(
+    PINATA_API_KEY,
+    PINATA_SECRET_KEY,
+    pin_url=os.getenv("PINATA_PIN_URL", PINATA_PIN_URL),
+    gateway_url=os.getenv("IPFS_GATEWAY_URL", PINATA_GATEWAY_URL),
+)
 
 # Instantiate the web3 client once since this is time-consuming
 ALCHEMY_URL = f"https://eth-goerli.g.alchemy.com/v2/{ALCHEMY_TOKEN}"
@@ -35,6 +41,14 @@ w3.eth.set_gas_price_strategy(rpc_gas_price_strategy)
 # Create the account object
 account = w3.eth.account.from_key(OWNER_PRIVATE_KEY)
 
+# Send the owner's transactions through one manager, so they never race on a nonce
+tx_manager = TransactionManager(w3, account)
+tx_managers = {account.address: tx_manager}
+tx_managers_lock = threading.Lock()
+
+# Batch (and cache per block) the balance and owner reads
+bulk_reader = BulkReader(ALCHEMY_URL, CONTRACT_ADDRESS)
+
 # Load the ABI once into memory
 with open("contracts/XmasLootBox_abi.json", "r") as f:
     CONTRACT_ABI = json.load(f)
@@ -55,51 +69,39 @@ def to_thread(func: Callable) -> Coroutine:
     return wrapper
 
 
+def get_tx_manager(private_key: str) -> TransactionManager:
+    """Get the transaction manager of an account."""
+    acct = w3.eth.account.from_key(private_key)
+    with tx_managers_lock:
+        if acct.address not in tx_managers:
+            tx_managers[acct.address] = TransactionManager(w3, acct)
+        return tx_managers[acct.address]
+
+
+async def send_transaction(manager: TransactionManager, txn: dict) -> dict:
+    """Send a transaction through a manager and wait for its receipt."""
+    future = await asyncio.to_thread(manager.submit, txn)
+    return await asyncio.wrap_future(future)
+
+
 @to_thread
 def pin_to_ipfs(filenames: List[str]) -> str:
     """Pins all contents of a directory to IPFS and returns the CID hash.
     NOTE: All files must be in the same directory for this to work.
     """
-    # Prepare the files
-    directory = os.path.dirname(filenames[0])
-    files = [
-        ("pinataMetadata", (None, '{"name":"' + directory.split(os.sep)[-1] + '"}'))
-    ]
-
-    for filename in filenames:
-        files.append(
-            ("file", (os.sep.join(filename.split(os.sep)[-2:]), open(filename, "rb")))
-        )
+    return ipfs_client.pin(filenames)
 
-    # Post the request
-    request = Request(
-        "POST",
-        ipfs_url,
-        headers=ipfs_headers,
-        files=files,
-    ).prepare()
-    response = Session().send(request)
 
-    if not response.ok:
-        raise RuntimeError(f"Could not pin to IPFS.\n{response.text}")
-
-    return response.json()["IpfsHash"]
+@to_thread
+def pin_many_to_ipfs(gifts: List[List[str]]) -> List[str]:
+    """Pins several directories to IPFS concurrently and returns their CID hashes."""
+    return ipfs_client.pin_many(gifts)
 
 
 @to_thread
 def get_from_ipfs(cid: str, filename: str) -> str:
-    """Download a file from IPFS."""
-    # Request the file
-    url = f"https://violet-legal-antelope-340.mypinata.cloud/ipfs/{cid}/{filename}"
-    response = get(url)
-
-    if not response.ok:
-        raise RuntimeError(f"Could not retrieve from IPFS.\n{response.text}")
-
-    # Save the file to /tmp
-    out_filename = f"/tmp/{filename}"
-    open(out_filename, "wb").write(response.content)
-    return out_filename
+    """Download a file from IPFS (cached locally by CID)."""
+    return ipfs_client.get(cid, filename)
 
 
 def create_acct() -> Tuple[str, str]:
@@ -112,27 +114,37 @@ def create_acct() -> Tuple[str, str]:
     return private_key, acct.address
 
 
-@to_thread
-def mint_nfts(addr: str, ipfs_cids: List[str]) -> bool:
-    """Mint the NFT located at `ipfs_cid` to address `addr`"""
+async def send_mint_batch(recipients: List[str], ipfs_cids: List[str]) -> dict:
+    """Mint the NFT located at `ipfs_cids[i]` to address `recipients[i]`."""
+    # Build the transaction (the manager sets the nonce)
     try:
-        # Get the the current nonce of the owner
-        nonce = w3.eth.get_transaction_count(OWNER_ADDRESS)
-
-        # Build the transaction
-        txn = contract.functions.mint4NFTs(addr, ipfs_cids).build_transaction(
+        txn = await asyncio.to_thread(
+            contract.functions.mintBatch(recipients, ipfs_cids).build_transaction,
             {
                 "from": account.address,
-                "nonce": nonce,
                 # "maxPriorityFeePerGas": w3.toWei(10, "gwei"),  # See issue #20 for math
                 # "maxFeePerGas": w3.toWei(200, "gwei"),  # See issue #20 for math
-            }
+            },
         )
+    except Exception as exc:
+        # Building estimates the gas, which fails if the batch would revert
+        raise MintNotSent(f"Could not build the mint batch: {exc}") from exc
 
-        # Sign and send the transaction
-        signed_txn = w3.eth.account.sign_transaction(txn, account.key)
-        txn_hash = w3.eth.send_raw_transaction(signed_txn.rawTransaction)
-        w3.eth.waitForTransactionReceipt(txn_hash, timeout=100000)
+    # Sign and send the transaction
+    try:
+        return await send_transaction(tx_manager, txn)
+    except TransactionReverted as exc:
+        raise MintNotSent(str(exc)) from exc
+
+
+# Mint the gifts claimed around the same time in one transaction
+mint_batcher = MintBatcher(send_mint_batch)
+
+
+async def mint_nfts(addr: str, ipfs_cids: List[str]) -> bool:
+    """Mint the NFT located at `ipfs_cid` to address `addr`"""
+    try:
+        await mint_batcher.mint(addr, ipfs_cids)
         return True
     except Exception as exc:
         print(exc)
@@ -142,72 +154,69 @@ def mint_nfts(addr: str, ipfs_cids: List[str]) -> bool:
 @to_thread
 def get_balance(addr: str) -> Tuple[float, int]:
     """Get the current ethereum balance in Eth."""
-    # Get the the current nonce of the owner
-    eth_balance = w3.fromWei(w3.eth.getBalance(addr), "ether")
-    # Get the number of NFTs
-    nft_balance = contract.functions.balanceOf(addr).call()
-    return eth_balance, nft_balance
+    wei, nft_balance = bulk_reader.get_balances([addr])[addr]
+    return w3.fromWei(wei, "ether"), nft_balance
+
+
+@to_thread
+def get_balances(addrs: List[str]) -> Dict[str, Tuple[float, int]]:
+    """Get the ethereum balance in Eth and the number of NFTs of many addresses at once."""
+    balances = bulk_reader.get_balances(addrs)
+    return {
+        addr: (w3.fromWei(wei, "ether"), nft_balance)
+        for addr, (wei, nft_balance) in balances.items()
+    }
 
 
 @to_thread
 def get_owner(nft_id: str) -> Optional[str]:
     """Get the owner of this NFT."""
     try:
-        return contract.functions.ownerOf(nft_id).call()
+        return bulk_reader.get_owners([int(nft_id)])[int(nft_id)]
     except Exception as exc:
         print(exc)
         return None
 
 
 @to_thread
-def transfer_nft(
+def get_owners(nft_ids: List[int]) -> Dict[int, Optional[str]]:
+    """Get the owners of many NFTs at once (None if an NFT does not exist)."""
+    return bulk_reader.get_owners(nft_ids)
+
+
+async def transfer_nft(
     sender_addr: str, sender_priv: str, recipient_addr: str, nft_id: int
 ) -> bool:
     """Transfer nft # nft_id from sender_addr to recipient_addr."""
     try:
-        # Get the the current nonce of the owner
-        nonce = w3.eth.get_transaction_count(sender_addr)
-
-        # Build the transaction
-        txn = contract.functions.transferFrom(
-            sender_addr, recipient_addr, nft_id
-        ).build_transaction(
-            {
-                "from": sender_addr,
-                "nonce": nonce,
-            }
+        # Build the transaction (the manager sets the nonce)
+        txn = await asyncio.to_thread(
+            contract.functions.transferFrom(
+                sender_addr, recipient_addr, nft_id
+            ).build_transaction,
+            {"from": sender_addr},
         )
 
         # Sign and send the transaction
-        signed_txn = w3.eth.account.sign_transaction(txn, sender_priv)
-        txn_hash = w3.eth.send_raw_transaction(signed_txn.rawTransaction)
-        w3.eth.waitForTransactionReceipt(txn_hash, timeout=100000)
+        await send_transaction(get_tx_manager(sender_priv), txn)
         return True
     except Exception as exc:
         print(exc)
         return False
 
 
-@to_thread
-def send_daily_eth(addr) -> bool:
+async def send_daily_eth(addr) -> bool:
     """Transfer 0.010 ETH to a user."""
     try:
-        # Get the the current nonce of the owner
-        nonce = w3.eth.get_transaction_count(OWNER_ADDRESS)
-
-        # Build the transaction
+        # Build the transaction (the manager sets the nonce and gas price)
         txn = {
-            "nonce": nonce,
             "to": addr,
             "value": w3.toWei(0.01, "ether"),
-            "gasPrice": w3.eth.generate_gas_price(),
             "gas": 21000,  # standard value
         }
 
         # Sign and send the transaction
-        signed_txn = w3.eth.account.sign_transaction(txn, account.key)
-        txn_hash = w3.eth.send_raw_transaction(signed_txn.rawTransaction)
-        w3.eth.waitForTransactionReceipt(txn_hash, timeout=100000)
+        await send_transaction(tx_manager, txn)
         return True
     except Exception as exc:
         print(exc)
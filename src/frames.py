@@ -0,0 +1,166 @@
+"""Decoded frame assets.
+
+Every frame gif is decoded, resized and converted to RGBA once and then kept in memory,
+so that framing an NFT only has to paste the artwork underneath the cached frames.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from PIL.Image import Image as ImgType
+
+from .constants import FRAME_DIR, FRAME_CACHE_BYTES, IMG_WIDTH, IMG_HEIGHT
+from .rarity import get_frame_names, get_rarity_labels
+
+
+def get_frame_offset(frame_name: str) -> int:
+    """Get an offset padding based on the frame."""
+    if frame_name in [None, "speedlines", "rain_of_gold", "astro"]:
+        # NOTE: The speedlines and rain of gold frames look a lot better
+        #       if you don't create a buffer border.
+        offset = 0
+    else:
+        # NOTE: This offset creates a buffer border to prevent the frame from
+        #       overlapping the image.
+        offset = 140
+    return offset
+
+
+class FrameAsset:
+    """A frame gif that has been decoded and is ready to be composited."""
+
+    def __init__(
+        self,
+        name: str,
+        frames: List[ImgType],
+        durations: List[int],
+    ):
+        self.name = name
+        self.offset = get_frame_offset(name)
+        self.size: Tuple[int, int] = (IMG_WIDTH + self.offset, IMG_HEIGHT + self.offset)
+        self.frames = frames
+        self.masks = [frame.getchannel("A") for frame in frames]
+        self.durations = durations
+        self._stack = None
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    @property
+    def stack(self) -> np.ndarray:
+        """Every frame stacked into a single (N, H, W, 4) uint8 array.
+
+        This is built on first use since only the numpy compositor needs it.
+        """
+        if self._stack is None:
+            self._stack = np.stack([np.asarray(frame) for frame in self.frames])
+        return self._stack
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate memory held by the decoded frames, masks and stack."""
+        width, height = self.size
+        bytes_per_pixel = 5 if self._stack is None else 9
+        return len(self.frames) * width * height * bytes_per_pixel
+
+
+def load_frame_asset(frame_name: str) -> FrameAsset:
+    """Decode a frame gif, resizing every frame and converting it to RGBA."""
+    frame_path = os.path.join(FRAME_DIR, f"{frame_name}.gif")
+    offset = get_frame_offset(frame_name)
+    size = (IMG_WIDTH + offset, IMG_HEIGHT + offset)
+
+    frames = []
+    durations = []
+    with Image.open(frame_path) as frame_gif:
+        # NOTE: The first frame of the gif is skipped.
+        try:
+            while 1:
+                frame_gif.seek(frame_gif.tell() + 1)
+                frame_img = frame_gif.resize(size)
+                frames.append(frame_img.convert("RGBA"))
+                durations.append(frame_gif.info.get("duration", 0))
+        except EOFError:
+            pass  # end of sequence
+
+    return FrameAsset(frame_name, frames, durations)
+
+
+def get_all_frame_names() -> List[str]:
+    """Get every frame name, ordered from the most to the least common rarity."""
+    return [
+        frame_name
+        for rarity_label in get_rarity_labels()
+        for frame_name in get_frame_names(rarity_label)
+        if frame_name is not None
+    ]
+
+
+class FrameCache:
+    """An LRU cache of decoded frame assets, bounded by a memory budget in bytes."""
+
+    def __init__(self, max_bytes: Optional[int] = FRAME_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._assets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate memory held by every cached asset."""
+        return sum(asset.nbytes for asset in self._assets.values())
+
+    def __contains__(self, frame_name: str) -> bool:
+        return frame_name in self._assets
+
+    def get(self, frame_name: str) -> FrameAsset:
+        """Get a decoded frame asset, loading it if it is not cached."""
+        with self._lock:
+            if frame_name in self._assets:
+                self._assets.move_to_end(frame_name)
+                return self._assets[frame_name]
+
+            asset = load_frame_asset(frame_name)
+            self._assets[frame_name] = asset
+            self._evict(keep=frame_name)
+            return asset
+
+    def _evict(self, keep: str):
+        """Evict the least recently used assets until the cache is within budget."""
+        while self.max_bytes is not None and self.nbytes > self.max_bytes:
+            name = next(iter(self._assets))
+            if name == keep:
+                break
+            del self._assets[name]
+
+    def preload(self, frame_names: Optional[List[str]] = None):
+        """Load frame assets up front, stopping before the memory budget is exceeded."""
+        if frame_names is None:
+            frame_names = get_all_frame_names()
+
+        for frame_name in frame_names:
+            if frame_name in self:
+                continue
+            asset = load_frame_asset(frame_name)
+            with self._lock:
+                limited = self.max_bytes is not None
+                if limited and self.nbytes + asset.nbytes > self.max_bytes:
+                    break
+                self._assets[frame_name] = asset
+
+    def clear(self):
+        """Drop every cached asset."""
+        with self._lock:
+            self._assets.clear()
+
+
+# One cache per process (each render worker has its own)
+frame_cache = FrameCache()
+
+
+def preload_frames():
+    """Fill this process's frame cache. Used as the render worker initializer."""
+    frame_cache.preload()
@@ -0,0 +1,272 @@
+"""Dalle generation service.
+
+All image requests go through one shared AsyncOpenAI client. Requests are queued per
+user and served round-robin, so one user's gift cannot starve everyone else during
+the morning rush, and a token bucket keeps us under the account's images/minute limit.
+Transient errors are retried with exponential backoff and jitter. Every image is
+also stored in the art cache, so regenerating a gift can reuse its art.
+"""
+
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+from PIL.Image import Image as ImgType
+
+from .artcache import ArtCache, get_art_key
+from .constants import DALLE_CONCURRENCY, DALLE_IMAGES_PER_MINUTE
+from .generators import DALLE_PARAMS, decode_dalle_response, save_art
+
+# Errors worth retrying (everything else fails the request immediately)
+RETRYABLE_ERRORS = (
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
+
+
+class TokenBucket:
+    """A token bucket rate limiter for use from a single event loop."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else max(1, rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self, seconds: float):
+        """Take every token, e.g. when the API says to back off for `seconds`."""
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class GenerationMetrics:
+    """Counters describing the generation queue."""
+
+    def __init__(self):
+        self.requests = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait: float):
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self, queue_depth: int) -> Dict[str, float]:
+        """Get the current metrics, including the number of queued requests."""
+        started = self.completed + self.failed
+        return {
+            "queue_depth": queue_depth,
+            "requests": self.requests,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retries": self.retries,
+            "cache_hits": self.cache_hits,
+            "mean_wait": self.total_wait / started if started else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class _Job:
+    def __init__(
+        self, description: str, img_file: str, key: str, future: asyncio.Future
+    ):
+        self.description = description
+        self.img_file = img_file
+        self.key = key
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class GenerationService:
+    """Queue, rate-limit and retry Dalle requests across every user."""
+
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        images_per_minute: float = DALLE_IMAGES_PER_MINUTE,
+        concurrency: int = DALLE_CONCURRENCY,
+        max_retries: int = 5,
+        base_delay: float = 2.0,
+        max_delay: float = 60.0,
+        timeout: float = 120.0,
+        cache: Optional[ArtCache] = None,
+    ):
+        # Retries are handled here, so turn off the client's own retries
+        self.client = client or AsyncOpenAI(timeout=timeout, max_retries=0)
+        self.cache = cache if cache is not None else ArtCache()
+        self.bucket = TokenBucket(images_per_minute)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = GenerationMetrics()
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._ready = None
+        self._workers = []
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of requests waiting to be sent."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> Dict[str, float]:
+        """Get the queue metrics."""
+        return self.metrics.snapshot(self.queue_depth)
+
+    async def generate(
+        self,
+        username: str,
+        description: str,
+        img_file: str,
+        reuse: bool = False,
+        variant: int = 0,
+    ) -> Tuple[ImgType, str]:
+        """Queue a Dalle request for a user and wait for the image and revised prompt.
+
+        With `reuse`, cached art for the same prompt (and `variant`) is returned
+        instead of generating a new image. This is meant for regenerating a gift that
+        failed after its art was created.
+        """
+        key = get_art_key(description, DALLE_PARAMS, variant)
+        if reuse:
+            cached = await asyncio.to_thread(self._load_cached, key, img_file)
+            if cached is not None:
+                self.metrics.cache_hits += 1
+                return cached
+
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(username, deque()).append(
+            _Job(description, img_file, key, future)
+        )
+        self.metrics.requests += 1
+        self._ready.release()
+        return await future
+
+    def _start(self):
+        """Start the worker tasks on first use (they need a running event loop)."""
+        if self._workers:
+            return
+        self._ready = asyncio.Semaphore(0)
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.concurrency)
+        ]
+
+    def _next_job(self) -> _Job:
+        """Pop the next job, taking turns between users."""
+        username, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        if queue:
+            # Send this user to the back of the line
+            self._queues.move_to_end(username)
+        else:
+            del self._queues[username]
+        return job
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            job = self._next_job()
+            if job.future.cancelled():
+                continue
+
+            await self.bucket.acquire()
+            self.metrics.record_wait(time.monotonic() - job.enqueued)
+            try:
+                result = await self._request(job.description, job.img_file, job.key)
+            except Exception as exc:
+                self.metrics.failed += 1
+                if not job.future.cancelled():
+                    job.future.set_exception(exc)
+            else:
+                self.metrics.completed += 1
+                if not job.future.cancelled():
+                    job.future.set_result(result)
+
+    def _load_cached(self, key: str, img_file: str) -> Optional[Tuple[ImgType, str]]:
+        """Copy cached art to `img_file`, returning None if it is not cached."""
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        imgbytes, revised_prompt = cached
+        return save_art(imgbytes, img_file), revised_prompt
+
+    def _save(self, key: str, response, img_file: str) -> Tuple[ImgType, str]:
+        """Save the art from a Dalle response to `img_file` and the cache."""
+        imgbytes, revised_prompt = decode_dalle_response(response)
+        self.cache.put(key, imgbytes, revised_prompt)
+        return save_art(imgbytes, img_file), revised_prompt
+
+    async def _request(
+        self, description: str, img_file: str, key: str
+    ) -> Tuple[ImgType, str]:
+        """Send one request, retrying transient errors with backoff and jitter."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.images.generate(
+                    prompt=description, **DALLE_PARAMS
+                )
+                return await asyncio.to_thread(self._save, key, response, img_file)
+            except RETRYABLE_ERRORS as exc:
+                if attempt == self.max_retries:
+                    raise
+
+                # Full jitter, but respect the server's Retry-After if it gave one
+                delay = random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2**attempt)
+                )
+                retry_after = _get_retry_after(exc)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                    self.bucket.drain(retry_after)
+
+                self.metrics.retries += 1
+                print(f"Dalle request failed ({exc}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        """Stop the workers and close the client."""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        await self.client.close()
+
+
+def _get_retry_after(exc: Exception) -> Optional[float]:
+    """Get the Retry-After delay (seconds) from an API error, if there is one."""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
@@ -6,35 +6,46 @@ from base64 import b64decode
 from .constants import ASSET_DIR
 from io import BytesIO
 
+# The Dalle request parameters (everything except the prompt)
+DALLE_PARAMS = {
+    "model": "dall-e-3",
+    "size": "1024x1024",
+    "quality": "standard",
+    "response_format": "b64_json",
+    "n": 1,
+}
+
 
 def generate_dalle_art(
     openai_client, description: str, img_file: str
 ) -> Tuple[ImgType, str]:
     """Execute the Dalle-3 art generation API using the provided credentials and text prompt."""
     # Query the image
-    response = openai_client.images.generate(
-        model="dall-e-3",
-        prompt=description,
-        size="1024x1024",
-        quality="standard",
-        response_format="b64_json",
-        n=1,
-    )
+    response = openai_client.images.generate(prompt=description, **DALLE_PARAMS)
+    return save_dalle_response(response, img_file)
 
-    imgbytes = b64decode(response.data[0].b64_json)
-    with open(img_file, mode="wb") as png:
-        png.write(imgbytes)
 
-    # Return the list of images
-    img = Image.open(BytesIO(imgbytes))
+def save_dalle_response(response, img_file: str) -> Tuple[ImgType, str]:
+    """Save the image from a Dalle response and return it with the revised prompt."""
+    imgbytes, revised_prompt = decode_dalle_response(response)
+    return save_art(imgbytes, img_file), revised_prompt
+
+
+def decode_dalle_response(response) -> Tuple[bytes, str]:
+    """Get the png bytes and the revised prompt from a Dalle response."""
+    imgbytes = b64decode(response.data[0].b64_json)
     revised_prompt = response.data[0].revised_prompt
+    return imgbytes, revised_prompt
+
 
-    return img, revised_prompt
+def save_art(imgbytes: bytes, img_file: str) -> ImgType:
+    """Write the png bytes to `img_file` and return the image."""
+    with open(img_file, mode="wb") as png:
+        png.write(imgbytes)
+    return Image.open(BytesIO(imgbytes))
 
 
-def generate_example_art(
-    unq_img_dir: str
-) -> ImgType:
+def generate_example_art(unq_img_dir: str) -> ImgType:
     """Just generate some example artwork for testing."""
     # Load the example images
     image = Image.open(os.path.join(ASSET_DIR, f"example/1.png"))
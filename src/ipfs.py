@@ -0,0 +1,218 @@
+"""IPFS pinning client (Pinata).
+
+One pooled requests.Session is shared by every upload and download. Uploads stream
+the multipart body from disk instead of building it in memory, several gift
+directories can be pinned concurrently, and downloads are cached on disk by CID (the
+content behind a CID never changes).
+"""
+
+import json
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .constants import IPFS_CACHE_DIR
+
+PINATA_PIN_URL = "https://api.pinata.cloud/pinning/pinFileToIPFS"
+PINATA_GATEWAY_URL = "https://violet-legal-antelope-340.mypinata.cloud/ipfs"
+
+# Status codes worth retrying
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# CIDs are base58 (v0) or base32 (v1), so a valid one is a safe directory name
+CID_PATTERN = re.compile(r"[A-Za-z0-9]+")
+
+
+class MultipartStream:
+    """A multipart/form-data body that reads its files lazily.
+
+    It has a length, so requests sends it with a Content-Length header and streams it
+    with read() rather than loading the files into memory.
+    """
+
+    def __init__(
+        self, fields: List[Tuple[str, str]], files: List[Tuple[str, str, str]]
+    ):
+        """`fields` are (name, value) pairs, `files` are (name, filename, path)."""
+        self.boundary = uuid.uuid4().hex
+        self._parts: List[Tuple[bytes, Optional[str]]] = []
+        for name, value in fields:
+            header = self._header(f'name="{name}"')
+            self._parts.append((header + value.encode("utf-8") + b"\r\n", None))
+        for name, filename, path in files:
+            header = self._header(
+                f'name="{name}"; filename="{filename}"',
+                "Content-Type: application/octet-stream\r\n",
+            )
+            self._parts.append((header, path))
+        self._closing = f"--{self.boundary}--\r\n".encode("utf-8")
+
+        self._length = len(self._closing) + sum(
+            len(header) + (os.path.getsize(path) + 2 if path else 0)
+            for header, path in self._parts
+        )
+        self._chunks = self._iter_chunks()
+        self._buffer = b""
+
+    def _header(self, disposition: str, extra: str = "") -> bytes:
+        return (
+            f"--{self.boundary}\r\n"
+            f"Content-Disposition: form-data; {disposition}\r\n{extra}\r\n"
+        ).encode("utf-8")
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _iter_chunks(self, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        for header, path in self._parts:
+            yield header
+            if path is not None:
+                with open(path, "rb") as f:
+                    while True:
+                        chunk = f.read(chunk_size)
+                        if not chunk:
+                            break
+                        yield chunk
+                yield b"\r\n"
+        yield self._closing
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to `size` bytes of the body (everything that is left if negative)."""
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class IPFSClient:
+    """Pin files to IPFS and fetch them back through a gateway."""
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        secret_key: Optional[str],
+        pin_url: str = PINATA_PIN_URL,
+        gateway_url: str = PINATA_GATEWAY_URL,
+        cache_dir: str = IPFS_CACHE_DIR,
+        max_workers: int = 4,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 120.0,
+    ):
+        self.pin_url = pin_url
+        self.gateway_url = gateway_url.rstrip("/")
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"pinata_api_key": api_key or "", "pinata_secret_api_key": secret_key or ""}
+        )
+        # GETs are retried by urllib3. A streamed POST body cannot be replayed, so
+        # pins are retried by pin() with a fresh body instead.
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["GET"]),
+        )
+        adapter = HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def pin(self, filenames: List[str]) -> str:
+        """Pin files as one directory to IPFS and return the directory's CID.
+
+        NOTE: All files must be in the same directory for this to work.
+        """
+        directory = os.path.dirname(filenames[0])
+        dirname = directory.split(os.sep)[-1]
+        fields = [("pinataMetadata", json.dumps({"name": dirname}))]
+        files = [
+            ("file", os.sep.join(filename.split(os.sep)[-2:]), filename)
+            for filename in filenames
+        ]
+
+        for attempt in range(self.max_retries + 1):
+            body = MultipartStream(fields, files)
+            try:
+                response = self.session.post(
+                    self.pin_url,
+                    data=body,
+                    headers={"Content-Type": body.content_type},
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt == self.max_retries:
+                    raise RuntimeError(f"Could not pin to IPFS.\n{exc}")
+            else:
+                if response.ok:
+                    return response.json()["IpfsHash"]
+                retryable = response.status_code in RETRY_STATUSES
+                if not retryable or attempt == self.max_retries:
+                    raise RuntimeError(f"Could not pin to IPFS.\n{response.text}")
+            time.sleep(self.backoff * 2**attempt)
+
+    def pin_many(self, gifts: List[List[str]]) -> List[str]:
+        """Pin several directories concurrently, returning their CIDs in order."""
+        return list(self._executor.map(self.pin, gifts))
+
+    def get(self, cid: str, filename: str) -> str:
+        """Download a file from IPFS, returning the path of the cached copy."""
+        # Never let a crafted CID or filename write outside of the cache
+        basename = os.path.basename(filename)
+        if not CID_PATTERN.fullmatch(cid) or basename in ("", ".", ".."):
+            raise ValueError(f"Invalid IPFS file {cid}/{filename}.")
+        out_filename = os.path.join(self.cache_dir, cid, basename)
+        if os.path.exists(out_filename):
+            return out_filename
+
+        url = f"{self.gateway_url}/{cid}/{filename}"
+        tmp_file = f"{out_filename}.{uuid.uuid4().hex}.tmp"
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                if not response.ok:
+                    raise RuntimeError(
+                        f"Could not retrieve from IPFS.\n{response.text}"
+                    )
+
+                # Download to a temporary file so a failed download is never cached
+                os.makedirs(os.path.dirname(out_filename), exist_ok=True)
+                with open(tmp_file, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                os.replace(tmp_file, out_filename)
+        except requests.RequestException as exc:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise RuntimeError(f"Could not retrieve from IPFS.\n{exc}")
+
+        return out_filename
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
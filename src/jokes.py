@@ -0,0 +1,147 @@
+"""Christmas joke provider.
+
+Jokes are prefetched from the joke API into a buffer by a background task, so !joke
+never waits on the network. Recently told jokes are skipped, and when the buffer is
+empty (or the API is down) a joke is picked from the bundled corpus in assets/jokes.json.
+"""
+
+import asyncio
+import json
+import os
+import random
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import aiohttp
+
+from .constants import ASSET_DIR, JOKE_API_URL
+
+# Joke API query parameters
+JOKE_PARAMS = {"blacklistFlags": "nsfw,religious,political,racist,sexist,explicit"}
+
+# The text fields of each type of joke
+JOKE_FIELDS = {"single": ("joke",), "twopart": ("setup", "delivery")}
+
+
+def get_joke_key(joke: Dict) -> str:
+    """Identify a joke, to avoid telling it twice in a row."""
+    if "id" in joke:
+        return str(joke["id"])
+    return joke.get("joke") or joke.get("setup", "")
+
+
+def is_valid_joke(joke: Dict) -> bool:
+    """Check that a joke has the text fields of its type."""
+    fields = JOKE_FIELDS.get(joke.get("type"))
+    return fields is not None and all(isinstance(joke.get(f), str) for f in fields)
+
+
+def load_joke_corpus(filename: Optional[str] = None) -> List[Dict]:
+    """Load the bundled jokes (same shape as the joke API's jokes)."""
+    if filename is None:
+        filename = os.path.join(ASSET_DIR, "jokes.json")
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+class JokeService:
+    """A prefetched buffer of jokes with an offline fallback."""
+
+    def __init__(
+        self,
+        url: str = JOKE_API_URL,
+        corpus: Optional[List[Dict]] = None,
+        buffer_size: int = 20,
+        batch_size: int = 10,
+        recent_size: int = 20,
+        timeout: float = 5.0,
+        retry_delay: float = 60.0,
+    ):
+        self.url = url
+        self.corpus = corpus if corpus is not None else load_joke_corpus()
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retry_delay = retry_delay
+        self._buffer: Deque[Dict] = deque(maxlen=buffer_size)
+        self._recent: Deque[str] = deque(maxlen=recent_size)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._refill_task: Optional[asyncio.Task] = None
+
+    def get_joke(self) -> Dict:
+        """Get a joke that was not told recently, without waiting on the network."""
+        joke = None
+        while self._buffer:
+            candidate = self._buffer.popleft()
+            if get_joke_key(candidate) not in self._recent:
+                joke = candidate
+                break
+
+        if joke is None:
+            joke = self.get_corpus_joke()
+        else:
+            self._recent.append(get_joke_key(joke))
+        self.schedule_refill()
+        return joke
+
+    def get_corpus_joke(self) -> Dict:
+        """Get a bundled joke that was not told recently (e.g. if an API joke fails)."""
+        fresh = [j for j in self.corpus if get_joke_key(j) not in self._recent]
+        joke = random.choice(fresh or self.corpus)
+        self._recent.append(get_joke_key(joke))
+        return joke
+
+    def schedule_refill(self):
+        """Top up the buffer in the background (if an event loop is running)."""
+        if self._refill_task is not None and not self._refill_task.done():
+            return
+        try:
+            self._refill_task = asyncio.get_running_loop().create_task(self.refill())
+        except RuntimeError:
+            pass
+
+    async def refill(self):
+        """Fetch jokes until the buffer is full, backing off while the API fails."""
+        while len(self._buffer) < self.buffer_size:
+            try:
+                jokes = await self.fetch(self.batch_size)
+            except Exception as exc:
+                # Keep refilling whatever went wrong, or the buffer is never filled again
+                print(f"Could not fetch jokes: {exc!r}")
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            seen = {get_joke_key(j) for j in self._buffer}.union(self._recent)
+            new_jokes = [joke for joke in jokes if get_joke_key(joke) not in seen]
+            if not new_jokes:
+                # The API has nothing we have not told recently
+                return
+            self._buffer.extend(new_jokes[: self.buffer_size - len(self._buffer)])
+
+    async def fetch(self, amount: int) -> List[Dict]:
+        """Fetch a batch of jokes from the API."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+
+        params = dict(JOKE_PARAMS, amount=str(amount))
+        async with self._session.get(self.url, params=params) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+
+        if not isinstance(data, dict):
+            raise ValueError(f"Unexpected joke API response: {data!r}")
+        if data.get("error"):
+            raise ValueError(data.get("message", "joke API error"))
+        # A single joke is returned on its own, several are returned in a list
+        jokes = data["jokes"] if "jokes" in data else [data]
+        if not isinstance(jokes, list) or not all(isinstance(j, dict) for j in jokes):
+            raise ValueError(f"Unexpected joke API response: {data!r}")
+        # Drop the jokes that could not be told
+        return [joke for joke in jokes if is_valid_joke(joke)]
+
+    async def close(self):
+        """Stop refilling and close the HTTP session."""
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,125 @@
+"""Cross-process semaphore backed by the state database.
+
+Bot shards running in separate processes share the machine's cores, so the number of
+gifts being rendered at once is bounded by slots leased from a table in the shared
+SQLite database. A lease expires after `ttl` seconds, so the slots of a shard that
+crashed are freed again.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from .constants import STATE_DB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (name, slot)
+)
+"""
+
+
+class LeaseSemaphore:
+    """At most `slots` holders of `name` at once, across every process."""
+
+    def __init__(
+        self,
+        name: str,
+        slots: int,
+        filename: str = STATE_DB,
+        ttl: float = 900.0,
+        poll_interval: float = 0.5,
+    ):
+        self.name = name
+        self.slots = slots
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            filename, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SCHEMA)
+
+    def try_acquire(self) -> Optional[int]:
+        """Lease a free slot, returning None if every slot is taken."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.execute(
+                    "DELETE FROM leases WHERE name = ? AND expires < ?",
+                    (self.name, now),
+                )
+                taken = {
+                    slot
+                    for (slot,) in cur.execute(
+                        "SELECT slot FROM leases WHERE name = ?", (self.name,)
+                    )
+                }
+                free = [slot for slot in range(self.slots) if slot not in taken]
+                if free:
+                    cur.execute(
+                        "INSERT INTO leases (name, slot, owner, expires) "
+                        "VALUES (?, ?, ?, ?)",
+                        (self.name, free[0], self.owner, now + self.ttl),
+                    )
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            else:
+                cur.execute("COMMIT")
+            finally:
+                cur.close()
+        return free[0] if free else None
+
+    def release(self, slot: int):
+        """Give a leased slot back."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM leases WHERE name = ? AND slot = ? AND owner = ?",
+                (self.name, slot, self.owner),
+            )
+
+    def release_all(self):
+        """Give back every slot leased by this process (e.g. when shutting down)."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM leases WHERE name = ? AND owner = ?",
+                (self.name, self.owner),
+            )
+
+    @asynccontextmanager
+    async def slot(self, timeout: Optional[float] = None):
+        """Hold a slot for the duration of an `async with` block.
+
+        Raises asyncio.TimeoutError if no slot frees up within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        slot = self.try_acquire()
+        while slot is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise asyncio.TimeoutError(f"No free {self.name} slot.")
+            await asyncio.sleep(self.poll_interval)
+            slot = self.try_acquire()
+
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def close(self):
+        self.release_all()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,128 @@
+"""Per-user claim ledger.
+
+Each user's claims are a bitset of days: bit i is set if the user claimed on day i,
+counting from LEDGER_EPOCH (January 1st of the event's year). The bitsets are Python
+ints of a few machine words, so checking a claim, counting the claims of a week and
+measuring a streak are a handful of bit operations, and a whole season of claims is
+stored in a few bytes per user.
+
+The ledger replaces the lists of hash((year, week, day)) day hashes, which are decoded
+by matching them against the hashes of every day of the event's year.
+"""
+
+import functools
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .constants import VALID_YEAR
+
+LEDGER_EPOCH = date(VALID_YEAR, 1, 1)
+
+
+def get_day_index(day: Optional[date] = None) -> int:
+    """Get the ledger bit of a day (today by default)."""
+    if day is None:
+        day = date.today()
+    day_index = (day - LEDGER_EPOCH).days
+    if day_index < 0:
+        raise ValueError(f"{day} is before the ledger epoch {LEDGER_EPOCH}.")
+    return day_index
+
+
+def get_day(day_index: int) -> date:
+    """Get the day of a ledger bit."""
+    return LEDGER_EPOCH + timedelta(days=day_index)
+
+
+def get_legacy_day_hash(day: date) -> int:
+    """The day hash the bot used to record claims with."""
+    year, week_num, day_num = day.isocalendar()
+    return hash((year, week_num, day_num))
+
+
+@functools.lru_cache(maxsize=1)
+def _get_day_of_hash() -> Dict[int, int]:
+    stop = (date(VALID_YEAR + 2, 1, 1) - LEDGER_EPOCH).days
+    return {get_legacy_day_hash(get_day(i)): i for i in range(stop)}
+
+
+def decode_day_hashes(day_hashes: Iterable[int]) -> Tuple[List[int], List[int]]:
+    """Decode legacy day hashes into ledger days.
+
+    Hashes of integer tuples are deterministic, so they are matched against every day
+    from the epoch to the end of the following year. Returns (days, undecoded hashes).
+    """
+    day_of_hash = _get_day_of_hash()
+    days, unknown = [], []
+    for day_hash in day_hashes:
+        if day_hash in day_of_hash:
+            days.append(day_of_hash[day_hash])
+        else:
+            unknown.append(day_hash)
+    return days, unknown
+
+
+def encode_days(bits: int) -> bytes:
+    """Serialize a bitset of days."""
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def decode_days(data: bytes) -> int:
+    """Deserialize a bitset of days."""
+    return int.from_bytes(data, "little")
+
+
+class ClaimLedger:
+    """The days each user claimed a gift on, as one bitset per user."""
+
+    def __init__(self, bits: Optional[Dict[str, int]] = None):
+        self.bits: Dict[str, int] = dict(bits) if bits is not None else {}
+
+    def __len__(self) -> int:
+        return len(self.bits)
+
+    def get(self, username: str) -> int:
+        """Get a user's bitset."""
+        return self.bits.get(username, 0)
+
+    def set(self, username: str, bits: int):
+        """Replace a user's bitset."""
+        self.bits[username] = bits
+
+    def has_claimed(self, username: str, day_index: int) -> bool:
+        return (self.get(username) >> day_index) & 1 == 1
+
+    def add(self, username: str, day_index: int) -> bool:
+        """Record a claim, returning False if it already was."""
+        if self.has_claimed(username, day_index):
+            return False
+        self.bits[username] = self.get(username) | (1 << day_index)
+        return True
+
+    def remove(self, username: str, day_index: int) -> bool:
+        """Remove a claim, returning False if there was none."""
+        if not self.has_claimed(username, day_index):
+            return False
+        self.bits[username] = self.get(username) & ~(1 << day_index)
+        return True
+
+    def days(self, username: str) -> List[int]:
+        """Get the days a user claimed on."""
+        bits = self.get(username)
+        return [i for i in range(bits.bit_length()) if (bits >> i) & 1]
+
+    def count(self, username: str, start: int, stop: int) -> int:
+        """Count a user's claims on the days in [start, stop)."""
+        return ((self.get(username) >> start) & ((1 << (stop - start)) - 1)).bit_count()
+
+    def count_week(self, username: str, day_index: int) -> int:
+        """Count a user's claims in the (Monday to Sunday) week of a day."""
+        # The first week of the year may start before the epoch
+        start = day_index - get_day(day_index).weekday()
+        return self.count(username, max(start, 0), start + 7)
+
+    def streak(self, username: str, day_index: int) -> int:
+        """Get the number of consecutive days a user claimed on, up to a day."""
+        mask = (1 << (day_index + 1)) - 1
+        missed = ~self.get(username) & mask
+        return day_index + 1 - missed.bit_length()
@@ -0,0 +1,141 @@
+"""Per-key asyncio locks (e.g. one per user).
+
+Keys are hashed onto a fixed table of asyncio.Locks (lock striping), so the number of
+locks stays bounded however many users there are, and different users almost never
+wait on each other. Locks can only be taken with `async with`, so they are always
+released, and a wait that times out reports who holds the lock.
+"""
+
+import asyncio
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+class LockTimeout(asyncio.TimeoutError):
+    pass
+
+
+class LockMetrics:
+    """Counters describing lock contention."""
+
+    def __init__(self):
+        self.acquisitions = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait: float, contended: bool):
+        self.acquisitions += 1
+        self.contended += contended
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self, held: int) -> Dict[str, float]:
+        """Get the current metrics, including the number of held locks."""
+        return {
+            "held": held,
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "timeouts": self.timeouts,
+            "mean_wait": (
+                self.total_wait / self.acquisitions if self.acquisitions else 0.0
+            ),
+            "max_wait": self.max_wait,
+        }
+
+
+@dataclass
+class _Holder:
+    key: str
+    task: Optional[asyncio.Task]
+    since: float
+
+    def describe(self) -> str:
+        name = self.task.get_name() if self.task is not None else "unknown task"
+        return f"{name} (for '{self.key}', {time.monotonic() - self.since:.1f}s)"
+
+
+class _KeyLock:
+    """The `async with` handle of one key's lock."""
+
+    def __init__(self, manager: "LockManager", key: str, timeout: Optional[float]):
+        self._manager = manager
+        self._key = key
+        self._timeout = timeout
+        self._stripe = None
+
+    async def __aenter__(self):
+        self._stripe = await self._manager._acquire(self._key, self._timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._manager._release(self._stripe)
+
+
+class LockManager:
+    """A striped table of asyncio locks keyed by string."""
+
+    def __init__(self, stripes: int = 256, timeout: Optional[float] = 60.0):
+        self.timeout = timeout
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self._holders: Dict[int, _Holder] = {}
+        self.metrics = LockMetrics()
+
+    def _get_stripe(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % len(self._locks)
+
+    def lock(self, key: str, timeout: Optional[float] = None) -> _KeyLock:
+        """Lock a key for the duration of an `async with` block.
+
+        Raises LockTimeout if the lock is not acquired within `timeout` seconds (the
+        manager's default if None).
+        """
+        return _KeyLock(self, key, self.timeout if timeout is None else timeout)
+
+    async def _acquire(self, key: str, timeout: Optional[float]) -> int:
+        stripe = self._get_stripe(key)
+        lock = self._locks[stripe]
+        task = asyncio.current_task()
+
+        # Waiting on a lock this task already holds would never return
+        holder = self._holders.get(stripe)
+        if holder is not None and task is not None and holder.task is task:
+            raise RuntimeError(
+                f"Deadlock: {holder.describe()} tried to lock '{key}' as well."
+            )
+
+        contended = lock.locked()
+        start = time.monotonic()
+        if not contended:
+            # A free lock is taken without yielding to the event loop
+            await lock.acquire()
+        else:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.metrics.timeouts += 1
+                holder = self._holders.get(stripe)
+                held_by = f", held by {holder.describe()}" if holder else ""
+                raise LockTimeout(
+                    f"Timed out after {timeout}s waiting to lock '{key}'{held_by}."
+                )
+
+        now = time.monotonic()
+        self.metrics.record_wait(now - start, contended)
+        self._holders[stripe] = _Holder(key, task, now)
+        return stripe
+
+    def _release(self, stripe: int):
+        del self._holders[stripe]
+        self._locks[stripe].release()
+
+    def held(self) -> List[str]:
+        """Describe the locks that are held, e.g. to diagnose a stuck command."""
+        return [holder.describe() for holder in self._holders.values()]
+
+    def stats(self) -> Dict[str, float]:
+        """Get the contention metrics."""
+        return self.metrics.snapshot(len(self._holders))
@@ -0,0 +1,101 @@
+"""Batch the gifts of many users into single mint transactions.
+
+Mints are queued for up to `window` seconds (or until `max_size` gifts are queued) and
+then sent together with one mintBatch call. Each caller waits on its own future, which
+resolves when the batch's receipt lands.
+
+If a batch provably minted nothing (MintNotSent), its mints are retried one by one, so
+one bad mint does not fail the others. Any other failure fails every mint of the batch,
+since the batch may still have been mined and retrying could mint its gifts twice.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+from .constants import MINT_BATCH_SIZE, MINT_BATCH_WINDOW
+
+
+class MintNotSent(RuntimeError):
+    """A batch that minted nothing (e.g. it reverted or failed gas estimation)."""
+
+
+@dataclass
+class _Mint:
+    addr: str
+    uris: List[str]
+    future: asyncio.Future
+
+
+class MintBatcher:
+    """Accumulate mints and send them in batches."""
+
+    def __init__(
+        self,
+        send_batch: Callable[[List[str], List[str]], Awaitable],
+        window: float = MINT_BATCH_WINDOW,
+        max_size: int = MINT_BATCH_SIZE,
+    ):
+        """`send_batch(recipients, uris)` mints uris[i] to recipients[i]."""
+        self.send_batch = send_batch
+        self.window = window
+        self.max_size = max_size
+        self._queue: List[_Mint] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def mint(self, addr: str, uris: List[str]):
+        """Mint `uris` to `addr`, returning the receipt of the batch it was sent in."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append(_Mint(addr, uris, future))
+
+        if len(self._queue) >= self.max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        """Send the queued mints now."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._queue = self._queue, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[_Mint]):
+        # Skip the mints whose caller has given up while they were queued
+        batch = [mint for mint in batch if not mint.future.done()]
+        if not batch:
+            return
+
+        recipients = [mint.addr for mint in batch for _ in mint.uris]
+        uris = [uri for mint in batch for uri in mint.uris]
+        try:
+            receipt = await self.send_batch(recipients, uris)
+        except MintNotSent as exc:
+            if len(batch) > 1:
+                # Don't let one bad mint fail the whole batch: send them one by one
+                print(f"Batch of {len(batch)} mints failed, retrying alone: {exc}")
+                await asyncio.gather(*(self._send([mint]) for mint in batch))
+                return
+            self._fail(batch, exc)
+            return
+        except Exception as exc:
+            self._fail(batch, exc)
+            return
+
+        for mint in batch:
+            if not mint.future.done():
+                mint.future.set_result(receipt)
+
+    @staticmethod
+    def _fail(batch: List[_Mint], exc: Exception):
+        for mint in batch:
+            if not mint.future.done():
+                mint.future.set_exception(exc)
@@ -1,13 +1,29 @@
 import datetime
-import requests
+import functools
+import os
 import random
 import numpy as np
 
 import discord
 from table2ascii import table2ascii
 
-from .rarity import get_rarity_color, get_rarity_labels, get_short_rarity_labels
-from .constants import VALID_YEAR, OPENSEA_URL
+from .rarity import get_rarity_color, get_short_rarity_labels
+from .constants import VALID_YEAR, OPENSEA_URL, ASSET_DIR
+from .assets import AssetRegistry
+
+# Remembers the URLs of the static images so they are only uploaded once
+asset_registry = AssetRegistry()
+
+
+def get_msg_assets():
+    """Get the paths of the static images used by the messages."""
+    msg_assets = sorted(os.listdir(os.path.join(ASSET_DIR, "msgs")))
+    return [f"assets/msgs/{f}" for f in msg_assets] + ["assets/example/preview.gif"]
+
+
+async def _send(ctx, embedVar, asset_path):
+    """Send an embed with a static image, reusing its URL if it was uploaded before."""
+    await asset_registry.send_embed(ctx.channel, embedVar, asset_path)
 
 
 def days_until_christmas(year: int = VALID_YEAR) -> int:
@@ -38,13 +54,8 @@ async def send_eoe_msg(ctx):
         ",
         color=0xFF0000,
     )
-    # Attach the image
-    santa_rocket_file = discord.File(
-        "assets/msgs/santa_rocket.gif", filename="santa_rocket.gif"
-    )
-    embedVar.set_image(url="attachment://santa_rocket.gif")
     # Send the message
-    await ctx.channel.send(embed=embedVar, file=santa_rocket_file)
+    await _send(ctx, embedVar, "assets/msgs/santa_rocket.gif")
 
 
 async def send_join_msg(ctx, username):
@@ -73,10 +84,8 @@ async def send_impish_msg(ctx):
             If you are admirable, you can check back tomorrow for a new loot box.",
         color=0xFF0000,
     )
-    impish_file = discord.File("assets/msgs/impish.jpg", filename="impish.jpg")
-    embedVar.set_image(url="attachment://impish.jpg")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=impish_file)
+    await _send(ctx, embedVar, "assets/msgs/impish.jpg")
 
 
 async def send_success_msg(ctx, username, preview, revised_prompt):
@@ -93,6 +102,11 @@ async def send_success_msg(ctx, username, preview, revised_prompt):
     await ctx.channel.send(embed=embedVar, file=prev_file)
 
 
+async def send_success_text_msg(ctx, username):
+    """Send the success message without the preview (e.g. if the preview failed)."""
+    await ctx.channel.send(f"Your Gift is available, {username}!")
+
+
 async def send_not_bayesbrew_msg(ctx):
     """Send the not bayesbrew message for creating new users."""
     # Configure the message
@@ -101,10 +115,8 @@ async def send_not_bayesbrew_msg(ctx):
         description="Ah Ah Ah, you didn't say the magic word!",
         color=0xFF0000,
     )
-    stop_file = discord.File("assets/msgs/magic_word.gif", filename="magic_word.gif")
-    embedVar.set_image(url="attachment://magic_word.gif")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=stop_file)
+    await _send(ctx, embedVar, "assets/msgs/magic_word.gif")
 
 
 async def send_created_msg(ctx, username):
@@ -116,10 +128,8 @@ async def send_created_msg(ctx, username):
         Use the `!help` command to get started.",
         color=0x00FF00,
     )
-    santa_file = discord.File("assets/msgs/santa_nft.png", filename="santa_nft.png")
-    embedVar.set_image(url="attachment://santa_nft.png")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=santa_file)
+    await _send(ctx, embedVar, "assets/msgs/santa_nft.png")
 
 
 async def send_addr_msg(ctx, addr):
@@ -132,10 +142,8 @@ async def send_addr_msg(ctx, addr):
         If you are interested in understanding more about Ethereum addresses, ask @bayesbrew!",
         color=0x00873E,
     )
-    eth_file = discord.File("assets/msgs/eth.jpg", filename="eth.jpg")
-    embedVar.set_image(url="attachment://eth.jpg")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=eth_file)
+    await _send(ctx, embedVar, "assets/msgs/eth.jpg")
 
 
 async def send_user_has_account(ctx, username, addr):
@@ -147,10 +155,8 @@ async def send_user_has_account(ctx, username, addr):
         If you are interested in understanding more about Ethereum addresses, ask @bayesbrew!",
         color=0x00FF00,
     )
-    eth_file = discord.File("assets/msgs/eth.jpg", filename="eth.jpg")
-    embedVar.set_image(url="attachment://eth.jpg")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=eth_file)
+    await _send(ctx, embedVar, "assets/msgs/eth.jpg")
 
 
 async def send_admirable_msg(ctx, username, rarity_label, description):
@@ -166,10 +172,8 @@ async def send_admirable_msg(ctx, username, rarity_label, description):
             \n**Generating:**```\n{description}\n```",
         color=get_rarity_color(rarity_label),
     )
-    lootbox_file = discord.File("assets/msgs/loot-box.gif", filename="loot_box.gif")
-    embedVar.set_image(url="attachment://loot_box.gif")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=lootbox_file)
+    await _send(ctx, embedVar, "assets/msgs/loot-box.gif")
 
 
 async def send_users_msg(ctx, accounts):
@@ -231,10 +235,8 @@ async def send_balance_msg(ctx, username, balance, num_nfts, addr):
         Checkout their collection on [OpenSea](https://testnets.opensea.io/{addr}?tab=collected&search[sortBy]=CREATED_DATE&search[sortAscending]=false)",
         color=0x00FF00,
     )
-    money_file = discord.File("assets/msgs/money.png", filename="money.png")
-    embedVar.set_image(url="attachment://money.png")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=money_file)
+    await _send(ctx, embedVar, "assets/msgs/money.png")
 
 
 async def send_nft_dne_msg(ctx, nft_id, addr):
@@ -299,8 +301,10 @@ async def send_transfer_conf_msg(ctx, sender, recipient, nft_id):
     await ctx.channel.send(embed=embedVar)
 
 
-async def send_bot_faq_msg(ctx):
-    embedVar = discord.Embed(
+@functools.lru_cache(maxsize=None)
+def get_bot_faq_embed() -> discord.Embed:
+    """Build the bot FAQ embed (once, it never changes)."""
+    return discord.Embed(
         title="Frequently Asked Questions (bot)",
         description="\
         **Why is this bot so slow?**\n\
@@ -348,12 +352,17 @@ async def send_bot_faq_msg(ctx):
         Great question. 🤷‍♂️ I needed something to do when Katelyn was asleep and I missed coding.",
         color=0x4056AA,
     )
+
+
+async def send_bot_faq_msg(ctx):
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar)
+    await ctx.channel.send(embed=get_bot_faq_embed())
 
 
-async def send_web3_faq_msg(ctx):
-    embedVar = discord.Embed(
+@functools.lru_cache(maxsize=None)
+def get_web3_faq_embed() -> discord.Embed:
+    """Build the web3 FAQ embed (once, it never changes)."""
+    return discord.Embed(
         title="Frequently Asked Questions (web3)",
         description="\
         **What is Ethereum?**\n\
@@ -387,8 +396,11 @@ async def send_web3_faq_msg(ctx):
         If you care, we are using the [Goerli testnet](https://goerli.net/). There are others, but this is the best IMO.\n\n",
         color=0x4056AA,
     )
+
+
+async def send_web3_faq_msg(ctx):
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar)
+    await ctx.channel.send(embed=get_web3_faq_embed())
 
 
 async def send_welcome_msg(ctx):
@@ -403,10 +415,8 @@ async def send_welcome_msg(ctx):
         Use the '!help' or '!faq' commands for more information.\n\n",
         color=0xC54245,
     )
-    preview_file = discord.File("assets/example/preview.gif", filename="preview.gif")
-    embedVar.set_image(url="attachment://preview.gif")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=preview_file)
+    await _send(ctx, embedVar, "assets/example/preview.gif")
 
 
 async def send_invalid_username(ctx, username):
@@ -427,10 +437,8 @@ async def send_error(ctx, username):
         **However, I recovered your credit so feel free to try again!**.",
         color=0xFF0000,
     )
-    elf_file = discord.File("assets/msgs/broken_elf.png", filename="broken_elf.png")
-    embedVar.set_image(url="attachment://broken_elf.png")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=elf_file)
+    await _send(ctx, embedVar, "assets/msgs/broken_elf.png")
 
 
 async def send_mint_error(ctx):
@@ -440,12 +448,8 @@ async def send_mint_error(ctx):
         Contact @bayesbrew and tell him to fix this immediately.",
         color=0xFF0000,
     )
-    elf_file = discord.File(
-        "assets/msgs/sick_reindeer.png", filename="sick_reindeer.png"
-    )
-    embedVar.set_image(url="attachment://sick_reindeer.png")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=elf_file)
+    await _send(ctx, embedVar, "assets/msgs/sick_reindeer.png")
 
 
 async def send_daily_eth_error(ctx):
@@ -456,10 +460,8 @@ async def send_daily_eth_error(ctx):
         Contact @bayesbrew and tell him to fix this immediately.",
         color=0xFF0000,
     )
-    elf_file = discord.File("assets/msgs/santa_hacker.png", filename="santa_hacker.png")
-    embedVar.set_image(url="attachment://santa_hacker.png")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=elf_file)
+    await _send(ctx, embedVar, "assets/msgs/santa_hacker.png")
 
 
 async def send_all_balances_msg(ctx, bals):
@@ -493,19 +495,14 @@ def fmt_probs(pmf):
     return prb_fmt
 
 
-async def send_odds_msg(ctx, week_num, pmf_true, rarities):
+def render_odds_msg(week_num, pmf_true, snapshot) -> str:
+    """Render the true and observed rarity probabilities as a table."""
     # Get the rarity labels
-    rarity_labels = get_rarity_labels()
     shrt_rarity_labels = get_short_rarity_labels()
 
-    # Count the number of each NFT obtained
-    totals = [0 for _ in rarity_labels]
-    for rare_dict in rarities.values():
-        counts = [rare_dict[label] for label in rarity_labels]
-        totals = [t + c for t, c in zip(totals, counts)]
-
-    totalcount = sum(totals)
-    pmf_obs = [t / totalcount for t in totals]
+    # Get the number of each NFT obtained
+    totalcount = snapshot.total_count
+    pmf_obs = snapshot.get_pmf()
 
     # Format the true pmf and observed pmf
     prb_fmt_true = fmt_probs(pmf_true)
@@ -519,54 +516,47 @@ async def send_odds_msg(ctx, week_num, pmf_true, rarities):
         ],
     )
 
+    return f"```Rarity Probs (%) for Week: {week_num+1}\n{output}\nTotal: {totalcount} NFTs\n```"
+
+
+async def send_odds_msg(ctx, week_num, pmf_true, snapshot):
     # Send the message to the channel
-    await ctx.send(
-        f"```Rarity Probs (%) for Week: {week_num+1}\n{output}\nTotal: {totalcount} NFTs\n```"
-    )
+    await ctx.send(render_odds_msg(week_num, pmf_true, snapshot))
 
 
-async def send_rares_msg(ctx, rarities):
-    """Send the current counts for the rarities."""
-    rarity_labels = get_rarity_labels()
+def render_rares_msg(snapshot) -> str:
+    """Render the current counts for the rarities as a table."""
     shrt_rarity_labels = get_short_rarity_labels()
 
-    body = []
-    totals = [0 for _ in rarity_labels]
-    for username, rare_dict in rarities.items():
-        counts = [rare_dict[label] for label in rarity_labels]
-        body.append([username] + counts)
-        totals = [t + c for t, c in zip(totals, counts)]
-
-    body.append(["--TOTALS--"] + totals)
+    body = [[username] + list(counts) for username, counts in snapshot.users.items()]
+    body.append(["--TOTALS--"] + list(snapshot.totals))
 
     output = table2ascii(
         header=["Username"] + shrt_rarity_labels,
         body=body,
     )
-    # Send the message to the channel
-    await ctx.send(f"```\n{output}\n```")
-
+    return f"```\n{output}\n```"
 
-async def send_joke_msg(ctx):
-    try:
-        res = requests.get(
-            "https://v2.jokeapi.dev/joke/Christmas?blacklistFlags=nsfw,religious,political,racist,sexist,explicit"
-        ).json()
 
-        if res["type"] == "single":
-            embedVar = discord.Embed(
-                title=res["joke"],
-                color=0xC54245,
-            )
-        else:
-            embedVar = discord.Embed(
-                title=res["setup"],
-                description=res["delivery"],
-                color=0xC54245,
-            )
-        await ctx.channel.send(embed=embedVar)
-    except Exception as exc:
-        print(exc)
+async def send_rares_msg(ctx, snapshot):
+    """Send the current counts for the rarities."""
+    # Send the message to the channel
+    await ctx.send(render_rares_msg(snapshot))
+
+
+async def send_joke_msg(ctx, joke):
+    if joke["type"] == "single":
+        embedVar = discord.Embed(
+            title=joke["joke"],
+            color=0xC54245,
+        )
+    else:
+        embedVar = discord.Embed(
+            title=joke["setup"],
+            description=joke["delivery"],
+            color=0xC54245,
+        )
+    await ctx.channel.send(embed=embedVar)
 
 
 async def send_recovered_msg(ctx, username):
@@ -581,12 +571,8 @@ async def send_already_voted_msg(ctx, username, team):
             That is, use: `!vote <TEAMNAME> -f`",
         color=0xFF0000,
     )
-    elf_file = discord.File(
-        "assets/msgs/santa-lose-soccer.png", filename="santa-lose-soccer.png"
-    )
-    embedVar.set_image(url="attachment://santa-lose-soccer.png")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=elf_file)
+    await _send(ctx, embedVar, "assets/msgs/santa-lose-soccer.png")
 
 
 async def send_voted_msg(ctx, username, team):
@@ -600,10 +586,8 @@ async def send_voted_msg(ctx, username, team):
     )
     imgname = random.choice([f"santa-soccer{i}.png" for i in range(4)])
 
-    elf_file = discord.File(f"assets/msgs/{imgname}", filename=f"{imgname}")
-    embedVar.set_image(url=f"attachment://{imgname}")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=elf_file)
+    await _send(ctx, embedVar, f"assets/msgs/{imgname}")
 
 
 async def send_votes_msg(ctx, votes):
@@ -640,9 +624,5 @@ async def send_wrong_team_msg(ctx, username, team):
             That is, use: `!vote <TEAMNAME> -f`",
         color=0xFF0000,
     )
-    elf_file = discord.File(
-        "assets/msgs/santa-lose-soccer.png", filename="santa-lose-soccer.png"
-    )
-    embedVar.set_image(url="attachment://santa-lose-soccer.png")
     # Send the message to the channel
-    await ctx.channel.send(embed=embedVar, file=elf_file)
+    await _send(ctx, embedVar, "assets/msgs/santa-lose-soccer.png")
@@ -18,6 +18,16 @@ def get_rarity_labels() -> List[str]:
     ]
 
 
+# Map each rarity label to its level
+RARITY_LEVELS = {label: level for level, label in enumerate(get_rarity_labels())}
+
+# The Poisson mean of the rarity level for each week of the event
+WEEKLY_RARITY_MEANS = [1, 2, 6, 12, 16]
+
+# The rarity distribution used in simulation mode
+UNIFORM_RARITY_PMF = [1 / 48, 2 / 48, 2 / 48, 6 / 48, 12 / 48, 12 / 48, 13 / 48]
+
+
 def get_short_rarity_labels() -> List[str]:
     """Get the list of rarity labels (shortend)."""
     return [
@@ -33,9 +43,7 @@ def get_short_rarity_labels() -> List[str]:
 
 def rarity_label_to_level(rarity_label: str) -> int:
     """Convert a rarity label string to an integer level."""
-    rarity_labels = get_rarity_labels()
-    label_map = {f"{s}": i for i, s in enumerate(rarity_labels)}
-    return label_map[rarity_label.lower()]
+    return RARITY_LEVELS[rarity_label.lower()]
 
 
 def rarity_level_to_label(rarity_level: int) -> str:
@@ -279,8 +287,7 @@ def get_rarity_pmf(week_num: int) -> str:
     ids = np.arange(1, num_labels + 1)
 
     # Get the Poisson mean for this week
-    mus = [1, 2, 6, 12, 16]
-    mu = mus[week_num]
+    mu = WEEKLY_RARITY_MEANS[week_num]
     exp_mu = np.exp(-mu)
 
     # Compute the PMF over this support and normalize to ensure its still a distribution
@@ -304,8 +311,7 @@ def sample_rarity_label_uniform() -> str:
     """Sample a rarity label according to a uniform distribution."""
     # Grab the labels and IDs
     rarity_labels = get_rarity_labels()
-    p = [1 / 48, 2 / 48, 2 / 48, 6 / 48, 12 / 48, 12 / 48, 13 / 48]
-    return np.random.choice(rarity_labels, p=p)
+    return np.random.choice(rarity_labels, p=UNIFORM_RARITY_PMF)
 
 
 def sample_attributes(rarity_label: str) -> Dict[str, str]:
@@ -0,0 +1,61 @@
+"""Cache of rendered responses for the read-only commands.
+
+Each response is cached under a name and a key made of the versions of the state it
+was rendered from (e.g. the rarity aggregates version and the week number). A request
+with a new key replaces the cached response, so writes invalidate it without having to
+notify the cache. Concurrent requests for a response that is still being rendered wait
+for that render instead of starting their own.
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class ResponseCache:
+    """One cached (key, response) per response name, with request coalescing."""
+
+    def __init__(self):
+        self._responses: Dict[str, Tuple[Hashable, Any]] = {}
+        self._pending: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, name: str, key: Hashable, render: Callable[[], Any]) -> Any:
+        """Get the response for (name, key), rendering it in a thread on a miss."""
+        cached = self._responses.get(name)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+
+        # Join a render of the same response that is already running
+        pending = self._pending.get((name, key))
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[(name, key)] = future
+        try:
+            response = await asyncio.to_thread(render)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Nobody may be waiting on the future, so mark its exception as seen
+            future.exception()
+            raise
+        else:
+            future.set_result(response)
+            self._responses[name] = (key, response)
+            return response
+        finally:
+            del self._pending[(name, key)]
+
+    def invalidate(self, name: Optional[str] = None):
+        """Drop one cached response, or all of them."""
+        if name is None:
+            self._responses.clear()
+        else:
+            self._responses.pop(name, None)
@@ -0,0 +1,141 @@
+"""Bulk chain reads with JSON-RPC batch requests.
+
+Balances and token owners of many accounts are read with one batched HTTP request
+instead of one or two round trips per account. Results are cached per block: the batch
+also asks for the block number, and reads are served from the cache until a new block
+may have been mined.
+"""
+
+import threading
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import requests
+from eth_utils import to_checksum_address
+
+# ERC-721 function selectors
+BALANCE_OF = "0x70a08231"
+OWNER_OF = "0x6352211e"
+
+
+class RPCError(RuntimeError):
+    pass
+
+
+def is_revert(error: dict) -> bool:
+    """Check whether an RPC error is an execution revert (rather than a node failure)."""
+    message = str(error.get("message", ""))
+    return error.get("code") == 3 or "revert" in message.lower()
+
+
+def encode_address(addr: str) -> str:
+    return addr.lower().replace("0x", "").rjust(64, "0")
+
+
+def encode_uint(value: int) -> str:
+    return f"{value:064x}"
+
+
+class BulkReader:
+    """Batched, per-block cached reads of ETH balances, NFT balances and owners."""
+
+    def __init__(
+        self,
+        rpc_url: str,
+        contract_address: str,
+        block_time: float = 12.0,
+        max_batch: int = 500,
+        timeout: float = 30.0,
+    ):
+        self.rpc_url = rpc_url
+        self.contract_address = contract_address
+        self.block_time = block_time
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.session = requests.Session()
+
+        self._block: Optional[int] = None
+        self._block_checked = 0.0
+        self._cache: Dict[Hashable, object] = {}
+        self._lock = threading.Lock()
+
+    def batch(self, calls: List[Tuple[str, list]]) -> List[dict]:
+        """Send (method, params) calls as JSON-RPC batches, returning the responses in order."""
+        responses = []
+        for start in range(0, len(calls), self.max_batch):
+            stop = start + self.max_batch
+            payload = [
+                {"jsonrpc": "2.0", "id": start + i, "method": method, "params": params}
+                for i, (method, params) in enumerate(calls[start:stop])
+            ]
+            response = self.session.post(
+                self.rpc_url, json=payload, timeout=self.timeout
+            )
+            if not response.ok:
+                raise RPCError(f"Batch request failed.\n{response.text}")
+
+            # Responses may come back in any order
+            by_id = {r["id"]: r for r in response.json()}
+            responses.extend(by_id[start + i] for i in range(len(payload)))
+        return responses
+
+    def _eth_call(self, data: str) -> Tuple[str, list]:
+        return "eth_call", [{"to": self.contract_address, "data": data}, "latest"]
+
+    def _get_call(self, key: Tuple) -> Tuple[str, list]:
+        kind, arg = key
+        if kind == "eth":
+            return "eth_getBalance", [arg, "latest"]
+        if kind == "nft":
+            return self._eth_call(BALANCE_OF + encode_address(arg))
+        return self._eth_call(OWNER_OF + encode_uint(arg))
+
+    def _decode(self, key: Tuple, response: dict):
+        if "error" in response:
+            # ownerOf reverts for tokens that were never minted, other errors must not be
+            # cached as such
+            error = response["error"]
+            if key[0] == "owner" and is_revert(error):
+                return None
+            raise RPCError(error.get("message", "RPC error"))
+        if key[0] == "owner":
+            return to_checksum_address("0x" + response["result"][-40:])
+        return int(response["result"], 16)
+
+    def read(self, keys: List[Tuple]) -> Dict[Tuple, object]:
+        """Read ("eth", addr), ("nft", addr) and ("owner", token_id) keys."""
+        with self._lock:
+            return self._read(keys)
+
+    def _read(self, keys: List[Tuple]) -> Dict[Tuple, object]:
+        fresh = time.monotonic() - self._block_checked < self.block_time
+        missing = [key for key in keys if not (fresh and key in self._cache)]
+
+        if missing:
+            checked = time.monotonic()
+            calls = [("eth_blockNumber", [])] + [self._get_call(k) for k in missing]
+            responses = self.batch(calls)
+            block = int(responses[0]["result"], 16)
+            values = {k: self._decode(k, r) for k, r in zip(missing, responses[1:])}
+
+            if block != self._block:
+                # A new block: everything cached for the old one is stale
+                self._cache.clear()
+                self._block = block
+                if len(missing) < len(keys):
+                    self._block_checked = 0.0
+                    return self._read(keys)
+            self._cache.update(values)
+            self._block_checked = checked
+
+        return {key: self._cache[key] for key in keys}
+
+    def get_balances(self, addrs: List[str]) -> Dict[str, Tuple[int, int]]:
+        """Get the (wei, number of NFTs) balance of each address."""
+        values = self.read([(kind, addr) for addr in addrs for kind in ("eth", "nft")])
+        return {addr: (values[("eth", addr)], values[("nft", addr)]) for addr in addrs}
+
+    def get_owners(self, token_ids: List[int]) -> Dict[int, Optional[str]]:
+        """Get the owner of each token (None if it does not exist)."""
+        values = self.read([("owner", int(token_id)) for token_id in token_ids])
+        return {token_id: values[("owner", int(token_id))] for token_id in token_ids}
@@ -0,0 +1,224 @@
+"""Precomputed samplers for the rarity levels, attributes and frames.
+
+The distributions never change during the event, so they are compiled once at startup:
+every rarity PMF becomes a Walker/Vose alias table (O(1) per draw) and every attribute
+list is built once per rarity level. All draws come from one seedable
+numpy.random.Generator and can be vectorized with `n`, so the same code serves single
+claims and million-draw simulations.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .constants import SAMPLER_SEED
+from .rarity import (
+    UNIFORM_RARITY_PMF,
+    WEEKLY_RARITY_MEANS,
+    get_ages,
+    get_backgrounds,
+    get_eyes,
+    get_frame_names,
+    get_hats,
+    get_rarity_labels,
+    get_rarity_pmf,
+    get_scarfs,
+    get_styles,
+    get_subjects,
+    get_sweaters,
+    rarity_label_to_level,
+)
+
+# The attributes in the order they are sampled, with their options at a rarity level
+ATTRIBUTE_GETTERS = {
+    "age": lambda rarity_level: get_ages(),
+    "subject": get_subjects,
+    "eyes": get_eyes,
+    "hat": get_hats,
+    "scarf": get_scarfs,
+    "sweater": get_sweaters,
+    "background": lambda rarity_level: get_backgrounds(),
+    "style": lambda rarity_level: get_styles(),
+}
+
+
+class AliasTable:
+    """A Vose alias table for O(1) sampling from a discrete distribution."""
+
+    def __init__(self, pmf: Sequence[float]):
+        pmf = np.asarray(pmf, dtype=np.float64)
+        pmf = pmf / pmf.sum()
+        n = len(pmf)
+
+        prob = np.zeros(n)
+        alias = np.zeros(n, dtype=np.int64)
+        scaled = pmf * n
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, g = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = g
+            scaled[g] -= 1 - scaled[s]
+            if scaled[g] < 1:
+                small.append(g)
+            else:
+                large.append(g)
+
+        # Whatever is left over is 1 up to rounding error
+        for i in small + large:
+            prob[i] = 1
+
+        self.pmf = pmf
+        self.prob = prob
+        self.alias = alias
+
+    def __len__(self) -> int:
+        return len(self.prob)
+
+    def sample(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        """Draw n indices."""
+        # One uniform per draw: the integer part picks the column and the
+        # fractional part decides between the column and its alias
+        u = rng.random(n) * len(self.prob)
+        columns = u.astype(np.int64)
+        keep = (u - columns) < self.prob[columns]
+        return np.where(keep, columns, self.alias[columns])
+
+    def sample_one(self, rng: np.random.Generator) -> int:
+        """Draw a single index (avoids the array overhead of sample)."""
+        u = rng.random() * len(self.prob)
+        column = int(u)
+        return column if u - column < self.prob[column] else int(self.alias[column])
+
+
+class AttributeSampler:
+    """Uniform samplers for every attribute available at one rarity level."""
+
+    def __init__(self, rarity_level: int):
+        self.rarity_level = rarity_level
+        self.options: Dict[str, List[Optional[str]]] = {
+            name: getter(rarity_level) for name, getter in ATTRIBUTE_GETTERS.items()
+        }
+        self.sizes: Dict[str, int] = {
+            name: len(options) for name, options in self.options.items()
+        }
+        self._names = list(self.sizes)
+        self._size_array = np.array(list(self.sizes.values()))
+
+        # Mixed-radix strides, so every combination maps to a unique integer code
+        self.num_combinations = int(np.prod(self._size_array))
+        self._strides = np.cumprod(np.r_[1, self._size_array[:0:-1]])[::-1]
+
+    def sample(self, rng: np.random.Generator, n: int) -> Dict[str, np.ndarray]:
+        """Draw n index arrays, one per attribute (uniform, so no alias table)."""
+        u = rng.random((n, len(self._size_array)))
+        draws = (u * self._size_array).astype(np.int64)
+        return {name: draws[:, i] for i, name in enumerate(self._names)}
+
+    def encode(self, indices: Dict[str, np.ndarray]) -> np.ndarray:
+        """Encode index arrays as integer codes in [0, num_combinations)."""
+        codes = np.zeros(len(indices[self._names[0]]), dtype=np.int64)
+        for name, stride in zip(self._names, self._strides):
+            codes += indices[name] * stride
+        return codes
+
+    def decode(self, codes: np.ndarray) -> Dict[str, np.ndarray]:
+        """Decode integer codes back into index arrays."""
+        codes = np.asarray(codes, dtype=np.int64)
+        return {
+            name: (codes // stride) % size
+            for name, stride, size in zip(self._names, self._strides, self._size_array)
+        }
+
+    def to_attributes(
+        self, indices: Dict[str, np.ndarray], i: int = 0
+    ) -> Dict[str, Optional[str]]:
+        """Look up the attribute values of the i-th draw."""
+        return {
+            name: self.options[name][int(index[i])] for name, index in indices.items()
+        }
+
+
+class LootSampler:
+    """Every rarity, attribute and frame sampler, compiled once."""
+
+    def __init__(self, seed: Optional[int] = SAMPLER_SEED):
+        self.rng = np.random.default_rng(seed)
+        self.rarity_labels = get_rarity_labels()
+        self.rarity_tables = [
+            AliasTable(get_rarity_pmf(week_num))
+            for week_num in range(len(WEEKLY_RARITY_MEANS))
+        ]
+        self.uniform_rarity_table = AliasTable(UNIFORM_RARITY_PMF)
+        self.attribute_samplers = [
+            AttributeSampler(rarity_level)
+            for rarity_level in range(len(self.rarity_labels))
+        ]
+        self.frame_names = [get_frame_names(label) for label in self.rarity_labels]
+
+        # Each rarity level's codes start after the codes of the levels below it
+        self.num_combinations = [s.num_combinations for s in self.attribute_samplers]
+        self.level_offsets = np.cumsum([0] + self.num_combinations[:-1])
+
+    def seed(self, seed: Optional[int]):
+        """Reset the random number generator."""
+        self.rng = np.random.default_rng(seed)
+
+    def sample_rarity_levels(self, week_num: int, n: int) -> np.ndarray:
+        """Draw n rarity levels from this week's PMF."""
+        return self.rarity_tables[week_num].sample(self.rng, n)
+
+    def sample_uniform_rarity_levels(self, n: int) -> np.ndarray:
+        """Draw n rarity levels from the simulation mode distribution."""
+        return self.uniform_rarity_table.sample(self.rng, n)
+
+    def sample_attribute_indices(
+        self, rarity_level: int, n: int
+    ) -> Dict[str, np.ndarray]:
+        """Draw n sets of attribute indices at one rarity level."""
+        return self.attribute_samplers[rarity_level].sample(self.rng, n)
+
+    def sample_codes(self, rarity_levels: np.ndarray) -> np.ndarray:
+        """Draw the attributes for every rarity level and encode them.
+
+        The codes are unique across rarity levels (see level_offsets), so two NFTs
+        have the same rarity and attributes exactly when their codes are equal.
+        """
+        codes = np.empty(len(rarity_levels), dtype=np.int64)
+        for rarity_level, attribute_sampler in enumerate(self.attribute_samplers):
+            mask = rarity_levels == rarity_level
+            n = int(np.count_nonzero(mask))
+            if n == 0:
+                continue
+            indices = attribute_sampler.sample(self.rng, n)
+            codes[mask] = attribute_sampler.encode(indices)
+            codes[mask] += self.level_offsets[rarity_level]
+        return codes
+
+    def sample_rarity_label(self, week_num: int) -> str:
+        """Sample a rarity label based on the PMF for this week."""
+        return self.rarity_labels[self.rarity_tables[week_num].sample_one(self.rng)]
+
+    def sample_rarity_label_uniform(self) -> str:
+        """Sample a rarity label according to the simulation mode distribution."""
+        return self.rarity_labels[self.uniform_rarity_table.sample_one(self.rng)]
+
+    def sample_attributes(self, rarity_label: str) -> Dict[str, Optional[str]]:
+        """Sample the attributes based on the rarity level."""
+        rarity_level = rarity_label_to_level(rarity_label)
+        attribute_sampler = self.attribute_samplers[rarity_level]
+        attributes = {"rarity": rarity_label}
+        attributes.update(
+            attribute_sampler.to_attributes(attribute_sampler.sample(self.rng, 1))
+        )
+        return attributes
+
+    def sample_frame(self, rarity_label: str) -> Optional[str]:
+        """Sample a frame at this rarity level with equal probabilities."""
+        frame_names = self.frame_names[rarity_label_to_level(rarity_label)]
+        return frame_names[self.rng.integers(0, len(frame_names))]
+
+
+# Shared by the bot
+loot_sampler = LootSampler()
@@ -0,0 +1,302 @@
+"""Drop-rate simulator and rarity economy checks.
+
+Run from the repository root:
+    python -m src.simulate counts
+    python -m src.simulate rates --draws 10000000
+    python -m src.simulate collisions --users 100 --trials 200
+    python -m src.simulate chisquare --db state.db
+"""
+
+import argparse
+import math
+import time
+from datetime import date, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .constants import RARITY_LOG, START_WEEK, STATE_DB, VALID_YEAR
+from .ledger import ClaimLedger, get_day_index
+from .rarity import (
+    WEEKLY_RARITY_MEANS,
+    get_rarity_labels,
+    get_rarity_pmf,
+    get_short_rarity_labels,
+)
+from .sampler import LootSampler
+
+NUM_WEEKS = len(WEEKLY_RARITY_MEANS)
+
+
+# ============================================ #
+# Statistics
+# ============================================ #
+def regularized_gamma_q(a: float, x: float) -> float:
+    """The regularized upper incomplete gamma function Q(a, x)."""
+    if x <= 0:
+        return 1.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+
+    if x < a + 1:
+        # Series expansion of P(a, x)
+        term = total = 1 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1 - total * math.exp(log_prefix))
+
+    # Continued fraction for Q(a, x) (modified Lentz)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return h * math.exp(log_prefix)
+
+
+def chi_square_test(
+    observed: Sequence[int], pmf: Sequence[float], min_expected: float = 5
+) -> Tuple[float, int, float]:
+    """Pearson's chi-square goodness of fit test.
+
+    The rarest categories are pooled until every expected count is at least
+    `min_expected`. Returns the statistic, degrees of freedom and p-value.
+    """
+    observed = np.asarray(observed, dtype=np.float64)
+    expected = np.asarray(pmf, dtype=np.float64) * observed.sum()
+
+    # Merge the smallest category into its smaller neighbour until all are large enough
+    obs, exp = list(observed), list(expected)
+    while len(exp) > 2 and min(exp) < min_expected:
+        i = int(np.argmin(exp))
+        j = i - 1 if i == len(exp) - 1 or (i > 0 and exp[i - 1] < exp[i + 1]) else i + 1
+        obs[j] += obs.pop(i)
+        exp[j] += exp.pop(i)
+
+    obs, exp = np.array(obs), np.array(exp)
+    stat = float(np.sum((obs - exp) ** 2 / exp))
+    dof = len(exp) - 1
+    return stat, dof, regularized_gamma_q(dof / 2, stat / 2)
+
+
+# ============================================ #
+# Season helpers
+# ============================================ #
+def get_season_days() -> List[date]:
+    """Get every day of the event."""
+    start = date.fromisocalendar(VALID_YEAR, START_WEEK, 1)
+    return [start + timedelta(days=i) for i in range(7 * NUM_WEEKS)]
+
+
+def get_claims_per_week(ledger: ClaimLedger) -> List[int]:
+    """Count the recorded claims in each week of the event."""
+    start = get_day_index(get_season_days()[0])
+    return [
+        sum(
+            ledger.count(username, start + 7 * week_num, start + 7 * (week_num + 1))
+            for username in ledger.bits
+        )
+        for week_num in range(NUM_WEEKS)
+    ]
+
+
+def get_mixture_pmf(claims_per_week: Sequence[int]) -> np.ndarray:
+    """The expected rarity pmf over claims spread across the weeks."""
+    weights = np.asarray(claims_per_week, dtype=np.float64)
+    pmfs = np.array([get_rarity_pmf(week_num) for week_num in range(NUM_WEEKS)])
+    return weights @ pmfs / weights.sum()
+
+
+def get_collision_pairs(codes: np.ndarray) -> int:
+    """Count the pairs of NFTs sharing the same rarity and attributes."""
+    _, counts = np.unique(codes, return_counts=True)
+    return int(np.sum(counts * (counts - 1) // 2))
+
+
+# ============================================ #
+# Commands
+# ============================================ #
+def print_counts(sampler: LootSampler):
+    """Print the exact number of attribute combinations at each rarity level."""
+    rarity_labels = get_rarity_labels()
+    attribute_names = list(sampler.attribute_samplers[0].sizes)
+
+    columns = "".join(f"{name:>12}" for name in attribute_names)
+    print(f"{'rarity':<20}{columns}{'combinations':>16}")
+    for label, attribute_sampler in zip(rarity_labels, sampler.attribute_samplers):
+        sizes = attribute_sampler.sizes
+        columns = "".join(f"{sizes[name]:>12}" for name in attribute_names)
+        print(f"{label:<20}{columns}{attribute_sampler.num_combinations:>16,}")
+
+    print(f"\nDistinct (rarity, attributes) NFTs: {sum(sampler.num_combinations):,}")
+    print(
+        "Distinct attribute sets (ignoring rarity): "
+        f"{max(sampler.num_combinations):,}"
+    )
+
+
+def print_rates(sampler: LootSampler, draws: int):
+    """Compare Monte Carlo drop rates with the exact pmf for every week."""
+    labels = get_short_rarity_labels()
+    print(f"{'week':<6}" + "".join(f"{label:>16}" for label in labels))
+
+    total_draws = 0
+    start = time.perf_counter()
+    for week_num in range(NUM_WEEKS):
+        levels = sampler.sample_rarity_levels(week_num, draws)
+        sampler.sample_codes(levels)
+        total_draws += draws
+        rates = np.bincount(levels, minlength=len(labels)) / draws
+        pmf = get_rarity_pmf(week_num)
+        columns = "".join(
+            f"{100 * r:>7.3f}/{100 * p:<7.3f}%" for r, p in zip(rates, pmf)
+        )
+        print(f"{week_num + 1:<6}{columns}")
+    elapsed = time.perf_counter() - start
+
+    draws_per_nft = 1 + len(sampler.attribute_samplers[0].sizes)
+    print(
+        f"\nSimulated {total_draws:,} NFTs ({total_draws * draws_per_nft:,} draws) "
+        f"in {elapsed:.2f}s: {total_draws * draws_per_nft / elapsed / 1e6:.1f}M "
+        "draws/s"
+    )
+
+
+def print_collisions(sampler: LootSampler, users: int, trials: int):
+    """Estimate how often two NFTs in a season share the same rarity and attributes."""
+    claims_per_week = [7 * users] * NUM_WEEKS
+    num_claims = sum(claims_per_week)
+
+    # Exact expected number of colliding pairs. Two claims i != j collide with
+    # probability sum_t p_it p_jt / M_t, where p_it is the chance claim i has rarity t
+    # and M_t the number of combinations at rarity t. Summing over pairs gives
+    # sum_t (S_t^2 - Q_t) / (2 M_t) with S_t = sum_i p_it and Q_t = sum_i p_it^2.
+    counts = np.asarray(claims_per_week, dtype=np.float64)
+    pmfs = np.array([get_rarity_pmf(week_num) for week_num in range(NUM_WEEKS)])
+    first, second = counts @ pmfs, counts @ pmfs**2
+    expected_pairs = float(
+        np.sum((first**2 - second) / (2 * np.asarray(sampler.num_combinations)))
+    )
+
+    pairs = np.zeros(trials, dtype=np.int64)
+    for trial in range(trials):
+        levels = np.concatenate(
+            [
+                sampler.sample_rarity_levels(week_num, n)
+                for week_num, n in enumerate(claims_per_week)
+            ]
+        )
+        pairs[trial] = get_collision_pairs(sampler.sample_codes(levels))
+
+    print(f"Season: {users} users x {7 * NUM_WEEKS} days = {num_claims:,} NFTs")
+    print(f"Expected duplicate pairs (exact):     {expected_pairs:.4f}")
+    print(f"P(any duplicate) (Poisson approx.):   {1 - math.exp(-expected_pairs):.4f}")
+    print(f"Duplicate pairs (Monte Carlo, mean):  {pairs.mean():.4f}")
+    print(f"P(any duplicate) (Monte Carlo):       {np.mean(pairs > 0):.4f}")
+
+
+def print_chi_square(db: str, week_num: Optional[int]):
+    """Test the live rarity counts against the drop rates."""
+    # Imported here so the other commands do not need a database
+    from .store import open_store
+
+    # Include the counts the running bots have not flushed yet
+    store = open_store(db, counter_log=RARITY_LOG, read_only=True)
+    try:
+        rarities = store.get_rarities()
+        ledger = store.get_ledger()
+    finally:
+        store.close()
+
+    rarity_labels = get_rarity_labels()
+    observed = [
+        sum(counts.get(label, 0) for counts in rarities.values())
+        for label in rarity_labels
+    ]
+    if sum(observed) == 0:
+        print("No claims recorded.")
+        return
+
+    if week_num is not None:
+        pmf = get_rarity_pmf(week_num)
+        print(f"Expected: week {week_num + 1} pmf")
+    else:
+        claims_per_week = get_claims_per_week(ledger)
+        if sum(claims_per_week) == 0:
+            print("No dated claims in the history, use --week.")
+            return
+        pmf = get_mixture_pmf(claims_per_week)
+        print(f"Expected: pmf mixed over the claims per week {claims_per_week}")
+
+    total = sum(observed)
+    print(f"{'rarity':<20}{'observed':>10}{'expected':>12}")
+    for label, count, p in zip(rarity_labels, observed, pmf):
+        print(f"{label:<20}{count:>10}{total * p:>12.2f}")
+
+    stat, dof, p_value = chi_square_test(observed, pmf)
+    print(f"\nchi2 = {stat:.3f}, dof = {dof}, p = {p_value:.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the rarity economy.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("counts", help="Exact attribute combinations per rarity.")
+
+    rates_parser = subparsers.add_parser("rates", help="Monte Carlo drop rates.")
+    rates_parser.add_argument(
+        "--draws", type=int, default=10_000_000, help="NFTs to draw per week."
+    )
+
+    collisions_parser = subparsers.add_parser(
+        "collisions", help="Duplicate NFT probabilities over a season."
+    )
+    collisions_parser.add_argument(
+        "--users", type=int, default=100, help="Users claiming every day."
+    )
+    collisions_parser.add_argument(
+        "--trials", type=int, default=200, help="Seasons to simulate."
+    )
+
+    chi_parser = subparsers.add_parser(
+        "chisquare", help="Test the live rarity counts against the drop rates."
+    )
+    chi_parser.add_argument("--db", default=STATE_DB, help="Database file.")
+    chi_parser.add_argument(
+        "--week",
+        type=int,
+        choices=range(1, NUM_WEEKS + 1),
+        default=None,
+        help="Week (1-5) to test against (default: mix the weeks of the claims).",
+    )
+
+    args = parser.parse_args()
+    sampler = LootSampler(seed=args.seed)
+
+    if args.command == "counts":
+        print_counts(sampler)
+    elif args.command == "rates":
+        print_rates(sampler, args.draws)
+    elif args.command == "collisions":
+        print_collisions(sampler, args.users, args.trials)
+    elif args.command == "chisquare":
+        print_chi_square(args.db, None if args.week is None else args.week - 1)
+
+
+if __name__ == "__main__":
+    main()
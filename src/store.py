@@ -0,0 +1,620 @@
+"""Persistent game state.
+
+The bot used to keep its state in a handful of JSON files (see backup.sh) that were
+re-read and re-written in full on every claim. The stores in this module keep the same
+data in per-user rows so that a claim only touches the rows it changes.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+from .constants import STATE_DB
+from .counters import CounterLog, WriteBehindCounters
+from .ledger import ClaimLedger, decode_day_hashes, decode_days, encode_days
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY
+);
+-- Legacy claims keyed by hash((year, week, day)), migrated into the ledger on open
+CREATE TABLE IF NOT EXISTS claims (
+    username TEXT NOT NULL REFERENCES users(username),
+    day_hash INTEGER NOT NULL,
+    PRIMARY KEY (username, day_hash)
+);
+CREATE INDEX IF NOT EXISTS claims_by_day ON claims(day_hash);
+CREATE TABLE IF NOT EXISTS ledger (
+    username TEXT PRIMARY KEY REFERENCES users(username),
+    days BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rarities (
+    username TEXT NOT NULL REFERENCES users(username),
+    label TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, label)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class StateStore:
+    """Interface for the bot's persistent state.
+
+    Every method is a single transaction, so a caller never observes (or leaves behind)
+    a claim without its rarity count or vice versa. With write-behind counters, the
+    rarity count is logged along with the claim's transaction and flushed later.
+
+    Subscribers are called with (username, rarity_label, delta) after every committed
+    change to the rarity counters, and with (username, None, 0) when a user is added.
+    """
+
+    def __init__(self):
+        # Whether other processes (e.g. bot shards) change the store too
+        self.shared = False
+        self._subscribers: List[Callable[[str, Optional[str], int], None]] = []
+
+    def subscribe(self, callback: Callable[[str, Optional[str], int], None]):
+        """Call `callback` after every committed rarity change."""
+        self._subscribers.append(callback)
+
+    def _notify(self, username: str, rarity_label: Optional[str], delta: int):
+        for callback in self._subscribers:
+            callback(username, rarity_label, delta)
+
+    def add_user(self, username: str, rarity_labels: List[str]) -> bool:
+        """Add a user with zeroed rarity counters. Returns False if they already exist."""
+        raise NotImplementedError
+
+    def has_user(self, username: str) -> bool:
+        """Check whether a user has joined the game."""
+        raise NotImplementedError
+
+    def has_claimed(self, username: str, day_index: int) -> bool:
+        """Check whether a user has claimed a gift on the given day (see ledger.py)."""
+        raise NotImplementedError
+
+    def record_claim(
+        self,
+        username: str,
+        day_index: int,
+        rarity_label: Optional[str],
+        record_history: bool = True,
+    ) -> bool:
+        """Record a claim and increment its rarity counter together.
+
+        Returns False (and changes nothing) if the user already claimed on this day.
+        """
+        raise NotImplementedError
+
+    def revoke_claim(
+        self, username: str, day_index: int, rarity_label: Optional[str]
+    ) -> bool:
+        """Remove a claim and decrement its rarity counter together.
+
+        Returns False if there was no claim to remove.
+        """
+        raise NotImplementedError
+
+    def increment_rarity(self, username: str, rarity_label: str, delta: int = 1):
+        """Increment the rarity statistic for this user."""
+        raise NotImplementedError
+
+    def decrement_rarity(self, username: str, rarity_label: str):
+        """Decrement the rarity statistic for this user."""
+        self.increment_rarity(username, rarity_label, delta=-1)
+
+    def get_rarities(self) -> Dict[str, Dict[str, int]]:
+        """Get every user's rarity counters (same shape as the old rarities.json)."""
+        raise NotImplementedError
+
+    def get_ledger(self) -> ClaimLedger:
+        """Get a copy of every user's claimed days."""
+        raise NotImplementedError
+
+    def rarity_version(self) -> int:
+        """Changes whenever users or rarity counts are committed to the store.
+
+        Write-behind rarity counts (see counters.py) only change it once flushed.
+        """
+        return 0
+
+    def skip_own_rarity_versions(self, version: int) -> int:
+        """Follow the rarity versions produced by this process's own changes.
+
+        Returns the version reached from `version` without a change of another process,
+        so a reader that already applied its own changes need not reload them.
+        """
+        return version
+
+    def close(self):
+        """Release any resources held by the store."""
+        pass
+
+
+class SQLiteStore(StateStore):
+    """State store backed by a SQLite database in WAL mode.
+
+    With `shared`, several processes (e.g. bot shards) use the database at once, so
+    claims are checked against the database rather than this process's ledger.
+
+    With `counters`, rarity counts are written behind (see counters.py): a background
+    thread flushes them every `counters.flush_interval` seconds, and on close. The
+    `read_counters` are the read-only logs of other processes (e.g. running bots),
+    whose pending counts are added when reading the rarity counts.
+
+    A `read_only` store never writes the database (not even its schema), so it is safe
+    to open next to a running bot.
+    """
+
+    def __init__(
+        self,
+        filename: str = STATE_DB,
+        shared: bool = False,
+        counters: Optional[WriteBehindCounters] = None,
+        read_counters: Sequence[WriteBehindCounters] = (),
+        read_only: bool = False,
+    ):
+        super().__init__()
+        self.filename = filename
+        self.shared = shared
+        self.counters = counters
+        self.read_counters = list(read_counters)
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        self._own_rarity_versions: Dict[int, int] = {}
+        self._bumped_rarity_version: Optional[int] = None
+        if read_only:
+            self._conn = sqlite3.connect(
+                f"file:{filename}?mode=ro",
+                uri=True,
+                timeout=30,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+        else:
+            self._conn = sqlite3.connect(
+                filename, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            with self.transaction() as cur:
+                for statement in SCHEMA.split(";"):
+                    if statement.strip():
+                        cur.execute(statement)
+            self._migrate_claims()
+        self.load_ledger()
+
+        self._closed = threading.Event()
+        self._flusher = None
+        if counters is not None:
+            changes = list(counters.log.replay())
+            counters.recover(
+                changes,
+                int(self.get_meta(counters.flushed_key, "0")),
+                int(self.get_meta(counters.committed_key, "0")),
+            )
+            self.flush()
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name="counter-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def load_ledger(self):
+        """Load the ledger into memory, so checking a claim does not touch the database."""
+        with self._lock:
+            self.ledger = ClaimLedger(
+                {
+                    username: decode_days(days)
+                    for username, days in self._query(
+                        "SELECT username, days FROM ledger"
+                    )
+                }
+            )
+
+    def _migrate_claims(self):
+        """Move the legacy day hashes of the claims table into the ledger."""
+        rows = self._query("SELECT username, day_hash FROM claims")
+        if not rows:
+            return
+
+        day_hashes = {}
+        for username, day_hash in rows:
+            day_hashes.setdefault(username, []).append(day_hash)
+        with self.transaction() as cur:
+            merge_ledger(cur, day_hashes)
+            cur.execute("DELETE FROM claims")
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Run a block of statements atomically."""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+                cur.execute("COMMIT")
+            except BaseException:
+                if self._conn.in_transaction:
+                    cur.execute("ROLLBACK")
+                if self.counters is not None:
+                    self.counters.rollback()
+                raise
+            finally:
+                cur.close()
+                bumped, self._bumped_rarity_version = self._bumped_rarity_version, None
+            if self.counters is not None:
+                self.counters.commit()
+            if bumped is not None:
+                self._own_rarity_versions[bumped] = bumped + 1
+
+    @contextmanager
+    def _snapshot(self) -> Iterator[sqlite3.Cursor]:
+        """Read from one consistent view of the database."""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                yield cur
+            finally:
+                cur.execute("COMMIT")
+                cur.close()
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def add_user(self, username: str, rarity_labels: List[str]) -> bool:
+        with self.transaction() as cur:
+            cur.execute(
+                "INSERT OR IGNORE INTO users (username) VALUES (?)", (username,)
+            )
+            if cur.rowcount == 0:
+                return False
+            cur.executemany(
+                "INSERT INTO rarities (username, label, count) VALUES (?, ?, 0)",
+                [(username, label) for label in rarity_labels],
+            )
+            self._bump_own_rarity_version(cur)
+        self._notify(username, None, 0)
+        return True
+
+    def has_user(self, username: str) -> bool:
+        rows = self._query("SELECT 1 FROM users WHERE username = ?", (username,))
+        return len(rows) > 0
+
+    def has_claimed(self, username: str, day_index: int) -> bool:
+        if self.shared:
+            return (self._get_days(username) >> day_index) & 1 == 1
+        with self._lock:
+            return self.ledger.has_claimed(username, day_index)
+
+    def _get_days(self, username: str) -> int:
+        rows = self._query("SELECT days FROM ledger WHERE username = ?", (username,))
+        return decode_days(rows[0][0]) if rows else 0
+
+    @staticmethod
+    def _set_days(cur: sqlite3.Cursor, username: str, bits: int):
+        cur.execute(
+            "INSERT INTO ledger (username, days) VALUES (?, ?) "
+            "ON CONFLICT (username) DO UPDATE SET days = excluded.days",
+            (username, encode_days(bits)),
+        )
+
+    def record_claim(
+        self,
+        username: str,
+        day_index: int,
+        rarity_label: Optional[str],
+        record_history: bool = True,
+    ) -> bool:
+        # Hold the lock until the ledger is updated, so no one sees a stale ledger
+        with self._lock:
+            with self.transaction() as cur:
+                # Read the days in the transaction, other processes may have changed them
+                bits = self._get_days(username)
+                if record_history:
+                    if (bits >> day_index) & 1:
+                        return False
+                    bits |= 1 << day_index
+                    self._set_days(cur, username, bits)
+                if rarity_label is not None:
+                    self._add_rarity(cur, username, rarity_label, 1)
+            if record_history:
+                self.ledger.set(username, bits)
+            self._flush_if_full()
+        if rarity_label is not None:
+            self._notify(username, rarity_label, 1)
+        return True
+
+    def revoke_claim(
+        self, username: str, day_index: int, rarity_label: Optional[str]
+    ) -> bool:
+        with self._lock:
+            with self.transaction() as cur:
+                bits = self._get_days(username)
+                revoked = (bits >> day_index) & 1 == 1
+                bits &= ~(1 << day_index)
+                if revoked:
+                    self._set_days(cur, username, bits)
+                if rarity_label is not None:
+                    self._add_rarity(cur, username, rarity_label, -1)
+            if revoked:
+                self.ledger.set(username, bits)
+            self._flush_if_full()
+        if rarity_label is not None:
+            self._notify(username, rarity_label, -1)
+        return revoked
+
+    def increment_rarity(self, username: str, rarity_label: str, delta: int = 1):
+        with self._lock:
+            with self.transaction() as cur:
+                self._add_rarity(cur, username, rarity_label, delta)
+            self._flush_if_full()
+        self._notify(username, rarity_label, delta)
+
+    def _add_rarity(
+        self, cur: sqlite3.Cursor, username: str, rarity_label: str, delta: int
+    ):
+        if self.counters is None:
+            cur.execute(
+                "INSERT INTO rarities (username, label, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (username, label) DO UPDATE SET count = count + excluded.count",
+                (username, rarity_label, delta),
+            )
+            self._bump_own_rarity_version(cur)
+            return
+
+        # Log the change before the commit, and mark it as committed in the transaction
+        seq = self.counters.stage(username, rarity_label, delta)
+        self._set_meta(cur, self.counters.committed_key, str(seq))
+
+    @staticmethod
+    def _bump_rarity_version(cur: sqlite3.Cursor):
+        cur.execute(
+            "INSERT INTO meta (key, value) VALUES ('rarity_version', '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def _bump_own_rarity_version(self, cur: sqlite3.Cursor):
+        """Bump the rarity version, remembering it was this process's change."""
+        if self._bumped_rarity_version is None:
+            self._bumped_rarity_version = int(
+                self._get_meta(cur, "rarity_version", "0")
+            )
+            self._bump_rarity_version(cur)
+
+    @staticmethod
+    def _set_meta(cur: sqlite3.Cursor, key: str, value: str):
+        cur.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def _flush_if_full(self):
+        if self.counters is not None and self.counters.full:
+            self.flush()
+
+    def flush(self):
+        """Write the pending rarity counts to the database in one transaction."""
+        with self._lock:
+            if self.counters is None or not self.counters.dirty:
+                return
+            skipped = 0
+            with self.transaction() as cur:
+                for (username, rarity_label), delta in self.counters.pending.items():
+                    # Users are never deleted, but a count must not block the flush
+                    cur.execute(
+                        "INSERT INTO rarities (username, label, count) "
+                        "SELECT ?, ?, ? WHERE EXISTS "
+                        "(SELECT 1 FROM users WHERE username = ?) "
+                        "ON CONFLICT (username, label) "
+                        "DO UPDATE SET count = count + excluded.count",
+                        (username, rarity_label, delta, username),
+                    )
+                    skipped += cur.rowcount == 0
+                self._set_meta(cur, self.counters.flushed_key, str(self.counters.seq))
+                self._bump_own_rarity_version(cur)
+            self.counters.flushed()
+        if skipped:
+            print(f"Skipped the rarity counts of {skipped} unknown users.")
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.counters.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                # The changes stay logged and pending, so the next flush retries them
+                print(f"Failed to flush the rarity counts: {e}")
+
+    def get_rarities(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            # Read the other processes' logs before the database, so a change they
+            # flush in between is not counted twice
+            changes = [list(counters.log.replay()) for counters in self.read_counters]
+            with self._snapshot() as cur:
+                rows = cur.execute(
+                    "SELECT u.username, r.label, r.count FROM users u "
+                    "JOIN rarities r ON r.username = u.username "
+                    "ORDER BY u.rowid, r.rowid"
+                ).fetchall()
+                seqs = [
+                    (
+                        int(self._get_meta(cur, counters.flushed_key, "0")),
+                        int(self._get_meta(cur, counters.committed_key, "0")),
+                    )
+                    for counters in self.read_counters
+                ]
+
+            pending = Counter()
+            if self.counters is not None:
+                pending.update(self.counters.pending)
+            for counters, logged, (flushed_seq, committed_seq) in zip(
+                self.read_counters, changes, seqs
+            ):
+                counters.recover(logged, flushed_seq, committed_seq)
+                pending.update(counters.pending)
+
+        rarities = {}
+        for username, label, count in rows:
+            rarities.setdefault(username, {})[label] = count + pending.get(
+                (username, label), 0
+            )
+        return rarities
+
+    def get_ledger(self) -> ClaimLedger:
+        if self.shared:
+            self.load_ledger()
+        with self._lock:
+            return ClaimLedger(self.ledger.bits)
+
+    def rarity_version(self) -> int:
+        return int(self.get_meta("rarity_version", "0"))
+
+    def skip_own_rarity_versions(self, version: int) -> int:
+        with self._lock:
+            for old in [v for v in self._own_rarity_versions if v < version]:
+                del self._own_rarity_versions[old]
+            while version in self._own_rarity_versions:
+                version = self._own_rarity_versions.pop(version)
+            return version
+
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Get a value from the key/value metadata table."""
+        with self._lock:
+            return self._get_meta(self._conn.cursor(), key, default)
+
+    @staticmethod
+    def _get_meta(
+        cur: sqlite3.Cursor, key: str, default: Optional[str] = None
+    ) -> Optional[str]:
+        rows = cur.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchall()
+        return rows[0][0] if rows else default
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            self.flush()
+            if self.counters is not None:
+                self.counters.log.close()
+            self._conn.close()
+
+
+def open_store(
+    filename: str = STATE_DB,
+    shared: bool = False,
+    counter_log: Optional[str] = None,
+    read_only: bool = False,
+) -> StateStore:
+    """Open the state store used by the bot (`shared` if several processes use it).
+
+    With `counter_log`, rarity counts are written behind through that log. With
+    `read_only`, the database is never written, and the logs of the bots using
+    `counter_log` (one per shard process, `<counter_log>.<index>`) are only read, to
+    include their pending counts, so the store can be used (e.g. by a report) while the
+    bots run.
+    """
+    if read_only:
+        read_counters = []
+        if counter_log is not None:
+            logs = [counter_log] + sorted(glob.glob(f"{glob.escape(counter_log)}.*"))
+            read_counters = [
+                WriteBehindCounters(CounterLog(log, read_only=True)) for log in logs
+            ]
+        return SQLiteStore(
+            filename, shared=shared, read_counters=read_counters, read_only=True
+        )
+    if counter_log is None:
+        return SQLiteStore(filename, shared=shared)
+    counters = WriteBehindCounters(CounterLog(counter_log))
+    return SQLiteStore(filename, shared=shared, counters=counters)
+
+
+def _load_json(filename: str):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def merge_ledger(cur: sqlite3.Cursor, history: Dict[str, List[int]]):
+    """Add legacy day hashes (keyed by username) to the ledger."""
+    for username, day_hashes in history.items():
+        days, unknown = decode_day_hashes(day_hashes)
+        if unknown:
+            print(f"Skipping {len(unknown)} unknown day hashes of {username}.")
+
+        rows = cur.execute(
+            "SELECT days FROM ledger WHERE username = ?", (username,)
+        ).fetchall()
+        bits = decode_days(rows[0][0]) if rows else 0
+        for day_index in days:
+            bits |= 1 << day_index
+        SQLiteStore._set_days(cur, username, bits)
+
+
+def import_json_state(store: SQLiteStore, directory: str = ".") -> Dict[str, int]:
+    """One-shot import of the legacy JSON state files into the store.
+
+    Reads history.json and rarities.json (backed up by backup.sh) from `directory`. The
+    other backed up files (accounts.json, owners.json and next_id) are not imported, as
+    nothing reads them from the store. Missing files are skipped.
+    Everything is imported in a single transaction, and re-running the import is a
+    no-op for rows that already exist.
+    """
+    history = _load_json(os.path.join(directory, "history.json")) or {}
+    rarities = _load_json(os.path.join(directory, "rarities.json")) or {}
+
+    with store.transaction() as cur:
+        usernames = list(history.keys()) + [u for u in rarities if u not in history]
+        cur.executemany(
+            "INSERT OR IGNORE INTO users (username) VALUES (?)",
+            [(username,) for username in usernames],
+        )
+        merge_ledger(cur, history)
+        cur.executemany(
+            "INSERT OR IGNORE INTO rarities (username, label, count) VALUES (?, ?, ?)",
+            [
+                (username, label, count)
+                for username, counts in rarities.items()
+                for label, count in counts.items()
+            ],
+        )
+        SQLiteStore._bump_rarity_version(cur)
+
+    store.load_ledger()
+    return {
+        "users": len(usernames),
+        "claims": sum(len(day_hashes) for day_hashes in history.values()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the bot's state database.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser(
+        "import", help="Import the legacy JSON state files."
+    )
+    import_parser.add_argument("--db", default=STATE_DB, help="Database file.")
+    import_parser.add_argument(
+        "--dir", default=".", help="Directory containing the JSON files."
+    )
+    args = parser.parse_args()
+
+    if args.command == "import":
+        store = SQLiteStore(args.db)
+        print(import_json_state(store, args.dir))
+        store.close()
@@ -0,0 +1,188 @@
+"""Transaction manager for accounts that send many transactions (e.g. the owner).
+
+Nonces are allocated locally so concurrent sends never race on the same nonce, and
+transactions are sent without waiting for the previous one to be mined. A background
+thread polls for receipts and resolves each transaction's future, and re-sends
+transactions that are stuck with a bumped gas price.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from web3.exceptions import TransactionNotFound
+
+
+class TransactionReverted(RuntimeError):
+    """A transaction that was mined but reverted."""
+
+
+@dataclass
+class _Pending:
+    txn: dict
+    future: Future
+    hashes: List[bytes] = field(default_factory=list)
+    sent_at: float = 0.0
+    bumps: int = 0
+
+
+class TransactionManager:
+    """Sign, send and track the transactions of one account."""
+
+    def __init__(
+        self,
+        w3,
+        account,
+        poll_interval: float = 2.0,
+        bump_after: float = 120.0,
+        bump_factor: float = 1.125,
+        max_bumps: int = 5,
+    ):
+        self.w3 = w3
+        self.account = account
+        self.poll_interval = poll_interval
+        self.bump_after = bump_after
+        # Nodes only accept a replacement that pays at least 10% more
+        self.bump_factor = bump_factor
+        self.max_bumps = max_bumps
+
+        self._lock = threading.Lock()
+        self._nonce = None
+        self._pending: Dict[int, _Pending] = {}
+        self._wakeup = threading.Event()
+        self._poller = None
+        self._stopped = False
+
+    @property
+    def address(self) -> str:
+        return self.account.address
+
+    def resync(self):
+        """Reload the next nonce from the node (including its pending transactions)."""
+        with self._lock:
+            self._resync()
+
+    def _resync(self):
+        self._nonce = self.w3.eth.get_transaction_count(self.address, "pending")
+
+    def submit(self, txn: dict) -> Future:
+        """Send a transaction without waiting for it to be mined.
+
+        `txn` must not have a nonce. The returned future resolves to the receipt, or
+        fails if the transaction reverts or is replaced.
+        """
+        txn = dict(txn)
+        if "gasPrice" not in txn and "maxFeePerGas" not in txn:
+            txn["gasPrice"] = self.w3.eth.generate_gas_price()
+
+        pending = _Pending(txn, Future())
+        with self._lock:
+            if self._nonce is None:
+                self._resync()
+            txn["nonce"] = self._nonce
+            try:
+                self._send(pending)
+            except Exception:
+                # The node may know better (e.g. "nonce too low"), so ask it again
+                self._resync()
+                raise
+            self._nonce += 1
+            self._pending[txn["nonce"]] = pending
+
+        self._start_poller()
+        self._wakeup.set()
+        return pending.future
+
+    def send(self, txn: dict, timeout: float = None) -> dict:
+        """Send a transaction and wait for its receipt."""
+        return self.submit(txn).result(timeout=timeout)
+
+    def _send(self, pending: _Pending):
+        signed_txn = self.w3.eth.account.sign_transaction(pending.txn, self.account.key)
+        txn_hash = self.w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+        pending.hashes.append(txn_hash)
+        pending.sent_at = time.monotonic()
+
+    def _bump(self, pending: _Pending):
+        """Re-send a stuck transaction with the same nonce and a higher gas price."""
+        txn = dict(pending.txn)
+        for key in ("gasPrice", "maxFeePerGas", "maxPriorityFeePerGas"):
+            if key in txn:
+                txn[key] = int(txn[key] * self.bump_factor) + 1
+        bumped = _Pending(txn, pending.future, pending.hashes)
+        try:
+            self._send(bumped)
+        except Exception as exc:
+            # e.g. the original was mined meanwhile; the next poll will tell
+            print(f"Could not bump transaction {txn['nonce']}: {exc}")
+            pending.sent_at = time.monotonic()
+            return
+        pending.txn = txn
+        pending.sent_at = bumped.sent_at
+        pending.bumps += 1
+
+    def _get_receipt(self, pending: _Pending):
+        for txn_hash in reversed(pending.hashes):
+            try:
+                receipt = self.w3.eth.get_transaction_receipt(txn_hash)
+            except TransactionNotFound:
+                continue
+            if receipt is not None:
+                return receipt
+        return None
+
+    def poll(self):
+        """Resolve the transactions that were mined and bump the stuck ones."""
+        with self._lock:
+            pending_txns = sorted(self._pending.items())
+        if not pending_txns:
+            return
+
+        mined_nonce = self.w3.eth.get_transaction_count(self.address, "latest")
+        now = time.monotonic()
+        for nonce, pending in pending_txns:
+            receipt = self._get_receipt(pending)
+            if receipt is not None:
+                if receipt["status"] == 1:
+                    pending.future.set_result(receipt)
+                else:
+                    pending.future.set_exception(
+                        TransactionReverted(f"Transaction {nonce} reverted.")
+                    )
+            elif nonce < mined_nonce:
+                # Another transaction (sent elsewhere) used this nonce
+                pending.future.set_exception(
+                    RuntimeError(f"Transaction {nonce} was replaced.")
+                )
+            else:
+                stuck = now - pending.sent_at > self.bump_after
+                if stuck and pending.bumps < self.max_bumps:
+                    with self._lock:
+                        self._bump(pending)
+                continue
+
+            with self._lock:
+                del self._pending[nonce]
+
+    def _start_poller(self):
+        with self._lock:
+            if self._poller is not None or self._stopped:
+                return
+            self._poller = threading.Thread(target=self._run, daemon=True)
+            self._poller.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                self.poll()
+            except Exception as exc:
+                print(f"Could not poll transactions: {exc}")
+
+    def close(self):
+        """Stop polling (pending futures are left unresolved)."""
+        self._stopped = True
+        self._wakeup.set()
@@ -0,0 +1,415 @@
+"""Unique attribute assignment.
+
+Every (rarity, attributes) combination is encoded as an integer (see
+LootSampler.sample_codes) and the issued codes are kept in a roaring-style bitmap:
+the code space is split into chunks of 2^16 codes and each chunk is stored as a sorted
+uint16 array while it is sparse, or as a 8 KiB bitmap once it fills up. That keeps the
+whole 130M code space in a few MB at most, without a Python set of tuples.
+
+Run from the repository root to rebuild the index from the saved NFT metadata:
+    python -m src.uniqueness rebuild
+"""
+
+import argparse
+import fcntl
+import glob
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .constants import ISSUED_INDEX, OUT_DIR
+from .rarity import rarity_label_to_level, rarity_level_to_label
+from .sampler import LootSampler, loot_sampler
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+
+# Array chunks larger than this take more memory than a bitmap chunk (8 KiB)
+ARRAY_MAX = 4096
+
+
+class CombinationBitmap:
+    """A roaring-style set of non-negative integer codes."""
+
+    def __init__(self):
+        self._chunks: Dict[int, np.ndarray] = {}
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, code: int) -> bool:
+        chunk = self._chunks.get(code >> CHUNK_BITS)
+        if chunk is None:
+            return False
+
+        low = code & CHUNK_MASK
+        if chunk.dtype == np.uint16:
+            i = np.searchsorted(chunk, low)
+            return i < len(chunk) and chunk[i] == low
+        return bool((chunk[low >> 6] >> np.uint64(low & 63)) & np.uint64(1))
+
+    def add(self, code: int) -> bool:
+        """Add a code, returning False if it was already in the set."""
+        key, low = code >> CHUNK_BITS, code & CHUNK_MASK
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            self._chunks[key] = np.array([low], dtype=np.uint16)
+        elif chunk.dtype == np.uint16:
+            i = np.searchsorted(chunk, low)
+            if i < len(chunk) and chunk[i] == low:
+                return False
+            chunk = np.insert(chunk, i, low)
+            self._chunks[key] = chunk if len(chunk) <= ARRAY_MAX else _to_bitmap(chunk)
+        else:
+            word, bit = low >> 6, np.uint64(1) << np.uint64(low & 63)
+            if chunk[word] & bit:
+                return False
+            chunk[word] |= bit
+
+        self._count += 1
+        return True
+
+    def remove(self, code: int) -> bool:
+        """Remove a code, returning False if it was not in the set."""
+        if code not in self:
+            return False
+
+        key, low = code >> CHUNK_BITS, code & CHUNK_MASK
+        chunk = self._chunks[key]
+        if chunk.dtype == np.uint16:
+            chunk = np.delete(chunk, np.searchsorted(chunk, low))
+            if len(chunk):
+                self._chunks[key] = chunk
+            else:
+                del self._chunks[key]
+        else:
+            chunk[low >> 6] &= ~(np.uint64(1) << np.uint64(low & 63))
+
+        self._count -= 1
+        return True
+
+    def _free_in_chunk(self, key: int, low: int) -> Optional[int]:
+        """Get the first code >= low missing from a chunk, or None if there is none."""
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            return low
+
+        if chunk.dtype == np.uint16:
+            # The members >= low that are consecutive from low are taken
+            first = np.searchsorted(chunk, low)
+            tail = chunk[first:].astype(np.int64)
+            gaps = np.flatnonzero(tail != low + np.arange(len(tail)))
+            free = low + (gaps[0] if len(gaps) else len(tail))
+        else:
+            bits = np.unpackbits(chunk.view(np.uint8), bitorder="little")
+            zeros = np.flatnonzero(bits[low:] == 0)
+            free = low + zeros[0] if len(zeros) else CHUNK_SIZE
+
+        return int(free) if free < CHUNK_SIZE else None
+
+    def next_free(self, code: int, stop: int) -> Optional[int]:
+        """Get the first code in [code, stop) that is not in the set, or None."""
+        while code < stop:
+            key = code >> CHUNK_BITS
+            free = self._free_in_chunk(key, code & CHUNK_MASK)
+            if free is not None:
+                free += key << CHUNK_BITS
+                return free if free < stop else None
+            code = (key + 1) << CHUNK_BITS
+        return None
+
+    def __iter__(self) -> Iterator[int]:
+        for key in sorted(self._chunks):
+            chunk = self._chunks[key]
+            if chunk.dtype != np.uint16:
+                chunk = _to_array(chunk)
+            yield from (int(low) + (key << CHUNK_BITS) for low in chunk)
+
+    def save(self, filename: str):
+        """Write the set to a file (atomically)."""
+        keys = np.array(sorted(self._chunks), dtype=np.int64)
+        chunks = [self._chunks[key] for key in keys]
+        kinds = np.array([chunk.dtype == np.uint16 for chunk in chunks], dtype=bool)
+        sizes = np.array([chunk.nbytes for chunk in chunks], dtype=np.int64)
+        data = np.concatenate([chunk.view(np.uint8) for chunk in chunks] or [[]])
+
+        tmp_file = f"{filename}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(f, keys=keys, kinds=kinds, sizes=sizes, data=data)
+        os.replace(tmp_file, filename)
+
+    @classmethod
+    def load(cls, filename: str) -> "CombinationBitmap":
+        """Read a set written by save."""
+        bitmap = cls()
+        with np.load(filename) as npz:
+            offsets = np.cumsum(np.r_[0, npz["sizes"]])
+            data = npz["data"].astype(np.uint8)
+            for key, is_array, start, stop in zip(
+                npz["keys"], npz["kinds"], offsets[:-1], offsets[1:]
+            ):
+                dtype = np.uint16 if is_array else np.uint64
+                chunk = data[start:stop].copy().view(dtype)
+                bitmap._chunks[int(key)] = chunk
+                bitmap._count += (
+                    len(chunk)
+                    if is_array
+                    else int(np.unpackbits(chunk.view(np.uint8)).sum())
+                )
+        return bitmap
+
+
+def _to_bitmap(array: np.ndarray) -> np.ndarray:
+    bits = np.zeros(CHUNK_SIZE, dtype=np.uint8)
+    bits[array] = 1
+    return np.packbits(bits, bitorder="little").view(np.uint64)
+
+
+def _to_array(bitmap: np.ndarray) -> np.ndarray:
+    bits = np.unpackbits(bitmap.view(np.uint8), bitorder="little")
+    return np.flatnonzero(bits).astype(np.uint16)
+
+
+class IssuedIndex:
+    """The set of issued combination codes, persisted to disk.
+
+    New codes are appended to `<filename>.log` (one int64 each) as they are issued, and
+    released codes as their bitwise complement (~code, which is negative). The log is
+    folded into the bitmap snapshot by compact().
+
+    With `shared`, several processes (e.g. bot shards) issue codes from the same index:
+    the log is locked while a code is issued, the codes other processes appended are
+    replayed first, and compaction is left to whoever runs when no shard does.
+    """
+
+    def __init__(self, filename: str = ISSUED_INDEX, shared: bool = False):
+        self.filename = filename
+        self.log_file = f"{filename}.log"
+        self.shared = shared
+        self._lock = threading.Lock()
+
+        if os.path.exists(filename):
+            self.bitmap = CombinationBitmap.load(filename)
+        else:
+            self.bitmap = CombinationBitmap()
+
+        # Replay the codes issued since the last snapshot
+        self._log = open(self.log_file, "a+b")
+        with self._locked_log():
+            self._offset = 0
+            self._replay()
+
+            # Drop a partially written code left by a crash
+            self._log.truncate(self._offset)
+
+    @contextmanager
+    def _locked_log(self):
+        """Hold the log's file lock (only needed when it is shared)."""
+        if not self.shared:
+            yield
+            return
+        fcntl.flock(self._log.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._log.fileno(), fcntl.LOCK_UN)
+
+    def _replay(self):
+        """Add the codes appended to the log since it was last read."""
+        size = os.fstat(self._log.fileno()).st_size // 8 * 8
+        if size > self._offset:
+            data = os.pread(self._log.fileno(), size - self._offset, self._offset)
+            for code in np.frombuffer(data, dtype=np.int64):
+                if code >= 0:
+                    self.bitmap.add(int(code))
+                else:
+                    self.bitmap.remove(int(~code))
+            self._offset = size
+
+    def __len__(self) -> int:
+        return len(self.bitmap)
+
+    def __contains__(self, code: int) -> bool:
+        return code in self.bitmap
+
+    def add(self, code: int) -> bool:
+        """Mark a code as issued, returning False if it already was."""
+        with self._lock, self._locked_log():
+            if self.shared:
+                self._replay()
+            if not self.bitmap.add(code):
+                return False
+            self._append(code)
+            return True
+
+    def release(self, code: int) -> bool:
+        """Mark an issued code as free again (e.g. its gift failed)."""
+        with self._lock, self._locked_log():
+            if self.shared:
+                self._replay()
+            if not self.bitmap.remove(code):
+                return False
+            self._append(~code)
+            return True
+
+    def _append(self, record: int):
+        self._log.write(np.int64(record).tobytes())
+        self._log.flush()
+        self._offset += 8
+
+    def next_free(self, code: int, start: int, stop: int) -> Optional[int]:
+        """Get the first unissued code at or after `code`, wrapping within [start, stop)."""
+        with self._lock, self._locked_log():
+            if self.shared:
+                self._replay()
+            free = self.bitmap.next_free(code, stop)
+            if free is None:
+                free = self.bitmap.next_free(start, code)
+            return free
+
+    def compact(self):
+        """Write a new snapshot and empty the log."""
+        with self._lock:
+            self.bitmap.save(self.filename)
+            self._log.truncate(0)
+            self._offset = 0
+
+    def close(self):
+        if not self.shared:
+            self.compact()
+        self._log.close()
+
+
+class UniqueSampler:
+    """Sample attributes that have not been issued yet.
+
+    A draw is made from the usual per-tier distribution and redrawn if it was already
+    issued, so the attributes stay uniform over the unissued combinations of the tier
+    and the rarity levels are untouched. Once the tier is so full that `max_redraws`
+    draws all collide, the last draw is remapped to the next free combination in the
+    tier.
+    """
+
+    def __init__(
+        self,
+        index: IssuedIndex,
+        sampler: LootSampler = loot_sampler,
+        max_redraws: int = 8,
+    ):
+        self.index = index
+        self.sampler = sampler
+        self.max_redraws = max_redraws
+
+    def sample_code(self, rarity_level: int) -> Tuple[int, bool]:
+        """Draw and issue an unissued combination code at a rarity level.
+
+        Returns the code and whether it was issued by this draw (it was not if every
+        combination of the tier was issued already).
+        """
+        attribute_sampler = self.sampler.attribute_samplers[rarity_level]
+        start = int(self.sampler.level_offsets[rarity_level])
+        stop = start + attribute_sampler.num_combinations
+
+        codes = self.sampler.sample_codes(np.full(self.max_redraws, rarity_level))
+        for code in codes:
+            if self.index.add(int(code)):
+                return int(code), True
+
+        free = self.index.next_free(int(codes[-1]), start, stop)
+        if free is None or not self.index.add(free):
+            # Every combination of this tier has been issued
+            rarity_label = rarity_level_to_label(rarity_level)
+            print(f"Every {rarity_label} combination is issued, allowing a duplicate.")
+            return int(codes[-1]), False
+        return free, True
+
+    def sample(
+        self, rarity_label: str
+    ) -> Tuple[Dict[str, Optional[str]], Optional[int]]:
+        """Sample unissued attributes based on the rarity level.
+
+        Returns the attributes and the code they issued, to release it if the gift
+        fails (None if the attributes are a duplicate).
+        """
+        rarity_level = rarity_label_to_level(rarity_label)
+        attribute_sampler = self.sampler.attribute_samplers[rarity_level]
+        code, issued = self.sample_code(rarity_level)
+        index = code - self.sampler.level_offsets[rarity_level]
+
+        attributes = {"rarity": rarity_label}
+        attributes.update(
+            attribute_sampler.to_attributes(attribute_sampler.decode(np.array([index])))
+        )
+        return attributes, code if issued else None
+
+    def sample_attributes(self, rarity_label: str) -> Dict[str, Optional[str]]:
+        """Sample unissued attributes based on the rarity level."""
+        return self.sample(rarity_label)[0]
+
+    def release(self, codes: List[int]):
+        """Free the codes of a gift that failed."""
+        for code in codes:
+            self.index.release(code)
+
+
+def attributes_to_code(
+    attributes: Dict[str, Optional[str]], sampler: LootSampler = loot_sampler
+) -> Optional[int]:
+    """Encode a set of attributes, or None if they are not from the attribute lists."""
+    rarity_level = rarity_label_to_level(attributes["rarity"])
+    attribute_sampler = sampler.attribute_samplers[rarity_level]
+    try:
+        indices = {
+            name: np.array([options.index(attributes.get(name))])
+            for name, options in attribute_sampler.options.items()
+        }
+    except ValueError:
+        return None
+    code = attribute_sampler.encode(indices)[0]
+    return int(code + sampler.level_offsets[rarity_level])
+
+
+def rebuild_index(filename: str, directory: str) -> int:
+    """Rebuild the index from the ERC721 metadata of every saved NFT."""
+    bitmap = CombinationBitmap()
+    for data_file in glob.glob(os.path.join(directory, "*", "*.json")):
+        with open(data_file, "r") as f:
+            metadata = json.load(f)
+
+        attributes = {
+            a["trait_type"]: a["value"] for a in metadata.get("attributes", [])
+        }
+        if "rarity" not in attributes:
+            # Custom descriptions have no attributes
+            continue
+        code = attributes_to_code(attributes)
+        if code is not None:
+            bitmap.add(code)
+
+    bitmap.save(filename)
+    if os.path.exists(f"{filename}.log"):
+        os.remove(f"{filename}.log")
+    return len(bitmap)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the issued combination index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser(
+        "rebuild", help="Rebuild the index from the saved NFT metadata."
+    )
+    rebuild_parser.add_argument("--index", default=ISSUED_INDEX, help="Index file.")
+    rebuild_parser.add_argument(
+        "--dir", default=OUT_DIR, help="Directory containing the NFTs."
+    )
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        count = rebuild_index(args.index, args.dir)
+        print(f"Indexed {count} issued combinations.")
@@ -0,0 +1,193 @@
+"""Render workers.
+
+Framing the artwork and encoding the NFT gif are CPU bound and take several seconds,
+so they run in a pool of worker processes while the bot keeps serving commands.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+from PIL import Image
+from PIL.Image import Image as ImgType
+
+from .artists import add_frame, create_nft_preview, save_nft, save_nft_outputs
+from .frames import preload_frames
+
+
+class RenderQueueFull(RuntimeError):
+    """Raised when the render queue cannot accept any more jobs."""
+
+
+def render_nft(
+    img_file: str,
+    frame_name: Optional[str],
+    nft_file: str,
+    preview_file: Optional[str] = None,
+    thumbnail_file: Optional[str] = None,
+    webp_file: Optional[str] = None,
+) -> Dict[str, str]:
+    """Add the frame to the artwork in `img_file` and save the NFT and its previews.
+
+    The frames are composited once and every output is written from them (see
+    artists.save_nft_outputs). Returns the saved filenames keyed by output.
+    This runs inside a render worker process.
+    """
+    with Image.open(img_file) as image:
+        nft_img = add_frame(image, frame_name)
+    outputs, _ = save_nft_outputs(
+        nft_img, nft_file, preview_file, thumbnail_file, webp_file
+    )
+    return outputs
+
+
+def render_gift_nft(
+    img_file: str,
+    frame_name: Optional[str],
+    nft_file: str,
+    webp_file: Optional[str] = None,
+) -> List[ImgType]:
+    """Render one NFT of a multi-NFT gift and return its preview-size frames.
+
+    This runs inside a render worker process.
+    """
+    with Image.open(img_file) as image:
+        nft_img = add_frame(image, frame_name)
+    _, preview_img = save_nft_outputs(nft_img, nft_file, webp_file=webp_file)
+    return preview_img
+
+
+def render_gift_preview(
+    preview_imgs: List[List[ImgType]],
+    frame_name: Optional[str],
+    preview_file: str,
+    thumbnail_file: Optional[str] = None,
+) -> Dict[str, str]:
+    """Assemble the 2x2 preview of a gift from its NFTs' preview-size frames.
+
+    This runs inside a render worker process.
+    """
+    preview = create_nft_preview(preview_imgs, frame_name)
+    save_nft(preview, preview_file)
+    outputs = {"preview": preview_file}
+
+    if thumbnail_file is not None:
+        preview[0].save(thumbnail_file)
+        outputs["thumbnail"] = thumbnail_file
+
+    return outputs
+
+
+class RenderPool:
+    """A bounded pool of render worker processes.
+
+    At most `max_workers` jobs run at once and up to `max_pending` more wait in the
+    queue. Submitting beyond that raises RenderQueueFull instead of piling up work.
+    If a worker dies (e.g. killed for running out of memory), the jobs it broke fail
+    with BrokenProcessPool and the pool is replaced for the next jobs.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_pending: int = 16,
+        timeout: float = 300,
+        initializer: Optional[Callable] = preload_frames,
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.initializer = initializer
+        self._executor = None
+        self._slots = None
+        self._jobs = 0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """The process pool, created on first use."""
+        if self._executor is None:
+            # Use spawn so the workers do not inherit the bot's sockets and threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.initializer,
+            )
+        return self._executor
+
+    @property
+    def queued(self) -> int:
+        """The number of jobs that are running or waiting for a worker."""
+        return self._jobs
+
+    async def submit(
+        self, func: Callable, *args, timeout: Optional[float] = None
+    ) -> Any:
+        """Run `func(*args)` in a worker process and return its result.
+
+        Raises RenderQueueFull if the queue is full and asyncio.TimeoutError if the job
+        takes longer than `timeout` seconds (default: the pool's timeout). Cancelling
+        the awaiting task cancels the job if it has not started yet.
+        """
+        if self._jobs >= self.max_workers + self.max_pending:
+            raise RenderQueueFull(f"{self._jobs} render jobs are already queued.")
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+        self._jobs += 1
+        try:
+            # Wait for a free worker
+            await self._slots.acquire()
+            try:
+                executor = self.executor
+                try:
+                    future = executor.submit(func, *args)
+                except BrokenProcessPool:
+                    # The pool broke since the last job, retry on a new one
+                    self._reset(executor)
+                    executor = self.executor
+                    future = executor.submit(func, *args)
+            except BaseException:
+                self._slots.release()
+                raise
+
+            # Only free the slot once the worker is really done, even if we stop
+            # waiting on it, so timed-out jobs cannot oversubscribe the pool.
+            loop = asyncio.get_running_loop()
+            slots = self._slots
+
+            def release(_):
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(slots.release)
+
+            future.add_done_callback(release)
+
+            try:
+                return await asyncio.wait_for(
+                    asyncio.wrap_future(future),
+                    timeout=self.timeout if timeout is None else timeout,
+                )
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                future.cancel()
+                raise
+            except BrokenProcessPool:
+                self._reset(executor)
+                raise
+        finally:
+            self._jobs -= 1
+
+    def _reset(self, executor: ProcessPoolExecutor):
+        """Replace a broken process pool (unless that was already done)."""
+        if self._executor is executor:
+            print("A render worker died, restarting the render workers.")
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker processes, cancelling any jobs that have not started."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None